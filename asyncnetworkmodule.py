@@ -0,0 +1,167 @@
+import asyncio
+import logging
+import socket
+import struct
+from networkmodule import ConnModes
+from networkmodule import FailureType
+from networkmodule import headerStruct
+from networkmodule import bufferLengthStruct
+from networkmodule import stampStruct
+from networkmodule import FLAG_TIMESTAMPS
+from networkmodule import maxMessageSize
+from networkmodule import encodeMessage
+from networkmodule import decodePayload
+from networkmodule import decompressPayload
+from networkmodule import TrafficClass
+from networkmodule import tuneSocket
+
+# asyncio flavour of robotNetworkModule. Same framing and FailureType results,
+# but a server can hold any number of peers on one event loop instead of the
+# single blocking client_socket.
+
+
+class asyncRobotPeer:
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.reader = reader
+        self.writer = writer
+        self.address = writer.get_extra_info('peername')
+
+    async def send(self, ObjToSend):
+        return await self.sendEncoded(encodeMessage(ObjToSend))
+
+    async def sendEncoded(self, message):
+        # message is the buffer list from networkmodule.encodeMessage
+        try:
+            self.writer.writelines(message)
+            await self.writer.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            logging.error(f'Connection to {self.address} was closed while sending ->', exc_info=True)
+            return FailureType.CON_CLOSED
+        except socket.error:
+            logging.error(f'Attempting to send data to {self.address} has failed ->', exc_info=True)
+            return FailureType.SOCKET_ERROR
+        return FailureType.NONE
+
+    async def receive(self):
+        try:
+            header = await self.reader.readexactly(headerStruct.size)
+            (length, msgType, bufferCount, flags) = headerStruct.unpack(header)
+            lengths = await self.reader.readexactly(bufferLengthStruct.size * bufferCount)
+            if flags & FLAG_TIMESTAMPS:
+                await self.reader.readexactly(stampStruct.size)  # Round trip stamps aren't tracked here
+            bufferLengths = [bufferLength for (bufferLength,) in bufferLengthStruct.iter_unpack(lengths)]
+            if length + sum(bufferLengths) > maxMessageSize:
+                logging.error(f'Content length -> {length} + {bufferLengths} from {self.address} is larger than {maxMessageSize}. This indicates corrupted/bad data.')
+                return FailureType.UNPACK
+            data = await self.reader.readexactly(length)
+            buffers = []
+            for bufferLength in bufferLengths:
+                buffers.append(await self.reader.readexactly(bufferLength))
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            logging.warning(f'Connection to {self.address} closed abruptly.')
+            return FailureType.CON_CLOSED
+        except socket.error:
+            logging.error(f'Attempting to receive data from {self.address} has failed ->', exc_info=True)
+            return FailureType.SOCKET_ERROR
+
+        try:
+            data, buffers = decompressPayload(flags, data, buffers)
+            return decodePayload(msgType, data, buffers)
+        except (ValueError, struct.error):
+            logging.error(f'Decoding message of type {msgType} has failed. This indicates corrupted/bad data.', exc_info=True)
+            return FailureType.UNPACK
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except socket.error:
+            pass
+
+
+class asyncRobotNetworkModule:
+
+    def __init__(self, mode: ConnModes, address, port, trafficClass: TrafficClass = None) -> None:
+        self.mode = mode
+        self.address = address
+        self.port = port
+        self.trafficClass = trafficClass  # None leaves the sockets as the OS makes them
+        self.peer = None  # Client mode only
+        self.peers = set()  # Server mode only
+        self.server = None
+
+        logging.basicConfig(
+            filename="robotnetworkclient.log" if mode == ConnModes.CLIENT else "robotnetworkserver.log",
+            encoding="utf-8",
+            filemode='a',
+            format="{asctime} - {levelname} - {message}",
+            style="{",
+            datefmt="%Y-%m-%d %H:%M",
+            level=logging.DEBUG,
+        )
+
+    async def connect(self, timeout=10):
+        if self.mode != ConnModes.CLIENT:
+            logging.debug("connect() was called in Server mode. Please check your code.")
+            return FailureType.SOCKET_ERROR
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(self.address, self.port), timeout)
+        except asyncio.TimeoutError:
+            logging.fatal(f'Could not connect to the server at {self.address}:{self.port}')
+            return FailureType.CON_TIMEOUT
+        except socket.error:
+            logging.fatal("A fatal socket error has occured", exc_info=True)
+            return FailureType.SOCKET_ERROR
+        if self.trafficClass is not None:
+            tuneSocket(writer.get_extra_info('socket'), self.trafficClass)
+        self.peer = asyncRobotPeer(reader, writer)
+        return FailureType.NONE
+
+    async def start(self, handler):
+        # Starts listening and returns straight away. handler(peer) is run as
+        # its own task for every client that connects, the peer is closed
+        # once the handler returns.
+        async def onConnect(reader, writer):
+            if self.trafficClass is not None:
+                tuneSocket(writer.get_extra_info('socket'), self.trafficClass)
+            peer = asyncRobotPeer(reader, writer)
+            logging.info(f'Server has accepted a connection from -> {peer.address}')
+            self.peers.add(peer)
+            try:
+                await handler(peer)
+            except Exception:
+                logging.error(f'Handler for {peer.address} failed ->', exc_info=True)
+            finally:
+                self.peers.discard(peer)
+                await peer.close()
+                logging.info(f'Connection from {peer.address} finished.')
+
+        self.server = await asyncio.start_server(onConnect, self.address, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logging.info(f'Server is listening on {self.address}:{self.port}...')
+        return self.server
+
+    async def serve(self, handler):
+        # Like start() but runs until cancelled
+        server = await self.start(handler)
+        async with server:
+            await server.serve_forever()
+
+    async def send(self, ObjToSend):
+        return await self.peer.send(ObjToSend)
+
+    async def receive(self):
+        return await self.peer.receive()
+
+    async def close(self):
+        if self.peer is not None:
+            await self.peer.close()
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    def isFailure(self, check):
+        if isinstance(check, FailureType):
+            return check != FailureType.NONE
+        return False
@@ -0,0 +1,161 @@
+# Replays qualityController against a simulated throttled socket on a virtual
+# clock, so runs are deterministic. The link rate steps down and back up and
+# the controller should settle near targetFps each time.
+# With skipUnchanged the scene is mostly still, like cameraServer's default
+# setup: a full frame every keyframeInterval and on the odd big change,
+# frameTiles for a small moving part in between and repeats when nothing
+# moved, at 1280x720 so a keyframe is more than the socket buffer takes.
+# "full frames only" is that scene with the controller told about full
+# frames alone, the way cameraServer used to.
+# Run from the repo root with: python -m benchmarks.adaptiveQualitySim
+import random
+from cameraPipeline import qualityController
+
+cameraInterval = 1 / 30
+frameSize = (640, 480)
+# (start time in seconds, link rate in bits/s)
+linkSchedule = [(0, 4e6), (20, 1e6), (40, 8e6), (60, 2e6)]
+duration = 80
+keyframeInterval = 2.0
+settleTime = 5  # Seconds after a link change or the first estimate before utilisation has to be under headroom
+tileFraction = 0.1  # Share of the picture a tile update carries
+repeatBytes = 16
+
+
+def jpegBytes(quality, scale, rng, size=frameSize):
+    # Rough JPEG size model, bits per pixel grows with the square of quality.
+    # Fits 640x480 webcam footage at ~30KB for q50.
+    bitsPerPixel = 0.25 + 2.2 * (quality / 100) ** 2
+    pixels = size[0] * size[1] * scale * scale
+    return int(pixels * bitsPerPixel / 8 * rng.uniform(0.9, 1.1))
+
+
+class throttledSocket():
+    # A socket whose send buffer drains at the scheduled link rate. A send
+    # that fits in the free buffer space is (nearly) instant, anything more
+    # blocks until enough has drained, same as sendall.
+
+    def __init__(self, schedule, bufferBytes=65536) -> None:
+        self.schedule = schedule
+        self.bufferBytes = bufferBytes
+        self.backlog = 0.0
+        self.lastTime = 0.0
+
+    def rate(self, now):
+        current = self.schedule[0][1]
+        for start, rate in self.schedule:
+            if now >= start:
+                current = rate
+        return current / 8
+
+    def send(self, now, frameBytes):
+        self.backlog = max(0.0, self.backlog - self.rate(now) * (now - self.lastTime))
+        copyTime = frameBytes / 1e9
+        space = self.bufferBytes - self.backlog
+        if frameBytes <= space:
+            self.backlog += frameBytes
+            wait = 0.0
+        else:
+            wait = (frameBytes - space) / self.rate(now)
+            self.backlog = self.bufferBytes
+        self.lastTime = now + wait + copyTime
+        return wait + copyTime
+
+
+def nextMessage(controller, now, lastKeyframe, rng, size):
+    # (bytes, is a full frame) of what changeEncoder would send next
+    if now - lastKeyframe >= keyframeInterval or rng.random() < 0.03:
+        return jpegBytes(controller.quality, controller.scale, rng, size), True
+    if rng.random() < 0.7:
+        return int(jpegBytes(controller.quality, controller.scale, rng, size) * tileFraction), False
+    return repeatBytes, False
+
+
+def simulate(targetFps=20, seed=1, skipUnchanged=False, reportPartial=True, size=frameSize):
+    rng = random.Random(seed)
+    controller = qualityController(targetFps)
+    sock = throttledSocket(linkSchedule)
+    now = 0.0
+    nextFrame = 0.0
+    lastKeyframe = -keyframeInterval
+    estimatedAt = None
+    windows = []
+    window = {'start': 0, 'frames': 0, 'bytes': 0, 'quality': 0}
+    while now < duration:
+        nextFrame = max(nextFrame + 1 / targetFps, now)
+        if skipUnchanged:
+            frameBytes, fullFrame = nextMessage(controller, now, lastKeyframe, rng, size)
+        else:
+            frameBytes, fullFrame = jpegBytes(controller.quality, controller.scale, rng, size), True
+        if fullFrame:
+            lastKeyframe = now
+        window['quality'] += controller.quality
+        sendTime = sock.send(now, frameBytes)
+        now += sendTime
+        if fullFrame or reportPartial:
+            controller.update(frameBytes, sendTime, now, fullFrame)
+        if estimatedAt is None and controller.bandwidth is not None:
+            estimatedAt = now
+        # Wait for the next camera frame if we're ahead of it, and skip the
+        # ones that come sooner than targetFps allows like cameraServer does
+        now = max(now, (int(now / cameraInterval) + 1) * cameraInterval)
+        while now < nextFrame - 1e-9:
+            now += cameraInterval
+        window['frames'] += 1
+        window['bytes'] += frameBytes
+        if now - window['start'] >= 5:
+            elapsed = now - window['start']
+            linkChange = max(start for start, rate in linkSchedule if start <= window['start'])
+            windows.append({
+                'start': window['start'],
+                'elapsed': elapsed,
+                # Until then the controller hasn't had the chance to find the link rate
+                'settled': estimatedAt is not None and window['start'] - max(linkChange, estimatedAt) >= settleTime,
+                'link_mbps': sock.rate(window['start']) * 8 / 1e6,
+                'fps': window['frames'] / elapsed,
+                'mbps': window['bytes'] * 8 / elapsed / 1e6,
+                'utilisation': window['bytes'] / elapsed / sock.rate(window['start']),
+                'quality': window['quality'] / window['frames'],
+                'scale': controller.scale,
+                'estimate_mbps': (controller.bandwidth or 0) * 8 / 1e6,
+            })
+            window = {'start': now, 'frames': 0, 'bytes': 0, 'quality': 0}
+    return windows
+
+
+def settledUtilisation(windows):
+    # {link change time: share of the link used} over the settled windows
+    # after each change. Averaged over the whole spell rather than per window
+    # as a still scene sends in bursts, one window can get two keyframes.
+    sent = {}
+    for window in windows:
+        if window['settled']:
+            linkChange = max(start for start, rate in linkSchedule if start <= window['start'])
+            used, elapsed = sent.get(linkChange, (0.0, 0.0))
+            sent[linkChange] = (used + window['utilisation'] * window['elapsed'], elapsed + window['elapsed'])
+    return {linkChange: used / elapsed for linkChange, (used, elapsed) in sent.items()}
+
+
+def run():
+    results = {
+        'full frames': simulate(),
+        'skip unchanged 1280x720': simulate(skipUnchanged=True, size=(1280, 720)),
+        'skip unchanged 640x480': simulate(skipUnchanged=True),
+        'skip unchanged 1280x720, full frames only': simulate(skipUnchanged=True, reportPartial=False, size=(1280, 720)),
+    }
+    headroom = qualityController(20).headroom
+    for name, windows in results.items():
+        if 'full frames only' in name:
+            continue  # The old way, kept to compare against
+        for linkChange, utilisation in settledUtilisation(windows).items():
+            assert utilisation <= headroom, f'{name}: {utilisation:.0%} of the link used after {linkChange}s, headroom is {headroom:.0%}'
+    return results
+
+
+if __name__ == "__main__":
+    for name, windows in run().items():
+        print(name)
+        for window in windows:
+            print(f'{window["start"]:5.1f}s link {window["link_mbps"]:4.1f} Mbit/s -> {window["fps"]:5.1f} fps {window["mbps"]:5.2f} Mbit/s '
+                  f'({window["utilisation"] * 100:3.0f}%) quality {window["quality"]:5.1f} scale {window["scale"]} '
+                  f'estimate {window["estimate_mbps"]:5.2f} Mbit/s')
@@ -0,0 +1,62 @@
+# Drives several loopback clients against one asyncRobotNetworkModule server
+# at the same time. The server echoes back a commandData for every telemData
+# it receives, each client checks its own replies.
+# Run from the repo root with: python -m benchmarks.asyncServeBench
+import asyncio
+import time
+from asyncnetworkmodule import asyncRobotNetworkModule
+from networkmodule import ConnModes
+from robotTelemModule import telemData
+from robotTelemModule import commandData
+
+
+async def echoHandler(peer):
+    while True:
+        received = await peer.receive()
+        if isinstance(received, telemData):
+            reply = commandData()
+            reply.ma = int(received.ch1ma)
+            reply.mb = int(received.ch2ma)
+            await peer.send(reply)
+        else:
+            return
+
+
+async def clientSession(port, clientID, messages):
+    client = asyncRobotNetworkModule(ConnModes.CLIENT, "127.0.0.1", port)
+    result = await client.connect()
+    if client.isFailure(result):
+        raise RuntimeError(f'client {clientID} failed to connect: {result}')
+    for i in range(messages):
+        telem = telemData()
+        telem.ch1ma = clientID
+        telem.ch2ma = i
+        await client.send(telem)
+        reply = await client.receive()
+        if client.isFailure(reply) or reply.ma != clientID or reply.mb != i:
+            raise RuntimeError(f'client {clientID} got a bad reply: {reply}')
+    await client.close()
+
+
+async def runAsync(clients, messages):
+    server = asyncRobotNetworkModule(ConnModes.SERVER, "127.0.0.1", 0)
+    await server.start(echoHandler)
+    start = time.perf_counter()
+    await asyncio.gather(*(clientSession(server.port, i, messages) for i in range(clients)))
+    elapsed = time.perf_counter() - start
+    await server.close()
+    return {
+        'clients': clients,
+        'round_trips': clients * messages,
+        'round_trips_per_s': clients * messages / elapsed,
+    }
+
+
+def run(clients=8, messages=2000):
+    return asyncio.run(runAsync(clients, messages))
+
+
+if __name__ == "__main__":
+    for clients in (1, 4, 16):
+        result = run(clients)
+        print(f'{result["clients"]:3} clients {result["round_trips"]:7} round trips {result["round_trips_per_s"]:10.0f}/s')
@@ -0,0 +1,66 @@
+# Fans synthetic frames out through frameBroadcaster to several fast viewers
+# plus one deliberately slow one, and checks the slow viewer only costs
+# itself frames. The "encode" here is done once per frame regardless of the
+# number of viewers, same as cameraServer's broadcast mode.
+# Run from the repo root with: python -m benchmarks.broadcastBench
+import asyncio
+import os
+import time
+from asyncnetworkmodule import asyncRobotNetworkModule
+from networkmodule import ConnModes
+from networkmodule import encodeMessage
+from cameraPipeline import frameBroadcaster
+
+
+async def viewer(port, delay):
+    # Receives until cancelled, sleeping `delay` after each frame
+    client = asyncRobotNetworkModule(ConnModes.CLIENT, "127.0.0.1", port)
+    await client.connect()
+    try:
+        while not client.isFailure(await client.receive()):
+            if delay:
+                await asyncio.sleep(delay)
+    finally:
+        await client.close()
+
+
+async def runAsync(fastViewers, frames, frameSize, fps):
+    broadcaster = frameBroadcaster(queueSize=2)
+    server = asyncRobotNetworkModule(ConnModes.SERVER, "127.0.0.1", 0)
+    await server.start(broadcaster.handleViewer)
+
+    tasks = [asyncio.create_task(viewer(server.port, 0)) for _ in range(fastViewers)]
+    tasks.append(asyncio.create_task(viewer(server.port, 0.1)))
+    while len(broadcaster.viewers) < fastViewers + 1:
+        await asyncio.sleep(0.01)
+
+    frame = bytearray(os.urandom(frameSize))
+    encodeTime = 0.0
+    for _ in range(frames):
+        start = time.perf_counter()
+        message = encodeMessage(frame)
+        encodeTime += time.perf_counter() - start
+        broadcaster.publish(message)
+        await asyncio.sleep(1 / fps)
+    stats = broadcaster.report()
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await server.close()
+    return {
+        'published': frames,
+        'encode_us_per_frame': encodeTime / frames * 1e6,
+        'viewers': stats,
+    }
+
+
+def run(fastViewers=4, frames=150, frameSize=60 * 1024, fps=30):
+    return asyncio.run(runAsync(fastViewers, frames, frameSize, fps))
+
+
+if __name__ == "__main__":
+    result = run()
+    print(f'published {result["published"]} frames, {result["encode_us_per_frame"]:.1f} us framing per frame')
+    for viewer in result['viewers']:
+        print(f'  {viewer["name"]:30} {viewer["rate"]:6.1f} fps {viewer["dropped"]:4} dropped')
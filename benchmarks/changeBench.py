@@ -0,0 +1,90 @@
+# Bytes and encode CPU for sending every frame as a full JPEG versus
+# changeEncoder (tiles / repeat markers), on synthetic 640x480 footage: a
+# parked robot (static scene plus sensor noise) and a small object moving
+# across it. Frames are rebuilt the way cameraServerViewer does and checked
+# against the source so we know the composite stays faithful.
+# Run from the repo root with: python -m benchmarks.changeBench
+import pickle
+import time
+import cv2
+import numpy as np
+from cameraPipeline import changeEncoder
+from cameraPipeline import frameRepeat
+from cameraPipeline import frameTiles
+
+quality = 50
+
+
+def encodeJpeg(image, quality):
+    _, buffer = cv2.imencode('.jpg', image, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    return buffer
+
+
+def syntheticFootage(frames, moving, seed=1):
+    rng = np.random.default_rng(seed)
+    # Smooth-ish background so it compresses like a real scene
+    background = cv2.GaussianBlur(rng.integers(0, 255, (480, 640, 3), dtype=np.uint8), (31, 31), 0)
+    for i in range(frames):
+        frame = background.copy()
+        noise = rng.integers(-2, 3, frame.shape, dtype=np.int16)
+        frame = np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+        if moving:
+            x = (i * 6) % 600
+            cv2.rectangle(frame, (x, 200), (x + 40, 240), (0, 0, 255), -1)
+        yield frame
+
+
+def rebuild(shown, received):
+    if isinstance(received, frameRepeat):
+        return shown
+    if isinstance(received, frameTiles):
+        for x, y, buffer in received.tiles:
+            tile = cv2.imdecode(buffer, 1)
+            shown[y:y + tile.shape[0], x:x + tile.shape[1]] = tile
+        return shown
+    return cv2.imdecode(received, 1)
+
+
+def runCase(moving, frames=300):
+    footage = list(syntheticFootage(frames, moving))
+    encoder = changeEncoder(encodeJpeg, keyframeInterval=2.0)
+
+    fullBytes = 0
+    start = time.process_time()
+    for frame in footage:
+        fullBytes += len(pickle.dumps(encodeJpeg(frame, quality), protocol=5))
+    fullCpu = time.process_time() - start
+
+    changeBytes = 0
+    results = []
+    start = time.process_time()
+    for i, frame in enumerate(footage):
+        # Keyframes on a 30 fps clock rather than however fast this loop runs
+        result = encoder.encode(frame, quality, now=i / 30)
+        changeBytes += len(pickle.dumps(result, protocol=5))
+        results.append(result)
+    changeCpu = time.process_time() - start
+
+    worstError = 0.0
+    shown = None
+    for frame, result in zip(footage, results):
+        shown = rebuild(shown, result)
+        worstError = max(worstError, float(np.abs(shown.astype(np.int16) - frame).mean()))
+    return {
+        'full_kb': fullBytes / 1024,
+        'full_cpu_ms_per_frame': fullCpu / frames * 1000,
+        'change_kb': changeBytes / 1024,
+        'change_cpu_ms_per_frame': changeCpu / frames * 1000,
+        'worst_mean_abs_error': worstError,
+    }
+
+
+def run():
+    return {'parked': runCase(False), 'moving object': runCase(True)}
+
+
+if __name__ == "__main__":
+    for name, result in run().items():
+        print(f'{name:14} full {result["full_kb"]:8.0f} KB {result["full_cpu_ms_per_frame"]:5.2f} ms/frame | '
+              f'changes {result["change_kb"]:8.0f} KB {result["change_cpu_ms_per_frame"]:5.2f} ms/frame | '
+              f'worst error {result["worst_mean_abs_error"]:.2f}')
@@ -0,0 +1,65 @@
+# Compares the fixed-layout telemData/commandData codecs against plain pickle.
+# Run from the repo root with: python -m benchmarks.codecBench
+import pickle
+import timeit
+from robotTelemModule import telemData
+from robotTelemModule import commandData
+from networkmodule import headerStruct
+from networkmodule import encodePayload
+from networkmodule import decodePayload
+
+
+def sampleTelem():
+    telem = telemData()
+    telem.ch1volt = 12.31
+    telem.ch2volt = 12.28
+    telem.ch3volt = 12.3
+    telem.ch1ma = 812.4
+    telem.ch2ma = 640.0
+    telem.ch3ma = 102.8
+    telem.avgVolt = 12.3
+    telem.avgMa = 518.4
+    telem.totalMa = 1555.2
+    telem.timeLeft = 3.12
+    telem.battSize = 6500
+    telem.voltageBatteryPercent = 89.19
+    telem.cpu_usage = 23.5
+    telem.ram_usage = 41.2
+    telem.cpu_temp = 54.0
+    telem.wifiSignal = -61
+    return telem
+
+
+def sampleCommand():
+    command = commandData()
+    command.ma = -60
+    command.mb = 60
+    return command
+
+
+def measure(obj, number=100000):
+    packed = pickle.dumps(obj)
+    msgType, encoded, _ = encodePayload(obj)
+    results = {
+        'pickle_encode_us': timeit.timeit(lambda: pickle.dumps(obj), number=number) / number * 1e6,
+        'pickle_decode_us': timeit.timeit(lambda: pickle.loads(packed), number=number) / number * 1e6,
+        'pickle_wire_bytes': headerStruct.size + len(packed),
+        'codec_encode_us': timeit.timeit(lambda: encodePayload(obj), number=number) / number * 1e6,
+        'codec_decode_us': timeit.timeit(lambda: decodePayload(msgType.value, encoded), number=number) / number * 1e6,
+        'codec_wire_bytes': headerStruct.size + len(encoded),
+    }
+    return results
+
+
+def run():
+    return {
+        'telemData': measure(sampleTelem()),
+        'commandData': measure(sampleCommand()),
+    }
+
+
+if __name__ == "__main__":
+    for name, results in run().items():
+        print(name)
+        for key, value in results.items():
+            print(f'  {key:20} {value:10.2f}')
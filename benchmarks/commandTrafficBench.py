@@ -0,0 +1,135 @@
+# Command traffic over a scripted drive session, with robot-local-main.py
+# and a fakeMcu set up like robotLoopBench. The client plays gui-client's
+# robotLoop: keys sampled every commandInterval, commands handed to a
+# networkWorker.
+#  - every tick: a command every tick, the robot writes each one to the MCU
+#    (motorRefresh 0), the way both used to work
+#  - on change: a command only when it changes plus the worker's keepalive,
+#    the robot skips unchanged MCU writes
+# Reported per minute of driving: commands over the network, motor frames
+# and all frames over serial. Also checked: the MCU held the right duties at
+# the end of every segment, and once the client stalls (connected but
+# sending nothing) the robot stops the motors after commandTimeout.
+# Linux/macOS only (needs a pty). Uses port 4421 like the robot does.
+# Run from the repo root with: python -m benchmarks.commandTrafficBench
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from robotTelemModule import commandData
+from networkworker import networkWorker
+from benchmarks.fakeMcu import fakeMcu
+from benchmarks.robotLoopBench import robotMain
+from benchmarks.robotLoopBench import writeConfig
+from benchmarks.robotLoopBench import connect
+
+commandInterval = 0.02
+keepaliveInterval = 0.25
+commandTimeout = 1.0
+# (seconds, ma, mb), what deriveControl would come up with for a short drive
+driveScript = (
+    (2.0, 0, 0),
+    (4.0, -60, 60),
+    (1.5, -60, -60),
+    (3.0, -120, 120),
+    (2.0, 0, 0),
+    (1.0, 60, 60),
+    (2.5, 60, -60),
+    (1.5, -60, 60),
+)
+
+
+def drive(worker, mcu, onChange):
+    # Returns how many segments ended with the MCU on other duties
+    mismatched = 0
+    lastCommand = None
+    nextTick = time.perf_counter()
+    for seconds, ma, mb in driveScript:
+        segmentEnd = nextTick + seconds
+        while nextTick < segmentEnd:
+            if not onChange or (ma, mb) != lastCommand:
+                command = commandData()
+                command.ma = ma
+                command.mb = mb
+                worker.outgoing.put(command)
+                lastCommand = (ma, mb)
+            nextTick += commandInterval
+            time.sleep(max(0.0, nextTick - time.perf_counter()))
+        if mcu.duties != {"ma": ma, "mb": mb}:
+            mismatched += 1
+    return mismatched
+
+
+def runCase(onChange):
+    directory = tempfile.mkdtemp(prefix="commandTrafficBench-")
+    mcu = fakeMcu()
+    timing = {'commandTimeout': commandTimeout, 'motorRefresh': 0.5 if onChange else 0}
+    writeConfig(directory, mcu.path, 20, 20, False, timing)
+    with open(os.path.join(directory, "robot.out"), 'w') as output:
+        robot = subprocess.Popen([sys.executable, robotMain], cwd=directory, stdout=output, stderr=subprocess.STDOUT)
+    client = connect(robot, False)
+    if client is None:
+        robot.kill()
+        mcu.close()
+        shutil.rmtree(directory)
+        raise RuntimeError("robot-local-main.py did not accept a connection")
+    worker = networkWorker(client, keepalive=keepaliveInterval if onChange else None)
+    while worker.lastReceived is None and robot.poll() is None:
+        time.sleep(0.01)
+    time.sleep(1.5)  # The robot starts the MCU in this time
+
+    sentBefore = client.stats.messagesSent
+    motorBefore = len(mcu.motorLog)
+    serialBefore = mcu.requestsSeen
+    start = time.perf_counter()
+    mismatched = drive(worker, mcu, onChange)
+    minutes = (time.perf_counter() - start) / 60
+    commands = client.stats.messagesSent - sentBefore
+    motorFrames = len(mcu.motorLog) - motorBefore
+    serialFrames = mcu.requestsSeen - serialBefore
+
+    # Stall: the connection stays up but nothing more is sent
+    worker.stop()
+    stalled = time.perf_counter()
+    command = commandData()
+    command.ma = 90
+    command.mb = 90
+    client.sendPyObject(command)  # Still driving when it stalls
+    time.sleep(commandTimeout + 0.5)
+    stoppedAfter = None
+    for arrived, ma, mb in mcu.motorLog:
+        if arrived > stalled and ma == 0 and mb == 0:
+            stoppedAfter = arrived - stalled
+            break
+
+    client.server_socket.close()
+    time.sleep(0.2)
+    robot.terminate()
+    robot.wait()
+    mcu.close()
+    shutil.rmtree(directory)
+    return {
+        'commands_per_min': commands / minutes,
+        'motor_frames_per_min': motorFrames / minutes,
+        'serial_frames_per_min': serialFrames / minutes,
+        'keepalives_per_min': worker.keepalivesSent / minutes,
+        'segments_mismatched': mismatched,
+        'stall_stop_s': stoppedAfter,
+    }
+
+
+def run():
+    return {'every tick': runCase(False), 'on change': runCase(True)}
+
+
+if __name__ == "__main__":
+    print(f'{sum(segment[0] for segment in driveScript):.0f} s drive in {len(driveScript)} segments, '
+          f'{commandInterval * 1000:.0f} ms ticks, keepalive {keepaliveInterval} s, robot commandTimeout {commandTimeout} s')
+    for name, result in run().items():
+        stop = result['stall_stop_s']
+        print(f'{name:10} {result["commands_per_min"]:6.0f} commands/min ({result["keepalives_per_min"]:.0f} keepalives)  '
+              f'{result["motor_frames_per_min"]:6.0f} motor frames/min  {result["serial_frames_per_min"]:6.0f} serial frames/min  '
+              f'{result["segments_mismatched"]} segments ended on wrong duties  '
+              f'stall stopped the motors after {"never" if stop is None else f"{stop:.2f} s"}')
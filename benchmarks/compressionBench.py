@@ -0,0 +1,89 @@
+# What payload compression costs in CPU and saves in bytes, per payload kind
+# and per codec (lz4/zstd only when installed). Each message goes through
+# encodeMessage/decodeMessage exactly as robotNetworkModule sends it, at the
+# default threshold. "telemetry, no threshold" forces compression on to show
+# what the threshold saves. link_ms adds the time the bytes take on a Wi-Fi
+# link doing linkRate, so a codec is worth it where that total goes down.
+# Run from the repo root with: python -m benchmarks.compressionBench
+import random
+import numpy as np
+from networkmodule import Compression
+from networkmodule import FLAG_COMPRESSION
+from networkmodule import headerStruct
+from networkmodule import compressors
+from networkmodule import compressThreshold
+from networkmodule import encodeMessage
+from networkmodule import decodeMessage
+from benchmarks.codecBench import sampleTelem
+from benchmarks.jpegBench import syntheticFrame
+from benchmarks.jpegBench import encodeJpeg
+from benchmarks.jpegBench import timeIt
+
+linkRate = 10e6 / 8  # Bytes/s, about what the robot's Wi-Fi manages next to video
+
+
+def powerHistory(seconds=30, rate=20, seed=1):
+    # Like a sampleRing dump, noisy INA3221 readings don't compress well
+    rng = np.random.default_rng(seed)
+    base = np.array([12.3, 400.0, 12.3, 400.0, 12.3, 120.0])
+    return base + rng.normal(0, [0.004, 3.0, 0.004, 3.0, 0.004, 3.0], (seconds * rate, 6))
+
+
+def logText(size=256 * 1024, seed=1):
+    # robotlocal.log style lines
+    rng = random.Random(seed)
+    lines = []
+    total = 0
+    while total < size:
+        line = (f'2026-10-18 08:{rng.randint(0, 59):02} - INFO - Link: {rng.uniform(19, 21):.1f} msgs/s out '
+                f'({rng.uniform(2, 4):.1f} kB/s), {rng.uniform(3, 50):.1f} msgs/s in, rtt p50 {rng.uniform(1, 9):.1f} ms '
+                f'p99 {rng.uniform(5, 80):.1f} ms, send blocked {rng.uniform(0, 2):.1f} ms max')
+        lines.append(line)
+        total += len(line) + 1
+    return '\n'.join(lines)
+
+
+def payloads():
+    frame = syntheticFrame(640, 480)
+    return {
+        'telemetry': (sampleTelem(), compressThreshold),
+        'telemetry, no threshold': (sampleTelem(), 0),
+        'power history 30 s': (powerHistory(), compressThreshold),
+        'jpeg 1280x720 q80': (encodeJpeg(syntheticFrame(1280, 720), 80), compressThreshold),
+        'raw frame 640x480': (frame, compressThreshold),
+        'log 256 KB': (logText(), compressThreshold),
+    }
+
+
+def measure(obj, compression, threshold, repeat):
+    message = encodeMessage(obj, None, compression, threshold)
+    joined = b''.join(message)
+    (_, _, _, flags) = headerStruct.unpack_from(joined)
+    encodeTime = timeIt(lambda: encodeMessage(obj, None, compression, threshold), repeat)
+    decodeTime = timeIt(lambda: decodeMessage(joined), repeat)
+    return {
+        'wire_bytes': len(joined),
+        'compressed': bool(flags & FLAG_COMPRESSION),
+        'encode_ms': encodeTime * 1000,
+        'decode_ms': decodeTime * 1000,
+        'link_ms': (encodeTime + decodeTime + len(joined) / linkRate) * 1000,
+    }
+
+
+def run(repeat=30):
+    codecs = [Compression.NONE] + [compression for compression in Compression if compression in compressors]
+    results = {}
+    for name, (obj, threshold) in payloads().items():
+        results[name] = {compression.name.lower(): measure(obj, compression, threshold, repeat) for compression in codecs}
+    return results
+
+
+if __name__ == "__main__":
+    missing = [compression.name.lower() for compression in Compression if compression != Compression.NONE and compression not in compressors]
+    print(f'Link at {linkRate * 8 / 1e6:.0f} Mbit/s, threshold {compressThreshold} bytes' + (f', not installed: {", ".join(missing)}' if missing else ''))
+    for name, cases in run().items():
+        print(name)
+        for codec, result in cases.items():
+            print(f'  {codec:5} {result["wire_bytes"]:9} bytes  {"compressed" if result["compressed"] else "as is     "}  '
+                  f'encode {result["encode_ms"]:7.3f} ms  decode {result["decode_ms"]:7.3f} ms  '
+                  f'with the link {result["link_ms"]:8.2f} ms')
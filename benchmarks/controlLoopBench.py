@@ -0,0 +1,168 @@
+# Command-to-actuation latency for the old lockstep robot loop versus the
+# decoupled command/telemetry loops in robot-local-main.py. The MCU is faked
+# with the same fixed sleeps mcuControl does per message, the network is a
+# real robotNetworkModule pair over loopback. The operator changes the motor
+# command at random times, latency is from that change until the fake MCU
+# sees the new duty.
+# Two client styles: "gui" sends one command per telemetry message received
+# like gui-client.py does, "fixed" sends commands at 50 Hz on its own.
+# Run from the repo root with: python -m benchmarks.controlLoopBench
+import random
+import threading
+import time
+from robotTelemModule import telemData
+from robotTelemModule import commandData
+from benchmarks.loopback import loopbackPair
+from benchmarks.loopback import closePair
+from latestslot import latestSlot
+
+mcuDelay = 1. / 120  # What mcuControl sleeps after every read and write
+telemetryRate = 20.0
+
+
+class fakeMcu():
+
+    def __init__(self) -> None:
+        self.lastHeartBeatMs = 0
+        self.dutySeen = {}  # duty -> time the MCU first got it
+
+    def sendMessage(self, message):
+        if message.startswith('ma '):
+            self.dutySeen.setdefault(int(message[3:]), time.perf_counter())
+        time.sleep(mcuDelay)
+
+    def readMessage(self):
+        time.sleep(mcuDelay)
+        return "heartbeat"
+
+    def heartBeat(self):
+        if (round(time.time() * 1000) - self.lastHeartBeatMs) > 150:
+            self.sendMessage("heartbeat")
+            self.readMessage()
+        self.lastHeartBeatMs = round(time.time() * 1000)
+
+    def getPower(self):
+        self.sendMessage("pwr")
+        return self.readMessage()
+
+
+def lockstepRobot(rnm, mcu, stop):
+    # The loop robot-local-main.py had before
+    while not stop.is_set():
+        mcu.heartBeat()
+        mcu.getPower()
+        if rnm.isFailure(rnm.sendPyObject(telemData())):
+            return
+        result = rnm.receivePyObject()
+        if rnm.isFailure(result):
+            return
+        mcu.sendMessage(f'ma {result.ma}')
+        mcu.sendMessage(f'mb {result.mb}')
+        mcu.heartBeat()
+
+
+def decoupledRobot(rnm, mcu, stop):
+    # Same shape as commandLoop/actuationLoop/telemetryLoop in robot-local-main.py
+    mcuLock = threading.Lock()
+
+    latestCommand = latestSlot()
+
+    def commands():
+        while not stop.is_set():
+            result = rnm.receivePyObject()
+            if rnm.isFailure(result):
+                return
+            latestCommand.put(result)
+
+    def actuation():
+        while not stop.is_set():
+            command = latestCommand.take(timeout=0.5)
+            if command is None:
+                continue
+            with mcuLock:
+                mcu.sendMessage(f'ma {command.ma}')
+                mcu.sendMessage(f'mb {command.mb}')
+
+    threading.Thread(target=commands, daemon=True).start()
+    threading.Thread(target=actuation, daemon=True).start()
+    interval = 1.0 / telemetryRate
+    nextTick = time.perf_counter()
+    while not stop.is_set():
+        with mcuLock:
+            mcu.heartBeat()
+            mcu.getPower()
+        if rnm.isFailure(rnm.sendPyObject(telemData())):
+            return
+        now = time.perf_counter()
+        nextTick = max(nextTick + interval, now)
+        stop.wait(nextTick - now)
+
+
+class operator():
+    # Changes the duty at random times (about 10 a second) regardless of when
+    # the client looks, remembers when each change happened
+    def __init__(self, seed=1) -> None:
+        self.rng = random.Random(seed)
+        self.duty = 0
+        self.changed = {}
+        self.nextChange = time.perf_counter()
+
+    def current(self):
+        now = time.perf_counter()
+        while now >= self.nextChange:
+            self.duty = (self.duty % 250) + 1
+            self.changed[self.duty] = self.nextChange
+            self.nextChange += self.rng.expovariate(10)
+        return self.duty
+
+
+def runCase(robotLoop, clientStyle, duration=5.0):
+    server, client = loopbackPair()
+    mcu = fakeMcu()
+    stop = threading.Event()
+    robotThread = threading.Thread(target=robotLoop, args=(server, mcu, stop), daemon=True)
+    robotThread.start()
+
+    person = operator()
+    sent = 0
+    end = time.perf_counter() + duration
+    nextSend = time.perf_counter()
+    while time.perf_counter() < end:
+        if clientStyle == "gui":
+            if client.isFailure(client.receivePyObject()):
+                break
+        else:
+            delay = nextSend - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            nextSend += 1 / 50
+        command = commandData()
+        command.ma = person.current()
+        client.sendPyObject(command)
+        sent += 1
+    stop.set()
+    closePair(server, client)
+    robotThread.join(2)
+
+    latencies = sorted(mcu.dutySeen[duty] - changed for duty, changed in person.changed.items() if duty in mcu.dutySeen)
+    return {
+        'commands_per_s': sent / duration,
+        'changes': len(person.changed),
+        'actuated': len(latencies),
+        'p50_ms': latencies[len(latencies) // 2] * 1000 if latencies else 0.0,
+        'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0.0,
+    }
+
+
+def run():
+    results = {}
+    for loopName, loop in (("lockstep", lockstepRobot), ("decoupled", decoupledRobot)):
+        for style in ("gui", "fixed"):
+            results[f'{loopName}/{style}'] = runCase(loop, style)
+    return results
+
+
+if __name__ == "__main__":
+    for name, result in run().items():
+        print(f'{name:16} {result["commands_per_s"]:6.1f} commands/s {result["actuated"]:3}/{result["changes"]:3} changes actuated, '
+              f'latency p50 {result["p50_ms"]:7.1f} ms p99 {result["p99_ms"]:7.1f} ms')
@@ -0,0 +1,181 @@
+# Pretends to be the ESP32 on the far end of a pseudo terminal so
+# mcuControl can be driven through a real serial port without the hardware.
+# Speaks the binary frames from robotMcuModule.py the way microcontroller.ino
+# does (or the old text lines with textProtocol=True), including pushing
+# power readings at a fixed rate once asked to, and keeps the last motor
+# duties it was sent. Like the sketch it stops the motors when nothing has
+# been heard for heartbeatExpiry seconds.
+# Readings are powerReading plus, optionally, current drawn by the motors
+# and gaussian sensor noise. Faults can be injected: replies with a flipped
+# bit (corruptRate) and random bytes between frames (garbageRate).
+# Linux/macOS only (needs a pty).
+import os
+import random
+import select
+import threading
+import time
+import tty
+from robotMcuModule import McuMsg
+from robotMcuModule import frameParser
+from robotMcuModule import requestSizes
+from robotMcuModule import encodeFrame
+from robotMcuModule import powerStruct
+from robotMcuModule import motorStruct
+from robotMcuModule import streamStruct
+from robotMcuModule import maxDuty
+
+powerReading = (12.31, 402.5, 12.30, 398.25, 12.29, 405.0)
+
+
+class fakeMcu():
+
+    def __init__(self, baudrate=115200, processingDelay=0.0005, textProtocol=False, corruptRate=0.0, seed=1, sampleDelay=0.0,
+                 garbageRate=0.0, voltageNoise=0.0, currentNoise=0.0, motorLoadMa=0.0, heartbeatExpiry=1.0) -> None:
+        self.baudrate = baudrate  # Replies are held back as long as they'd take on the wire, None for instant
+        self.processingDelay = processingDelay  # Time the sketch spends per request before answering
+        self.sampleDelay = sampleDelay  # Time reading the INA3221 takes, on top of processingDelay
+        self.textProtocol = textProtocol
+        self.corruptRate = corruptRate  # Chance each reply has one byte flipped on the way back
+        self.garbageRate = garbageRate  # Chance each reply is preceded by a few random bytes
+        self.voltageNoise = voltageNoise  # Standard deviation added to the readings, volts
+        self.currentNoise = currentNoise  # and mA
+        self.motorLoadMa = motorLoadMa  # Extra current per channel with both motors at full duty
+        self.heartbeatExpiry = heartbeatExpiry
+        self.rng = random.Random(seed)
+        self.duties = {"ma": 0, "mb": 0}
+        self.motorLog = []  # (perf_counter, ma, mb) for every motor frame as it finishes arriving
+        self.lastHeard = time.perf_counter()
+        self.expired = False
+        self.expiries = 0
+        self.requestsSeen = 0
+        self.repliesCorrupted = 0
+        self.garbageBursts = 0
+        self.pushInterval = 0.0
+        self.nextPush = 0.0
+        self.pushes = 0
+        self.parser = frameParser(requestSizes)
+        self.partialLine = b''
+        self.master, self.slave = os.openpty()
+        tty.setraw(self.slave)
+        self.path = os.ttyname(self.slave)
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def wireTime(self, byteCount):
+        if self.baudrate is None:
+            return 0.0
+        return byteCount * 10 / self.baudrate  # 8N1, 10 bits a byte
+
+    def textReply(self, line: str):
+        self.heard()
+        if line.startswith("heartbeat"):
+            return "heartbeat\r\n".encode('utf-8')  # Serial.println ends lines with \r\n
+        if line.startswith("pwr"):
+            time.sleep(self.sampleDelay)
+            return (" ".join(f'{value:.2f}' for value in self.reading()) + "\r\n").encode('utf-8')
+        if line.startswith("ma") or line.startswith("mb"):
+            try:
+                self.duties[line[:2]] = int(line[3:])
+            except ValueError:
+                pass
+        return None
+
+    def reading(self):
+        # What the INA3221 would say right now
+        load = self.motorLoadMa * (abs(self.duties["ma"]) + abs(self.duties["mb"])) / (2 * maxDuty)
+        values = []
+        for channel in range(3):
+            volts, milliamps = powerReading[channel * 2], powerReading[channel * 2 + 1] + load
+            volts += self.rng.gauss(0.0, self.voltageNoise) if self.voltageNoise else 0.0
+            milliamps += self.rng.gauss(0.0, self.currentNoise) if self.currentNoise else 0.0
+            values += [volts, milliamps]
+        return values
+
+    def frameReply(self, msgType, sequence, payload):
+        self.heard()
+        if msgType == McuMsg.HEARTBEAT.value:
+            return encodeFrame(McuMsg.HEARTBEAT, sequence)
+        if msgType == McuMsg.POWER.value:
+            time.sleep(self.sampleDelay)
+            return encodeFrame(McuMsg.POWER, sequence, powerStruct.pack(*self.reading()))
+        if msgType == McuMsg.MOTORS.value:
+            self.duties["ma"], self.duties["mb"] = motorStruct.unpack(payload)
+            self.motorLog.append((time.perf_counter(), self.duties["ma"], self.duties["mb"]))
+        if msgType == McuMsg.POWER_STREAM.value:
+            (intervalMs,) = streamStruct.unpack(payload)
+            self.pushInterval = intervalMs / 1000
+            self.nextPush = time.perf_counter() + self.pushInterval
+            return encodeFrame(McuMsg.POWER_STREAM, sequence, payload)
+        return None
+
+    def requests(self, data):
+        # Whatever requests are complete in data, as functions producing the reply
+        if self.textProtocol:
+            lines = (self.partialLine + data).split(b'\n')
+            self.partialLine = lines.pop()
+            return [lambda line=line: self.textReply(line.decode('utf-8', 'replace').strip()) for line in lines]
+        return [lambda frame=frame: self.frameReply(*frame) for frame in self.parser.feed(data)]
+
+    def push(self):
+        if self.pushInterval <= 0 or time.perf_counter() < self.nextPush:
+            return
+        self.nextPush = max(self.nextPush + self.pushInterval, time.perf_counter())
+        time.sleep(self.sampleDelay)
+        self.write(encodeFrame(McuMsg.POWER, 0, powerStruct.pack(*self.reading())))
+        self.pushes += 1
+
+    def heard(self):
+        # commsLog() in the sketch
+        self.lastHeard = time.perf_counter()
+        self.expired = False
+
+    def checkExpiry(self):
+        # isHbExpired() in the sketch, the motors stop until the host is back
+        if self.expired or time.perf_counter() - self.lastHeard <= self.heartbeatExpiry:
+            return
+        self.expired = True
+        self.expiries += 1
+        self.duties["ma"] = 0
+        self.duties["mb"] = 0
+
+    def write(self, out):
+        if self.corruptRate and self.rng.random() < self.corruptRate:
+            out = bytearray(out)
+            out[self.rng.randrange(len(out))] ^= 1 << self.rng.randrange(8)
+            out = bytes(out)
+            self.repliesCorrupted += 1
+        if self.garbageRate and self.rng.random() < self.garbageRate:
+            out = bytes(self.rng.randrange(256) for _ in range(self.rng.randint(1, 8))) + out
+            self.garbageBursts += 1
+        time.sleep(self.wireTime(len(out)))
+        os.write(self.master, out)
+
+    def serve(self):
+        while self.running:
+            self.push()
+            timeout = 0.1
+            if self.pushInterval > 0:
+                timeout = min(timeout, max(0.0, self.nextPush - time.perf_counter()))
+            ready, _, _ = select.select([self.master], [], [], timeout)
+            if not ready:
+                self.checkExpiry()
+                continue
+            try:
+                data = os.read(self.master, 4096)
+            except OSError:
+                return
+            time.sleep(self.wireTime(len(data)))
+            for handle in self.requests(data):
+                self.requestsSeen += 1
+                if self.processingDelay:
+                    time.sleep(self.processingDelay)
+                out = handle()
+                if out is not None:
+                    self.write(out)
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        os.close(self.master)
+        os.close(self.slave)
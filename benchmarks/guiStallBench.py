@@ -0,0 +1,106 @@
+# UI frame time in gui-client when the robot stalls. The server sends
+# telemetry at 20 Hz but goes quiet for stallTime every stallEvery seconds.
+# The UI loop is played without Tk (no display needed), a tick doing what
+# robotLoop does and then sleeping like after() would. Frame time is the
+# gap between ticks, while it lasts the UI can't handle keys or redraw.
+#  - legacy: robotLoop as it was, blocking receive on the UI thread
+#  - worker: robotLoop with networkworker, fixed 20 ms ticks
+# Commands/s is what the robot actually got.
+# Run from the repo root with: python -m benchmarks.guiStallBench
+import threading
+import time
+from robotTelemModule import telemData
+from robotTelemModule import commandData
+from networkworker import networkWorker
+from benchmarks.loopback import loopbackPair
+from benchmarks.loopback import closePair
+
+telemetryRate = 20
+stallEvery = 3.0
+stallTime = 1.5
+commandInterval = 0.02
+
+
+def stallingServer(server, stop, commandsReceived):
+    # Telemetry out at telemetryRate except during stalls
+    def drain():
+        while not stop.is_set():
+            if server.isFailure(server.receivePyObject()):
+                return
+            commandsReceived[0] += 1
+
+    threading.Thread(target=drain, daemon=True).start()
+    start = time.perf_counter()
+    while not stop.is_set():
+        if (time.perf_counter() - start) % stallEvery < stallTime:
+            time.sleep(0.01)
+            continue
+        server.sendPyObject(telemData())
+        time.sleep(1 / telemetryRate)
+
+
+def legacyTick(client, state):
+    client.receivePyObject()
+    command = commandData()
+    command.ma = 60
+    client.sendPyObject(command)
+    return 0.008  # m.after(8, ...)
+
+
+def workerTick(worker, state):
+    command = commandData()
+    command.ma = 60
+    worker.outgoing.put(command)
+    if worker.received.sequence != state['shown']:
+        state['shown'] = worker.received.sequence
+        worker.received.peek()
+    now = time.perf_counter()
+    state['nextTick'] = max(state['nextTick'] + commandInterval, now)
+    return state['nextTick'] - now
+
+
+def runCase(useWorker, duration=9.0):
+    server, client = loopbackPair()
+    stop = threading.Event()
+    commandsReceived = [0]
+    serverThread = threading.Thread(target=stallingServer, args=(server, stop, commandsReceived), daemon=True)
+    serverThread.start()
+    worker = networkWorker(client) if useWorker else None
+    state = {'shown': 0, 'nextTick': time.perf_counter()}
+
+    gaps = []
+    lastTick = time.perf_counter()
+    end = lastTick + duration
+    while lastTick < end:
+        if useWorker:
+            delay = workerTick(worker, state)
+        else:
+            delay = legacyTick(client, state)
+        time.sleep(max(delay, 0))
+        now = time.perf_counter()
+        gaps.append(now - lastTick)
+        lastTick = now
+
+    stop.set()
+    if worker is not None:
+        worker.stop()
+    closePair(server, client)
+    gaps.sort()
+    return {
+        'ticks': len(gaps),
+        'frame_p50_ms': gaps[len(gaps) // 2] * 1000,
+        'frame_p99_ms': gaps[int(len(gaps) * 0.99)] * 1000,
+        'frame_max_ms': gaps[-1] * 1000,
+        'commands_per_s': commandsReceived[0] / duration,
+    }
+
+
+def run():
+    return {'legacy': runCase(False), 'worker': runCase(True)}
+
+
+if __name__ == "__main__":
+    print(f'Server stalls {stallTime} s out of every {stallEvery} s')
+    for name, result in run().items():
+        print(f'{name:7} {result["ticks"]:5} ticks  frame time p50 {result["frame_p50_ms"]:7.1f} ms p99 {result["frame_p99_ms"]:7.1f} ms '
+              f'max {result["frame_max_ms"]:7.1f} ms  {result["commands_per_s"]:5.1f} commands/s reached the robot')
@@ -0,0 +1,58 @@
+# cv2.imencode / imdecode cost and JPEG size at a few qualities for the two
+# camera resolutions we run, on synthetic frames that compress roughly like
+# a real scene (blurred texture, sensor noise, a few hard edges).
+# Run from the repo root with: python -m benchmarks.jpegBench
+import time
+import cv2
+import numpy as np
+
+resolutions = {'640x480': (640, 480), '1280x720': (1280, 720)}
+qualities = (30, 50, 80)
+
+
+def syntheticFrame(width, height, seed=1):
+    rng = np.random.default_rng(seed)
+    frame = cv2.GaussianBlur(rng.integers(0, 255, (height, width, 3), dtype=np.uint8), (31, 31), 0)
+    noise = rng.integers(-3, 4, frame.shape, dtype=np.int16)
+    frame = np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+    for i in range(6):
+        x = int(rng.integers(0, width - 80))
+        y = int(rng.integers(0, height - 80))
+        cv2.rectangle(frame, (x, y), (x + 80, y + 60), tuple(int(c) for c in rng.integers(0, 255, 3)), -1)
+    return frame
+
+
+def encodeJpeg(frame, quality):
+    _, buffer = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    return buffer
+
+
+def timeIt(function, repeat):
+    # Median of single calls, steadier than the mean between two runs
+    function()  # Warm up
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times[len(times) // 2]
+
+
+def run(repeat=100):
+    results = {}
+    for name, (width, height) in resolutions.items():
+        frame = syntheticFrame(width, height)
+        for quality in qualities:
+            buffer = encodeJpeg(frame, quality)
+            results[f'{name} q{quality}'] = {
+                'bytes': int(buffer.nbytes),
+                'encode_ms': timeIt(lambda: encodeJpeg(frame, quality), repeat) * 1000,
+                'decode_ms': timeIt(lambda: cv2.imdecode(buffer, cv2.IMREAD_COLOR), repeat) * 1000,
+            }
+    return results
+
+
+if __name__ == "__main__":
+    for name, result in run().items():
+        print(f'{name:14} {result["bytes"] / 1024:7.1f} KB  encode {result["encode_ms"]:6.2f} ms  decode {result["decode_ms"]:6.2f} ms')
@@ -0,0 +1,58 @@
+# Cost of the robotNetworkModule instrumentation and how close the stamp
+# based RTT gets to the real one. Telemetry/command ping-pong over loopback
+# like robot-local-main and gui-client do, with timestamps off and on. The
+# real round trip is timed on the client around send + receive.
+# Run from the repo root with: python -m benchmarks.linkStatsBench
+import threading
+import time
+from robotTelemModule import telemData
+from robotTelemModule import commandData
+from benchmarks.loopback import loopbackPair
+from benchmarks.loopback import closePair
+
+
+def runCase(timestamps, rounds=20000):
+    server, client = loopbackPair()
+    server.timestamps = timestamps
+    client.timestamps = timestamps
+
+    def echo():
+        for _ in range(rounds):
+            client.receivePyObject()
+            client.sendPyObject(commandData())
+
+    echoThread = threading.Thread(target=echo)
+    echoThread.start()
+    telem = telemData()
+    measured = []
+    start = time.perf_counter()
+    for _ in range(rounds):
+        sent = time.perf_counter()
+        server.sendPyObject(telem)
+        server.receivePyObject()
+        measured.append(time.perf_counter() - sent)
+    elapsed = time.perf_counter() - start
+    echoThread.join()
+    closePair(server, client)
+    measured.sort()
+    stats = server.stats.snapshot()
+    return {
+        'rounds_per_s': rounds / elapsed,
+        'measured_p50_ms': measured[len(measured) // 2] * 1000,
+        'stamp_p50_ms': stats['rtt']['p50_ms'],
+        'stamp_samples': stats['rtt']['count'],
+        'serialize_avg_us': stats['serialize']['avg_ms'] * 1000,
+        'deserialize_avg_us': stats['deserialize']['avg_ms'] * 1000,
+        'bytes_per_round': (stats['bytes_sent'] + stats['bytes_received']) / rounds,
+    }
+
+
+def run():
+    return {'timestamps off': runCase(False), 'timestamps on': runCase(True)}
+
+
+if __name__ == "__main__":
+    for name, result in run().items():
+        print(f'{name:15} {result["rounds_per_s"]:8.0f} round trips/s  {result["bytes_per_round"]:.0f} bytes each  '
+              f'real rtt p50 {result["measured_p50_ms"]:.3f} ms  stamp rtt p50 {result["stamp_p50_ms"]:.3f} ms ({result["stamp_samples"]} samples)  '
+              f'serialize {result["serialize_avg_us"]:.1f} us  deserialize {result["deserialize_avg_us"]:.1f} us')
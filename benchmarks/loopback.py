@@ -0,0 +1,22 @@
+# Helpers for setting up robotNetworkModule pairs over loopback for benchmarks.
+import threading
+from networkmodule import robotNetworkModule
+from networkmodule import ConnModes
+
+
+def loopbackPair():
+    # Binds the server to an ephemeral port and connects a client to it.
+    # Returns (server, client), both ready to send/receive.
+    server = robotNetworkModule(ConnModes.SERVER, "127.0.0.1", 0)
+    port = server.sock.getsockname()[1]
+    acceptThread = threading.Thread(target=server.waitForConnection)
+    acceptThread.start()
+    client = robotNetworkModule(ConnModes.CLIENT, "127.0.0.1", port)
+    acceptThread.join()
+    return server, client
+
+
+def closePair(server, client):
+    client.server_socket.close()
+    server.client_socket.close()
+    server.sock.close()
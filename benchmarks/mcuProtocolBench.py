@@ -0,0 +1,90 @@
+# Checks the binary MCU frames from robotMcuModule.py against the pty fake
+# MCU and compares them with the old text lines.
+#  - wire: bytes on the serial line per control tick, each way
+#  - decode: cost of turning one power reply into six floats
+#  - corruption: power requests while the fake flips a bit in some replies,
+#    every corrupted reply should be caught (a timeout), never a wrong value
+# Run from the repo root with: python -m benchmarks.mcuProtocolBench
+import logging
+import time
+from robotMcuModule import McuMsg
+from robotMcuModule import mcuControl
+from robotMcuModule import frameParser
+from robotMcuModule import encodeFrame
+from robotMcuModule import powerStruct
+from robotMcuModule import motorStruct
+from benchmarks.fakeMcu import fakeMcu
+from benchmarks.fakeMcu import powerReading
+
+
+def wireBytes():
+    textOut = len(b"heartbeat\n") + len(b"pwr\n") + len(b"ma -255\n") + len(b"mb -255\n")
+    textIn = len(b"heartbeat\r\n") + len(" ".join(f'{value:.2f}' for value in powerReading).encode() + b"\r\n")
+    binaryOut = (len(encodeFrame(McuMsg.HEARTBEAT, 1)) + len(encodeFrame(McuMsg.POWER, 2))
+                 + len(encodeFrame(McuMsg.MOTORS, 0, motorStruct.pack(-255, -255))))
+    binaryIn = len(encodeFrame(McuMsg.HEARTBEAT, 1)) + len(encodeFrame(McuMsg.POWER, 2, powerStruct.pack(*powerReading)))
+    return {'text_out': textOut, 'text_in': textIn, 'binary_out': binaryOut, 'binary_in': binaryIn}
+
+
+def decodeCost(iterations=100000):
+    line = (" ".join(f'{value:.2f}' for value in powerReading) + "\r\n").encode()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        datapoints = line.decode('utf-8').rstrip().split(" ")
+        tuple(float(value) for value in datapoints)
+    textTime = time.perf_counter() - start
+
+    frame = encodeFrame(McuMsg.POWER, 7, powerStruct.pack(*powerReading))
+    parser = frameParser()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for _, _, payload in parser.feed(frame):
+            powerStruct.unpack(payload)
+    binaryTime = time.perf_counter() - start
+    return {'text_us': textTime / iterations * 1e6, 'binary_us': binaryTime / iterations * 1e6}
+
+
+def corruption(requests=2000, corruptRate=0.05):
+    mcu = fakeMcu(corruptRate=corruptRate)
+    control = mcuControl(mcu.path, replyTimeout=0.05)
+    expected = powerStruct.unpack(powerStruct.pack(*powerReading))  # As float32 round trips them
+    wrong = 0
+    missing = 0
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        reading = control.getPower()
+        if reading is None:
+            missing += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+        if reading != expected:
+            wrong += 1
+    control.close()
+    mcu.close()
+    latencies.sort()
+    return {
+        'requests': requests,
+        'corrupted': mcu.repliesCorrupted,
+        'detected': control.parser.corruptFrames,
+        'timeouts': missing,
+        'wrong_values': wrong,
+        'p50_ms': latencies[len(latencies) // 2] * 1000,
+        'p99_ms': latencies[int(len(latencies) * 0.99)] * 1000,
+    }
+
+
+def run():
+    return {'wire': wireBytes(), 'decode': decodeCost(), 'corruption': corruption()}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.CRITICAL)
+    results = run()
+    wire = results['wire']
+    print(f'wire bytes per tick  text {wire["text_out"]} out / {wire["text_in"]} in   binary {wire["binary_out"]} out / {wire["binary_in"]} in')
+    decode = results['decode']
+    print(f'power reply decode   text {decode["text_us"]:.2f} us   binary {decode["binary_us"]:.2f} us')
+    result = results['corruption']
+    print(f'corruption           {result["corrupted"]}/{result["requests"]} replies corrupted, {result["detected"]} corrupt frames detected, '
+          f'{result["timeouts"]} timeouts, {result["wrong_values"]} wrong values, round trip p50 {result["p50_ms"]:.2f} ms p99 {result["p99_ms"]:.2f} ms')
@@ -0,0 +1,99 @@
+# Control ticks per second through a real serial port (a pty with
+# benchmarks/fakeMcu.py on the other end) for the old sleep-after-every-line
+# mcuControl versus the threaded one in robotMcuModule.py. A tick is what
+# robot-local-main.py does with the MCU: heartbeat, power reading and both
+# motor duties (two text lines for the old one, one frame for the new one).
+# Run from the repo root with: python -m benchmarks.mcuTickBench
+import logging
+import time
+import serial
+from robotMcuModule import mcuControl
+from benchmarks.fakeMcu import fakeMcu
+
+
+class legacyMcuControl():
+    # mcuControl as it was in robot-local-main.py, serial timeout shortened
+    # so a lost reply can't stall the benchmark
+
+    def __init__(self, serialPath: str) -> None:
+        self.lastHeartBeatMs = round(time.time() * 1000)
+        self.mcuSerial = serial.Serial(port=serialPath, baudrate=115200, timeout=1)
+
+    def readMessage(self):
+        data = self.mcuSerial.readline()
+        time.sleep(1./120)
+        if len(data) > 0:
+            try:
+                decoded = data.decode('utf-8').rstrip()
+            except UnicodeDecodeError:
+                return ""
+            return decoded
+        else:
+            return ""
+
+    def sendMessage(self, message: str):
+        message = message + "\n"
+        self.mcuSerial.write(message.encode('utf-8'))
+        time.sleep(1./120)
+
+    def heartBeat(self):
+        if (round(time.time() * 1000) - self.lastHeartBeatMs) > 150:
+            self.sendMessage("heartbeat")
+            self.readMessage()
+        self.lastHeartBeatMs = round(time.time() * 1000)
+
+    def getPower(self):
+        self.sendMessage("pwr")
+        data = self.readMessage().split(" ")
+        return tuple(float(value) for value in data) if len(data) == 6 else None
+
+    def setMotors(self, ma, mb):
+        self.sendMessage(f'ma {ma}')
+        self.sendMessage(f'mb {mb}')
+
+    def clearInput(self):
+        self.mcuSerial.reset_input_buffer()
+
+    def close(self):
+        self.mcuSerial.close()
+
+
+def runCase(controlClass, baudrate, duration=3.0):
+    mcu = fakeMcu(baudrate, textProtocol=controlClass is legacyMcuControl)
+    control = controlClass(mcu.path)
+    tickTimes = []
+    badReplies = 0
+    duty = 0
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        start = time.perf_counter()
+        control.heartBeat()
+        if control.getPower() is None:
+            badReplies += 1
+        duty = (duty + 1) % 256
+        control.setMotors(duty, -duty)
+        tickTimes.append(time.perf_counter() - start)
+    control.close()
+    mcu.close()
+    tickTimes.sort()
+    return {
+        'ticks_per_s': len(tickTimes) / duration,
+        'p50_ms': tickTimes[len(tickTimes) // 2] * 1000,
+        'p99_ms': tickTimes[int(len(tickTimes) * 0.99)] * 1000,
+        'bad_replies': badReplies,
+    }
+
+
+def run():
+    results = {}
+    for baudName, baudrate in (("instant", None), ("115200", 115200)):
+        results[f'legacy/{baudName}'] = runCase(legacyMcuControl, baudrate)
+        results[f'threaded/{baudName}'] = runCase(mcuControl, baudrate)
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    for name, result in run().items():
+        print(f'{name:18} {result["ticks_per_s"]:7.1f} ticks/s  tick p50 {result["p50_ms"]:6.2f} ms p99 {result["p99_ms"]:6.2f} ms  '
+              f'{result["bad_replies"]} bad pwr replies')
@@ -0,0 +1,84 @@
+# robotNetworkModule over loopback with the messages we actually send:
+# telemetry and JPEG frames at both camera resolutions.
+#  - streaming: the server sends back to back, messages/s and MB/s
+#  - ping-pong: one message at a time answered by a commandData, round trip
+#    p50/p99 with nothing queued up
+# Run from the repo root with: python -m benchmarks.messageBench
+import threading
+import time
+from robotTelemModule import telemData
+from robotTelemModule import commandData
+from benchmarks.loopback import loopbackPair
+from benchmarks.loopback import closePair
+from benchmarks.jpegBench import syntheticFrame
+from benchmarks.jpegBench import encodeJpeg
+
+
+def messages():
+    return {
+        'telemetry': (telemData(), 20000),
+        'jpeg 640x480': (encodeJpeg(syntheticFrame(640, 480), 50), 2000),
+        'jpeg 1280x720': (encodeJpeg(syntheticFrame(1280, 720), 50), 1000),
+    }
+
+
+def streaming(message, count):
+    server, client = loopbackPair()
+
+    def receiver():
+        for _ in range(count):
+            client.receivePyObject()
+
+    receiveThread = threading.Thread(target=receiver)
+    receiveThread.start()
+    start = time.perf_counter()
+    for _ in range(count):
+        server.sendPyObject(message)
+    receiveThread.join()
+    elapsed = time.perf_counter() - start
+    stats = server.stats.snapshot()
+    closePair(server, client)
+    return count / elapsed, stats['bytes_sent'] / elapsed
+
+
+def pingPong(message, count):
+    server, client = loopbackPair()
+
+    def echo():
+        reply = commandData()
+        for _ in range(count):
+            client.receivePyObject()
+            client.sendPyObject(reply)
+
+    echoThread = threading.Thread(target=echo)
+    echoThread.start()
+    times = []
+    for _ in range(count):
+        start = time.perf_counter()
+        server.sendPyObject(message)
+        server.receivePyObject()
+        times.append(time.perf_counter() - start)
+    echoThread.join()
+    closePair(server, client)
+    times.sort()
+    return times[len(times) // 2], times[int(len(times) * 0.99)]
+
+
+def run():
+    results = {}
+    for name, (message, count) in messages().items():
+        perSecond, bytesPerSecond = streaming(message, count)
+        p50, p99 = pingPong(message, count // 2)
+        results[name] = {
+            'messages_per_s': perSecond,
+            'mb_per_s': bytesPerSecond / 1e6,
+            'rtt_p50_ms': p50 * 1000,
+            'rtt_p99_ms': p99 * 1000,
+        }
+    return results
+
+
+if __name__ == "__main__":
+    for name, result in run().items():
+        print(f'{name:14} {result["messages_per_s"]:9.0f} msgs/s {result["mb_per_s"]:8.1f} MB/s  '
+              f'rtt p50 {result["rtt_p50_ms"]:.3f} ms p99 {result["rtt_p99_ms"]:.3f} ms')
@@ -0,0 +1,114 @@
+# Worst-case control tick time with the old internalReporting.update()
+# (psutil calls plus forking iwconfig inside the loop every interval) versus
+# reading from systemMetrics.metricsSampler. The loop ticks at 100 Hz, the
+# old sampling interval is cut from 15 s to 1 s so a run crosses several
+# sample boundaries. The sampler runs every metric every 0.1 s so any
+# interference from it would show up.
+# Run from the repo root with: python -m benchmarks.metricsTickBench
+import platform
+import re
+import shutil
+import subprocess
+import time
+import psutil
+from robotTelemModule import telemData
+from systemMetrics import metricsSampler
+
+spikeLimitMs = 5.0  # A tick slower than this counts as a spike
+wifiCommand = ['iwconfig', 'wlan0'] if shutil.which('iwconfig') else ['cat', '/proc/net/wireless']
+
+
+class legacyInternalReporting():
+    # internalReporting.update() as it was, with the interval as a parameter
+
+    def __init__(self, intervalMs) -> None:
+        self.intervalMs = intervalMs
+        self.cpu_usage = 0
+        self.ram_usage = 0
+        self.cpu_temp = 0
+        self.wifiSignal = "Not Available"
+        self.lastReport = round(time.time() * 1000)
+
+    def update(self):
+        currentTime = round(time.time() * 1000)
+        if (currentTime - self.lastReport) > self.intervalMs:
+            if platform.system() == "Linux":
+                self.cpu_usage = psutil.cpu_percent(interval=None)
+                self.ram_usage = psutil.virtual_memory().percent
+                temps = psutil.sensors_temperatures()
+                if "coretemp" in temps:
+                    self.cpu_temp = temps["coretemp"][0].current
+                result = subprocess.run(wifiCommand, capture_output=True, text=True)
+                signal_level = re.search(r'Signal level=(-?\d+)', result.stdout)
+                if signal_level:
+                    self.wifiSignal = int(signal_level.group(1))
+                self.lastReport = currentTime
+
+    def reportToTelem(self, telem: telemData):
+        telem.cpu_usage = self.cpu_usage
+        telem.ram_usage = self.ram_usage
+        telem.cpu_temp = self.cpu_temp
+        telem.wifiSignal = self.wifiSignal
+        return telem
+
+
+class samplerReporting():
+    # What internalReporting does now
+
+    def __init__(self, intervals) -> None:
+        self.sampler = metricsSampler(intervals)
+        self.sampler.start()
+
+    def update(self):
+        pass
+
+    def reportToTelem(self, telem: telemData):
+        latest = self.sampler.latest.peek()
+        telem.cpu_usage = latest['cpu_usage']
+        telem.ram_usage = latest['ram_usage']
+        telem.cpu_temp = latest['cpu_temp']
+        telem.wifiSignal = latest['wifiSignal']
+        return telem
+
+
+def runCase(internal, duration=5.0, rate=100):
+    tickTimes = []
+    nextTick = time.perf_counter()
+    end = nextTick + duration
+    while nextTick < end:
+        delay = nextTick - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        nextTick += 1 / rate
+        start = time.perf_counter()
+        internal.update()
+        internal.reportToTelem(telemData()).pack()
+        tickTimes.append(time.perf_counter() - start)
+    ordered = sorted(tickTimes)
+    return {
+        'ticks': len(tickTimes),
+        'p50_ms': ordered[len(ordered) // 2] * 1000,
+        'p99_ms': ordered[int(len(ordered) * 0.99)] * 1000,
+        'max_ms': ordered[-1] * 1000,
+        'spikes': sum(1 for tick in tickTimes if tick * 1000 > spikeLimitMs),
+    }
+
+
+def run():
+    sampler = samplerReporting({'cpu': 0.1, 'ram': 0.1, 'temp': 0.1, 'wifi': 0.1})
+    results = {
+        'legacy': runCase(legacyInternalReporting(1000)),
+        'sampler': runCase(sampler),
+    }
+    sampler.sampler.stop.set()
+    return results
+
+
+if __name__ == "__main__":
+    results = run()
+    for name, result in results.items():
+        print(f'{name:8} {result["ticks"]} ticks  p50 {result["p50_ms"]:.3f} ms  p99 {result["p99_ms"]:.3f} ms  '
+              f'max {result["max_ms"]:.3f} ms  {result["spikes"]} ticks over {spikeLimitMs} ms')
+    if results['sampler']['spikes']:
+        print("FAIL: control ticks still spike with the sampler")
+        exit(1)
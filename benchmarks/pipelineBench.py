@@ -0,0 +1,85 @@
+# Serial capture -> encode -> send versus the pipelineStage/latestSlot version
+# cameraServer uses, with a simulated 30 fps camera, a fixed encode cost and
+# a network send that stalls every so often. Reports frames sent per second
+# and how old each frame was when its send started.
+# Run from the repo root with: python -m benchmarks.pipelineBench
+import time
+from cameraPipeline import pipelineStage
+from latestslot import latestSlot
+from timingstats import stageStats
+
+cameraInterval = 1 / 30
+encodeTime = 0.008
+sendTime = 0.005
+stallTime = 0.15
+stallEvery = 10
+driverBuffer = 4  # Frames the camera driver queues up, like V4L2 does
+
+
+class fakeCamera():
+    # A new frame every cameraInterval. read() returns the oldest frame still
+    # queued in the driver (or blocks for the next one) like cv2.VideoCapture,
+    # the "frame" is just the time it was captured.
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.nextIndex = 0
+
+    def read(self, _=None):
+        latestIndex = int((time.perf_counter() - self.start) / cameraInterval)
+        if latestIndex - self.nextIndex >= driverBuffer:
+            self.nextIndex = latestIndex - driverBuffer + 1
+        frameTime = self.start + self.nextIndex * cameraInterval
+        delay = frameTime - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        self.nextIndex += 1
+        return frameTime
+
+
+def fakeEncode(frame):
+    time.sleep(encodeTime)
+    return frame
+
+
+def fakeSend(count):
+    time.sleep(stallTime if count % stallEvery == 0 else sendTime)
+
+
+def runSerial(duration):
+    camera = fakeCamera()
+    latency = stageStats("serial")
+    count = 0
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        captureTime = camera.read()
+        fakeEncode(captureTime)
+        latency.add(time.perf_counter() - captureTime)
+        count += 1
+        fakeSend(count)
+    return latency.snapshot()
+
+
+def runPipelined(duration):
+    camera = fakeCamera()
+    rawFrames = latestSlot()
+    encodedFrames = latestSlot()
+    pipelineStage("capture", camera.read, sink=rawFrames).start()
+    pipelineStage("encode", fakeEncode, source=rawFrames, sink=encodedFrames).start()
+    latency = stageStats("pipelined")
+    count = 0
+    end = time.perf_counter() + duration
+    while time.perf_counter() < end:
+        captureTime, _ = encodedFrames.take()
+        latency.add(time.perf_counter() - captureTime)
+        count += 1
+        fakeSend(count)
+    return latency.snapshot()
+
+
+def run(duration=5):
+    return [runSerial(duration), runPipelined(duration)]
+
+
+if __name__ == "__main__":
+    for result in run():
+        print(f'{result["name"]:10} {result["rate"]:6.1f} fps sent, frame age {result["avg_ms"]:6.1f} ms avg {result["max_ms"]:6.1f} ms max')
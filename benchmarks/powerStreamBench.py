@@ -0,0 +1,69 @@
+# Control tick time with power readings polled every tick versus pushed by
+# the MCU at a fixed rate (mcuControl.startPowerStream), through a pty with
+# benchmarks/fakeMcu.py on the other end. The fake takes sampleDelay to read
+# the sensors like the INA3221 does, polling puts that in every tick.
+# A tick is what telemetryLoop does with the MCU plus a motor update, paced
+# at tickRate like the real loop (free running would just flood the line
+# with motor frames). Tick time is how long the loop was held up.
+# Run from the repo root with: python -m benchmarks.powerStreamBench
+import logging
+import time
+from robotMcuModule import mcuControl
+from benchmarks.fakeMcu import fakeMcu
+
+
+def runCase(streamRate, sampleDelay=0.002, tickRate=50, duration=3.0):
+    mcu = fakeMcu(sampleDelay=sampleDelay)
+    control = mcuControl(mcu.path)
+    readings = []
+    if streamRate:
+        control.startPowerStream(streamRate, readings.append)
+    tickTimes = []
+    ages = []
+    polls = 0
+    duty = 0
+    end = time.perf_counter() + duration
+    nextTick = time.perf_counter()
+    while time.perf_counter() < end:
+        delay = nextTick - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        nextTick += 1 / tickRate
+        start = time.perf_counter()
+        control.heartBeat()
+        if control.powerStreamFresh():
+            ages.append(start - control.lastPowerPush)
+        else:
+            control.getPower()
+            polls += 1
+            ages.append(0.0)
+        duty = (duty + 1) % 256
+        control.setMotors(duty, -duty)
+        tickTimes.append(time.perf_counter() - start)
+    control.close()
+    mcu.close()
+    tickTimes.sort()
+    ages.sort()
+    return {
+        'p50_ms': tickTimes[len(tickTimes) // 2] * 1000,
+        'p99_ms': tickTimes[int(len(tickTimes) * 0.99)] * 1000,
+        'polls': polls,
+        'pushed': len(readings),
+        'age_p50_ms': ages[len(ages) // 2] * 1000,
+        'age_max_ms': ages[-1] * 1000,
+    }
+
+
+def run():
+    return {
+        'poll': runCase(0),
+        'stream 20/s': runCase(20),
+        'stream 50/s': runCase(50),
+    }
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    for name, result in run().items():
+        print(f'{name:12} tick p50 {result["p50_ms"]:5.2f} ms p99 {result["p99_ms"]:5.2f} ms  '
+              f'{result["polls"]:5} polls {result["pushed"]:4} pushed  reading age p50 {result["age_p50_ms"]:5.1f} ms max {result["age_max_ms"]:5.1f} ms')
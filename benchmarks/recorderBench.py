@@ -0,0 +1,186 @@
+# Write and read cost of telemRecorder.py. Records a few hours of robot
+# traffic (telemetry at 20/s, commands at 50/s) into a temp directory, then
+# times opening it, pulling a column over the whole run and slicing out ten
+# minutes by time. Then checks a slice comes out right after the wall clock
+# steps back mid-recording (NTP at boot), that the oldest segments get
+# deleted once the directory passes maxTotalBytes, and how long record()
+# holds up the caller while the disk stalls.
+# Run from the repo root with: python -m benchmarks.recorderBench
+import os
+import shutil
+import tempfile
+import threading
+import time
+from robotTelemModule import telemData
+from robotTelemModule import commandData
+from telemRecorder import RecordKind
+from telemRecorder import telemetryRecorder
+from telemRecorder import recordingFiles
+from telemRecorder import openRecording
+from telemRecorder import between
+from telemRecorder import toMessage
+
+
+def run(hours=4.0):
+    directory = tempfile.mkdtemp()
+    try:
+        recorder = telemetryRecorder(directory, maxBytes=16 * 1024 * 1024)
+        telem = telemData()
+        command = commandData()
+        runStart = 1.7e9
+        telemCount = int(hours * 3600 * 20)
+        start = time.perf_counter()
+        for i in range(telemCount):
+            telem.avgVolt = 12.0 - i * 1e-6
+            timestamp = runStart + i / 20
+            recorder.record(telem, timestamp)
+            command.ma = i % 256
+            recorder.record(command, timestamp)
+            recorder.record(command, timestamp + 0.02)
+            if i % 2:
+                recorder.record(command, timestamp + 0.04)
+            if i % 1000 == 999:
+                recorder.drain()  # Faster than any robot, don't let the queue overflow
+        recorder.close()
+        recordTime = time.perf_counter() - start
+        records = recorder.records
+        size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+        start = time.perf_counter()
+        segments = [openRecording(path) for path in recordingFiles(directory, RecordKind.TELEM)]
+        openTime = time.perf_counter() - start
+
+        start = time.perf_counter()
+        mean = sum(float(records['avgVolt'].sum()) for records in segments) / sum(len(records) for records in segments)
+        columnTime = time.perf_counter() - start
+
+        start = time.perf_counter()
+        middle = runStart + hours * 3600 / 2
+        window = sum(len(between(records, middle, middle + 600)) for records in segments)
+        sliceTime = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for i in range(10000):
+            toMessage(segments[0][i])
+        decodeTime = (time.perf_counter() - start) / 10000
+        del segments
+    finally:
+        shutil.rmtree(directory)
+    result = {
+        'records': records,
+        'records_per_s': records / recordTime,
+        'megabytes': size / 1e6,
+        'open_ms': openTime * 1000,
+        'column_ms': columnTime * 1000,
+        'mean_volts': mean,
+        'slice_ms': sliceTime * 1000,
+        'window_records': window,
+        'decode_us': decodeTime * 1e6,
+    }
+    result.update(steppedClock())
+    result.update(retention())
+    result.update(stalledDisk())
+    return result
+
+
+def steppedClock(count=2000, stepBack=120.0):
+    # Half the records, then the clock goes back stepBack seconds
+    directory = tempfile.mkdtemp()
+    try:
+        recorder = telemetryRecorder(directory)
+        telem = telemData()
+        for i in range(count):
+            recorder.record(telem, 1.7e9 + i / 20 - (stepBack if i >= count // 2 else 0), monotonic=i / 20)
+        recorder.close()
+        records = openRecording(recordingFiles(directory, RecordKind.TELEM)[0])
+        start, end = 1.7e9 + 10, 1.7e9 + 40
+        times = records['time']
+        sliceOk = len(between(records, start, end)) == int(((times >= start) & (times < end)).sum())
+        ordered = bool((records['monotonic'][1:] > records['monotonic'][:-1]).all())
+        del records, times
+    finally:
+        shutil.rmtree(directory)
+    return {'stepped_slice_ok': sliceOk, 'stepped_monotonic_ordered': ordered}
+
+
+def retention(count=60000, maxBytes=256 * 1024, maxTotalBytes=1024 * 1024):
+    # A long run in small segments, the oldest have to go
+    directory = tempfile.mkdtemp()
+    try:
+        recorder = telemetryRecorder(directory, maxBytes=maxBytes, maxTotalBytes=maxTotalBytes)
+        telem = telemData()
+        for i in range(count):
+            recorder.record(telem)
+            if i % 1000 == 999:
+                recorder.drain()
+        recorder.close()
+        size = sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+    finally:
+        shutil.rmtree(directory)
+    return {'retained_megabytes': size / 1e6, 'cap_megabytes': maxTotalBytes / 1e6, 'segments_deleted': recorder.segmentsDeleted}
+
+
+class stallingFile():
+    # Stands in for a segment's file, every write stalls for stall seconds
+    # once every stallEvery writes like an SD card doing its housekeeping
+
+    def __init__(self, file, stall, stallEvery) -> None:
+        self.file = file
+        self.stall = stall
+        self.stallEvery = stallEvery
+        self.writes = 0
+
+    def write(self, data):
+        self.writes += 1
+        if self.writes % self.stallEvery == 0:
+            time.sleep(self.stall)
+        return self.file.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+def stalledDisk(duration=3.0, rate=70, stall=0.5, stallEvery=50, queueSize=4096):
+    # Robot traffic in real time (telemetry and commands together at rate/s)
+    # from two threads while the disk stalls, the longest record() call is
+    # what a control loop would have waited
+    directory = tempfile.mkdtemp()
+    try:
+        recorder = telemetryRecorder(directory, queueSize=queueSize)
+        for recordFile in recorder.files.values():
+            recordFile.file = stallingFile(recordFile.file, stall, stallEvery)
+        worst = [0.0, 0.0]
+
+        def loop(slot, obj):
+            nextRecord = time.perf_counter()
+            end = nextRecord + duration
+            while nextRecord < end:
+                start = time.perf_counter()
+                recorder.record(obj)
+                worst[slot] = max(worst[slot], time.perf_counter() - start)
+                nextRecord += 2 / rate
+                time.sleep(max(0.0, nextRecord - time.perf_counter()))
+
+        threads = [threading.Thread(target=loop, args=(0, telemData())),
+                   threading.Thread(target=loop, args=(1, commandData()))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        recorder.close()
+    finally:
+        shutil.rmtree(directory)
+    return {'stalled_record_max_ms': max(worst) * 1000, 'stalled_written': recorder.records, 'stalled_dropped': recorder.dropped}
+
+
+if __name__ == "__main__":
+    result = run()
+    print(f'recorded {result["records"]} records ({result["megabytes"]:.1f} MB) at {result["records_per_s"]:.0f} records/s')
+    print(f'open {result["open_ms"]:.2f} ms  whole-run avgVolt column {result["column_ms"]:.1f} ms  '
+          f'10 minute slice {result["slice_ms"]:.3f} ms ({result["window_records"]} records)  record -> telemData {result["decode_us"]:.1f} us')
+    print(f'clock stepped back: slice {"right" if result["stepped_slice_ok"] else "WRONG"}, '
+          f'monotonic column {"in order" if result["stepped_monotonic_ordered"] else "OUT OF ORDER"}')
+    print(f'retention: {result["segments_deleted"]} old segments deleted, {result["retained_megabytes"]:.2f} MB kept '
+          f'(cap {result["cap_megabytes"]:.2f} MB plus the segments being written)')
+    print(f'disk stalling: longest record() {result["stalled_record_max_ms"]:.3f} ms, '
+          f'{result["stalled_written"]} written, {result["stalled_dropped"]} dropped')
@@ -0,0 +1,71 @@
+# Compares the old chunked `data += recv(4096)` receive loop against the
+# recv_into path in robotNetworkModule.receivePyObject, using camera frame
+# sized payloads over loopback.
+# Run from the repo root with: python -m benchmarks.recvBench
+import os
+import pickle
+import threading
+import time
+from networkmodule import headerStruct
+from benchmarks.loopback import loopbackPair
+from benchmarks.loopback import closePair
+
+
+def legacyReceive(sock):
+    # The receive loop as it was before recv_into. The header read loops
+    # until it has all of it, a single recv could come back short and hang
+    # the benchmark.
+    header = b''
+    while len(header) < headerStruct.size:
+        header += sock.recv(headerStruct.size - len(header))
+    (length, msgType, bufferCount, flags) = headerStruct.unpack(header)
+    data = b''
+    while len(data) < length:
+        to_read = length - len(data)
+        received = sock.recv(
+            4096 if to_read > 4096 else to_read)
+        data += received
+    return pickle.loads(data)
+
+
+def runCase(payloadSize, frames, useLegacy):
+    server, client = loopbackPair()
+    payload = os.urandom(payloadSize)
+
+    def sender():
+        for _ in range(frames):
+            server.sendPyObject(payload)
+
+    sendThread = threading.Thread(target=sender)
+    start = time.perf_counter()
+    cpuStart = time.thread_time()
+    sendThread.start()
+    for _ in range(frames):
+        if useLegacy:
+            legacyReceive(client.server_socket)
+        else:
+            client.receivePyObject()
+    cpu = time.thread_time() - cpuStart
+    elapsed = time.perf_counter() - start
+    sendThread.join()
+    closePair(server, client)
+    return {
+        'mb_per_s': payloadSize * frames / elapsed / 1e6,
+        'cpu_us_per_frame': cpu / frames * 1e6,
+    }
+
+
+def run(frames=2000):
+    results = {}
+    for size in (30 * 1024, 100 * 1024):
+        results[f'{size // 1024}KB'] = {
+            'legacy': runCase(size, frames, True),
+            'recv_into': runCase(size, frames, False),
+        }
+    return results
+
+
+if __name__ == "__main__":
+    for size, cases in run().items():
+        for name, result in cases.items():
+            print(f'{size:6} {name:10} {result["mb_per_s"]:9.1f} MB/s {result["cpu_us_per_frame"]:9.1f} us cpu/frame')
@@ -0,0 +1,190 @@
+# The whole robot off-robot: robot-local-main.py runs as a subprocess in a
+# scratch directory with its serial port pointed at a fakeMcu pty, and a
+# headless client drives it over loopback like gui-client does.
+#  - telemetry ticks/s and tick jitter (how far each telemetry arrival is
+#    from the configured interval) as the client sees them
+#  - motor frames/s reaching the MCU
+#  - command to serial latency, from the client sending a command to its
+#    motor frame arriving at the MCU. Every command has different duties so
+#    each motor frame can be matched to the command it came from.
+#  - that the MCU stops the motors on its own once the robot is gone
+# Linux/macOS only (needs a pty). Uses port 4421 like the robot does.
+# Run from the repo root with: python -m benchmarks.robotLoopBench
+import bisect
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from configparser import ConfigParser
+from networkmodule import robotNetworkModule
+from networkmodule import ConnModes
+from robotTelemModule import commandData
+from benchmarks.fakeMcu import fakeMcu
+
+robotMain = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "robot-local-main.py")
+robotPort = 4421
+dutyCycle = 400  # Distinct commands before the duties repeat
+warmup = 1.5  # Seconds after the first telemetry before measuring, the robot starts the MCU in this time
+
+
+def writeConfig(directory, serialPath, telemetryRate, powerStreamRate, timing=None):
+    config = ConfigParser()
+    config.add_section("connection")
+    config.set('connection', 'serverIP', '127.0.0.1')
+    config.set('connection', 'mcuSerialPath', serialPath)
+    config.add_section("camera")
+    config.set('camera', 'sysCamID', '0')
+    config.add_section("power")
+    config.set('power', 'batterySize', '6500')
+    config.add_section("timing")
+    config.set('timing', 'telemetryRate', str(telemetryRate))
+    config.set('timing', 'powerStreamRate', str(powerStreamRate))
+    for key, value in (timing or {}).items():
+        config.set('timing', key, str(value))
+    config.add_section("recording")
+    config.set('recording', 'enabled', 'false')
+    with open(os.path.join(directory, "robotlocal.conf"), 'w') as f:
+        config.write(f)
+
+
+def connect(robot, timeout=10.0):
+    # The robot takes a moment to start listening
+    end = time.perf_counter() + timeout
+    while time.perf_counter() < end:
+        if robot.poll() is not None:
+            return None
+        client = robotNetworkModule(ConnModes.CLIENT, "127.0.0.1", robotPort, timestamps=True)
+        if client.successfulConnection:
+            return client
+        time.sleep(0.1)
+    return None
+
+
+def percentiles(values):
+    if not values:
+        return {'p50_ms': 0.0, 'p99_ms': 0.0, 'max_ms': 0.0}
+    ordered = sorted(values)
+    return {
+        'p50_ms': ordered[len(ordered) // 2] * 1000,
+        'p99_ms': ordered[int(len(ordered) * 0.99)] * 1000,
+        'max_ms': ordered[-1] * 1000,
+    }
+
+
+def commandLatencies(sent, motorLog, start):
+    # sent[i] holds the send times of the commands with duty value i
+    latencies = []
+    for arrived, ma, mb in motorLog:
+        if arrived < start:
+            continue
+        times = sent.get(ma)
+        if not times:
+            continue
+        index = bisect.bisect_right(times, arrived) - 1
+        if index >= 0:
+            latencies.append(arrived - times[index])
+    return latencies
+
+
+def runCase(duration=8.0, commandRate=50, telemetryRate=20, powerStreamRate=20, **mcuOptions):
+    directory = tempfile.mkdtemp(prefix="robotLoopBench-")
+    mcu = fakeMcu(**mcuOptions)
+    # Full telemetry every tick, deltas skip ticks when nothing changed and the jitter needs all of them
+    writeConfig(directory, mcu.path, telemetryRate, powerStreamRate, {'keyframeInterval': 0})
+    with open(os.path.join(directory, "robot.out"), 'w') as output:
+        robot = subprocess.Popen([sys.executable, robotMain], cwd=directory, stdout=output, stderr=subprocess.STDOUT)
+    client = connect(robot)
+    if client is None:
+        robot.kill()
+        mcu.close()
+        with open(os.path.join(directory, "robot.out")) as f:
+            print(f.read(), file=sys.stderr)
+        shutil.rmtree(directory)
+        raise RuntimeError("robot-local-main.py did not accept a connection")
+
+    arrivals = []
+    done = threading.Event()
+
+    def receiver():
+        while not done.is_set():
+            result = client.receivePyObject()
+            if client.isFailure(result):
+                return
+            arrivals.append(time.perf_counter())
+
+    receiveThread = threading.Thread(target=receiver, daemon=True)
+    receiveThread.start()
+    while not arrivals and robot.poll() is None:
+        time.sleep(0.01)
+
+    sent = {}
+    command = commandData()
+    start = time.perf_counter() + warmup
+    expiriesBefore = mcu.expiries  # The MCU has been waiting for the robot to start, that one doesn't count
+    end = start + duration
+    nextSend = time.perf_counter()
+    index = 0
+    while nextSend < end:
+        delay = nextSend - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        nextSend += 1 / commandRate
+        duty = index % dutyCycle - dutyCycle // 2
+        command.ma = duty
+        command.mb = -duty
+        sent.setdefault(duty, []).append(time.perf_counter())
+        client.sendPyObject(command)
+        index += 1
+    time.sleep(0.2)  # Let the last commands land
+
+    motorLog = list(mcu.motorLog)
+    measured = [arrival for arrival in arrivals if start <= arrival < end]
+    intervals = [b - a for a, b in zip(measured, measured[1:])]
+    motorFrames = [entry for entry in motorLog if start <= entry[0] < end]
+    expiriesWhileRunning = mcu.expiries - expiriesBefore
+
+    # Client hangs up first so the closed connection waits out TIME_WAIT on
+    # its side, the next robot can then bind the port again straight away
+    done.set()
+    client.server_socket.close()
+    time.sleep(0.2)
+    robot.terminate()
+    robot.wait()
+    time.sleep(mcu.heartbeatExpiry + 0.3)
+    stoppedAfterExit = mcu.expiries > expiriesBefore + expiriesWhileRunning and mcu.duties == {"ma": 0, "mb": 0}
+    corrupted = mcu.repliesCorrupted
+    mcu.close()
+    shutil.rmtree(directory)
+
+    return {
+        'telemetry_per_s': len(measured) / duration,
+        'tick_jitter': percentiles([abs(interval - 1 / telemetryRate) for interval in intervals]),
+        'motor_frames_per_s': len(motorFrames) / duration,
+        'commands_per_s': commandRate,
+        'command_to_serial': percentiles(commandLatencies(sent, motorLog, start)),
+        'expiries_while_running': expiriesWhileRunning,
+        'replies_corrupted': corrupted,
+        'stopped_after_exit': stoppedAfterExit,
+    }
+
+
+def run():
+    return {
+        'clean': runCase(),
+        'faulty mcu': runCase(processingDelay=0.002, corruptRate=0.02, garbageRate=0.02,
+                              voltageNoise=0.02, currentNoise=5.0, motorLoadMa=800.0),
+    }
+
+
+if __name__ == "__main__":
+    for name, result in run().items():
+        jitter = result['tick_jitter']
+        latency = result['command_to_serial']
+        print(f'{name:11} {result["telemetry_per_s"]:5.1f} telemetry/s  jitter p50 {jitter["p50_ms"]:.2f} ms p99 {jitter["p99_ms"]:.2f} ms  '
+              f'{result["motor_frames_per_s"]:5.1f} motor frames/s for {result["commands_per_s"]} commands/s  '
+              f'command to serial p50 {latency["p50_ms"]:.2f} ms p99 {latency["p99_ms"]:.2f} ms max {latency["max_ms"]:.2f} ms  '
+              f'{result["replies_corrupted"]} replies corrupted  {result["expiries_while_running"]} expiries while running  '
+              f'motors stopped after exit: {result["stopped_after_exit"]}')
@@ -0,0 +1,63 @@
+# Ingest and query throughput for samplering.py at kHz sample rates, with
+# the six power channels pwrSubSystem keeps. Queries run over windows of
+# samples at 1 kHz, the baseline does the same mean with a deque of tuples.
+# Run from the repo root with: python -m benchmarks.sampleRingBench
+import random
+import time
+from collections import deque
+from samplering import sampleRing
+
+sampleRate = 1000
+capacity = 120 * sampleRate  # Two minutes at 1 kHz
+
+
+def makeSamples(count, seed=1):
+    rng = random.Random(seed)
+    return [(12.3 + rng.random() * 0.1, 400 + rng.random() * 200,
+             12.3 + rng.random() * 0.1, 400 + rng.random() * 200,
+             12.3 + rng.random() * 0.1, 400 + rng.random() * 200) for _ in range(count)]
+
+
+def timeIt(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+
+def run():
+    samples = makeSamples(capacity)
+    ring = sampleRing(capacity, 6)
+    start = time.perf_counter()
+    for i, sample in enumerate(samples):
+        ring.append(i / sampleRate, sample)
+    ingest = len(samples) / (time.perf_counter() - start)
+
+    baseline = deque(maxlen=capacity)
+    start = time.perf_counter()
+    for i, sample in enumerate(samples):
+        baseline.append((i / sampleRate, sample))
+    baselineIngest = len(samples) / (time.perf_counter() - start)
+
+    results = {'ingest': {'ring_per_s': ingest, 'deque_per_s': baselineIngest}}
+    for seconds in (1, 10, 60):
+        def dequeMean():
+            cutoff = baseline[-1][0] - seconds
+            window = [sample for timestamp, sample in baseline if timestamp >= cutoff]
+            [sum(column) / len(window) for column in zip(*window)]
+        results[f'{seconds}s window'] = {
+            'mean_us': timeIt(lambda: ring.mean(seconds), 200) * 1e6,
+            'percentile_us': timeIt(lambda: ring.percentile(seconds, 95), 50) * 1e6,
+            'integral_us': timeIt(lambda: ring.integral(seconds, [1, 3, 5]), 200) * 1e6,
+            'deque_mean_us': timeIt(dequeMean, 5) * 1e6,
+        }
+    return results
+
+
+if __name__ == "__main__":
+    results = run()
+    ingest = results.pop('ingest')
+    print(f'ingest  ring {ingest["ring_per_s"]:10.0f} samples/s   deque {ingest["deque_per_s"]:10.0f} samples/s')
+    for name, result in results.items():
+        print(f'{name:11} mean {result["mean_us"]:8.1f} us  p95 {result["percentile_us"]:8.1f} us  '
+              f'mAh {result["integral_us"]:8.1f} us   deque mean {result["deque_mean_us"]:9.1f} us')
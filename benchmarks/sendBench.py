@@ -0,0 +1,68 @@
+# Compares the old send path (pickle into one bytes object, then a sendall for
+# the length and another for the body) against sendPyObject, which pickles
+# with protocol 5 out-of-band buffers and writes everything with one sendmsg.
+# The payload is a bytearray, which pickles out-of-band the same way the
+# ndarray from cv2.imencode does.
+# Run from the repo root with: python -m benchmarks.sendBench
+import os
+import pickle
+import struct
+import threading
+import time
+from benchmarks.loopback import loopbackPair
+from benchmarks.loopback import closePair
+
+
+def legacySend(sock, obj):
+    # The send path as it was before scatter-gather
+    packed = pickle.dumps(obj)
+    length = struct.pack('<Q', len(packed))
+    sock.sendall(length)
+    sock.sendall(packed)
+
+
+def drain(sock):
+    scratch = bytearray(1 << 20)
+    while sock.recv_into(scratch):
+        pass
+
+
+def runCase(payloadSize, frames, useLegacy):
+    server, client = loopbackPair()
+    payload = bytearray(os.urandom(payloadSize))
+    drainThread = threading.Thread(target=drain, args=(client.server_socket,))
+    drainThread.start()
+
+    start = time.perf_counter()
+    cpuStart = time.thread_time()
+    for _ in range(frames):
+        if useLegacy:
+            legacySend(server.client_socket, payload)
+        else:
+            server.sendPyObject(payload)
+    cpu = time.thread_time() - cpuStart
+    elapsed = time.perf_counter() - start
+
+    server.client_socket.close()
+    drainThread.join()
+    closePair(server, client)
+    return {
+        'mb_per_s': payloadSize * frames / elapsed / 1e6,
+        'cpu_us_per_frame': cpu / frames * 1e6,
+    }
+
+
+def run(frames=2000):
+    results = {}
+    for size in (30 * 1024, 100 * 1024):
+        results[f'{size // 1024}KB'] = {
+            'legacy': runCase(size, frames, True),
+            'sendmsg': runCase(size, frames, False),
+        }
+    return results
+
+
+if __name__ == "__main__":
+    for size, cases in run().items():
+        for name, result in cases.items():
+            print(f'{size:6} {name:10} {result["mb_per_s"]:9.1f} MB/s {result["cpu_us_per_frame"]:9.1f} us cpu/frame')
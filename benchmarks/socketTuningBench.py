@@ -0,0 +1,108 @@
+# What TrafficClass does for video over a slow link. The robot side sends
+# 100 KB frames at up to 30 fps (more than the link carries) on one
+# connection and a command every 20 ms on another, like the camera server
+# and robot-local-main. Each frame is stamped when the sender picks it up,
+# the client times how old frames and commands are when they arrive.
+# Everything goes through a throttledLink.
+#  - plain: sockets as the OS makes them, frames queue up in the kernel's
+#    send buffer faster than the link drains it
+#  - tuned: both connections with their TrafficClass, TCP_NOTSENT_LOWAT
+#    makes the send block instead so every frame that goes out is fresh
+# The TOS byte and SO_PRIORITY do nothing on loopback, only on a real link.
+# Run from the repo root with: python -m benchmarks.socketTuningBench
+import os
+import threading
+import time
+import numpy as np
+from networkmodule import TrafficClass
+from robotTelemModule import commandData
+from benchmarks.throttledLink import throttledLink
+from benchmarks.loopback import closePair
+
+linkRate = 2_000_000  # Bytes/s, about 16 Mbit/s of useful Wi-Fi
+frameSize = 100 * 1024
+fps = 30
+commandInterval = 0.02
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[int(len(values) * share)] * 1000 if values else None
+
+
+def runCase(tuned, duration=5.0):
+    link = throttledLink(linkRate)
+    video = link.pair(TrafficClass.VIDEO if tuned else None)
+    control = link.pair(TrafficClass.CONTROL if tuned else None)
+    stop = threading.Event()
+    sentAt = {}
+    commandLatencies = []
+    frameAges = []
+
+    def videoSender():
+        frame = np.frombuffer(os.urandom(frameSize), dtype=np.uint8)
+        nextFrame = time.perf_counter()
+        while not stop.is_set():
+            video[0].sendPyObject((time.perf_counter(), frame))
+            nextFrame = max(nextFrame + 1 / fps, time.perf_counter())
+            stop.wait(nextFrame - time.perf_counter())
+
+    def videoReceiver():
+        while True:
+            received = video[1].receivePyObject()
+            if video[1].isFailure(received):
+                return
+            if not stop.is_set():
+                frameAges.append(time.perf_counter() - received[0])
+
+    def commandReceiver():
+        while True:
+            received = control[1].receivePyObject()
+            if control[1].isFailure(received):
+                return
+            commandLatencies.append(time.perf_counter() - sentAt[received.ma])
+
+    for target in (videoSender, videoReceiver, commandReceiver):
+        threading.Thread(target=target, daemon=True).start()
+
+    time.sleep(1.0)  # Let the link fill up
+    del frameAges[:]
+    command = commandData()
+    commandsSent = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        command.ma = commandsSent
+        sentAt[commandsSent] = time.perf_counter()
+        control[0].sendPyObject(command)
+        commandsSent += 1
+        time.sleep(commandInterval)
+    frameRate = len(frameAges) / duration
+    stop.set()
+    time.sleep(0.5)  # Give stragglers a chance
+    link.close()
+    closePair(*video)
+    closePair(*control)
+
+    return {
+        'commands_sent': commandsSent,
+        'commands_received': len(commandLatencies),
+        'command_p50_ms': percentile(commandLatencies, 0.5),
+        'command_p99_ms': percentile(commandLatencies, 0.99),
+        'frame_age_p50_ms': percentile(frameAges, 0.5),
+        'frame_age_p99_ms': percentile(frameAges, 0.99),
+        'video_fps': frameRate,
+        'video_mb_per_s': frameRate * frameSize / 1e6,
+    }
+
+
+def run():
+    return {'plain': runCase(False), 'tuned': runCase(True)}
+
+
+if __name__ == "__main__":
+    print(f'Link {linkRate / 1e6:.1f} MB/s, video offered {frameSize * fps / 1e6:.1f} MB/s')
+    for name, result in run().items():
+        print(f'{name:6} commands {result["commands_received"]}/{result["commands_sent"]} '
+              f'p50 {result["command_p50_ms"]:6.1f} ms p99 {result["command_p99_ms"]:6.1f} ms  '
+              f'frame age p50 {result["frame_age_p50_ms"]:7.1f} ms p99 {result["frame_age_p99_ms"]:7.1f} ms  '
+              f'video {result["video_fps"]:5.1f} fps {result["video_mb_per_s"]:.2f} MB/s')
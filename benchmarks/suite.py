@@ -0,0 +1,102 @@
+# Runs a set of benchmarks and writes the results as JSON together with the
+# commit they were run on, so two commits can be compared:
+#   python -m benchmarks.suite --output before.json
+#   (change things)
+#   python -m benchmarks.suite --output after.json --compare before.json
+# Names on the command line pick benchmarks, default is the network, codec
+# and camera set. "all" adds the slow ones (MCU over pty, metrics, ...).
+# Only numbers are compared, with a percentage change for each.
+import argparse
+import importlib
+import json
+import platform
+import subprocess
+import sys
+import time
+
+defaultBenchmarks = ['messageBench', 'jpegBench', 'codecBench', 'sendBench', 'recvBench', 'linkStatsBench', 'pipelineBench', 'changeBench', 'telemetryBytesBench', 'compressionBench']
+slowBenchmarks = ['asyncServeBench', 'broadcastBench', 'udpLossBench', 'controlLoopBench', 'mcuTickBench', 'mcuProtocolBench',
+                  'powerStreamBench', 'sampleRingBench', 'recorderBench', 'metricsTickBench', 'adaptiveQualitySim', 'robotLoopBench', 'socketTuningBench', 'guiStallBench', 'viewerBench', 'commandTrafficBench']
+
+
+def gitCommit():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True)
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True)
+    except OSError:
+        return "unknown"
+    if result.returncode != 0:
+        return "unknown"
+    return result.stdout.strip() + ("-dirty" if dirty.stdout.strip() else "")
+
+
+def toJson(value):
+    # numpy scalars and anything else json can't handle on its own
+    if hasattr(value, 'item'):
+        return value.item()
+    return str(value)
+
+
+def runBenchmarks(names):
+    results = {}
+    for name in names:
+        print(f"Running {name}", file=sys.stderr)
+        module = importlib.import_module(f'benchmarks.{name}')
+        start = time.perf_counter()
+        results[name] = module.run()
+        print(f"  done in {time.perf_counter() - start:.1f} s", file=sys.stderr)
+    return {
+        'commit': gitCommit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'results': results,
+    }
+
+
+def numbers(value, path=''):
+    # Flattens nested dicts into {'bench/case/metric': number}
+    if isinstance(value, bool):
+        return {}
+    if isinstance(value, (int, float)):
+        return {path: value}
+    flat = {}
+    if isinstance(value, dict):
+        for key, item in value.items():
+            flat.update(numbers(item, f'{path}/{key}' if path else str(key)))
+    return flat
+
+
+def compare(old, new):
+    oldNumbers = numbers(old['results'])
+    newNumbers = numbers(new['results'])
+    print(f"{old['commit']} -> {new['commit']}")
+    for path, newValue in newNumbers.items():
+        if path not in oldNumbers:
+            continue
+        oldValue = oldNumbers[path]
+        change = f"{(newValue - oldValue) / abs(oldValue) * 100:+7.1f}%" if oldValue else "    n/a"
+        print(f"{path:70} {oldValue:14.4f} {newValue:14.4f} {change}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run benchmarks and write machine readable results")
+    parser.add_argument('names', nargs='*', help="benchmark modules to run, 'all' for every one")
+    parser.add_argument('--output', help="write the results to this JSON file")
+    parser.add_argument('--compare', help="compare the results against an earlier JSON file")
+    arguments = parser.parse_args()
+
+    names = arguments.names or defaultBenchmarks
+    if names == ['all']:
+        names = defaultBenchmarks + slowBenchmarks
+    report = runBenchmarks(names)
+    text = json.dumps(report, indent=2, default=toJson)
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+    if arguments.compare:
+        with open(arguments.compare) as file:
+            compare(json.load(file), report)
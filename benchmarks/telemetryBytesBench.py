@@ -0,0 +1,110 @@
+# Telemetry link bytes for a drive, full telemData every tick against the
+# telemPublisher deltas. The telemetry is simulated at 20 Hz the way the
+# robot builds it: INA3221 readings with sensor noise, motor current that
+# follows commandTrafficBench's drive script, battery sag under load, and
+# system metrics changing as often as systemMetrics.py samples them. Every
+# message is encoded as robot-local-main sends it (timestamps on), decoded
+# and merged like gui-client does, and compared to the robot's own values.
+# Bytes are the messages themselves, TCP/IP headers not included.
+# Run from the repo root with: python -m benchmarks.telemetryBytesBench
+import random
+from robotTelemModule import telemData
+from robotTelemModule import mergeTelem
+from robotTelemModule import deltaFields
+from networkmodule import encodeMessage
+from networkmodule import decodeMessage
+from telemPublisher import telemPublisher
+from benchmarks.commandTrafficBench import driveScript
+
+telemetryRate = 20
+duration = 120.0
+battSize = 6500
+stamp = (0.0, 0.0, 0.0)
+errorGroups = {
+    'volts': ('ch1volt', 'ch2volt', 'ch3volt', 'avgVolt'),
+    'ma': ('ch1ma', 'ch2ma', 'ch3ma', 'avgMa', 'totalMa'),
+    'percent': ('voltageBatteryPercent',),
+    'cpu_usage': ('cpu_usage',),
+}
+
+
+def dutyAt(t):
+    t %= sum(segment[0] for segment in driveScript)
+    for seconds, ma, mb in driveScript:
+        if t < seconds:
+            return ma, mb
+        t -= seconds
+    return 0, 0
+
+
+def driveTelemetry(seed=1):
+    # One telemData per tick over duration
+    rng = random.Random(seed)
+    smoothVolt = 12.4
+    metrics = {'cpu_usage': 22.0, 'ram_usage': 38.5, 'cpu_temp': 52.0, 'wifiSignal': -58}
+    for tick in range(int(duration * telemetryRate)):
+        t = tick / telemetryRate
+        ma, mb = dutyAt(t)
+        rest = 12.4 - t * 0.0005  # Slow drain over the run
+        currents = [400 + abs(ma) / 255 * 1500, 400 + abs(mb) / 255 * 1500, 120.0]
+        currents = [current + rng.gauss(0, 3.0) for current in currents]
+        volts = [rest - sum(currents) * 0.0001 + rng.gauss(0, 0.004) for _ in range(3)]
+        telem = telemData()
+        (telem.ch1volt, telem.ch2volt, telem.ch3volt) = volts
+        (telem.ch1ma, telem.ch2ma, telem.ch3ma) = currents
+        telem.avgVolt = round(sum(volts) / 3, 2)
+        telem.avgMa = round(sum(currents) / 3, 2)
+        telem.totalMa = sum(currents)
+        smoothVolt += (sum(volts) / 3 - smoothVolt) / (30 * telemetryRate)  # pwrSubSystem's 30 s smoothing
+        telem.voltageBatteryPercent = (smoothVolt - 9.0) / (12.70 - 9.0) * 100
+        telem.timeLeft = round(battSize * telem.voltageBatteryPercent / 100 / telem.totalMa, 2)
+        if tick % telemetryRate == 0:
+            metrics['cpu_usage'] = round(rng.uniform(15, 35), 1)
+        if tick % (5 * telemetryRate) == 0:
+            metrics['ram_usage'] = round(metrics['ram_usage'] + rng.uniform(-0.3, 0.3), 1)
+            metrics['cpu_temp'] = round(metrics['cpu_temp'] + rng.uniform(-1, 1), 1)
+        if tick % (2 * telemetryRate) == 0:
+            metrics['wifiSignal'] = -58 + rng.randint(-3, 3)
+        for field, value in metrics.items():
+            setattr(telem, field, value)
+        yield t, telem
+
+
+def runCase(publisher=None):
+    sentBytes = 0
+    messages = 0
+    shown = None
+    worst = {group: 0.0 for group in errorGroups}
+    for t, telem in driveTelemetry():
+        message = telem if publisher is None else publisher.publish(telem, t)
+        if message is not None:
+            encoded = b''.join(encodeMessage(message, stamp))
+            sentBytes += len(encoded)
+            messages += 1
+            shown = mergeTelem(shown, decodeMessage(encoded))
+        for group, fields in errorGroups.items():
+            for field in fields:
+                worst[group] = max(worst[group], abs(getattr(shown, field) - getattr(telem, field)))
+    result = {
+        'bytes_per_s': sentBytes / duration,
+        'messages_per_s': messages / duration,
+    }
+    result.update({f'max_error_{group}': error for group, error in worst.items()})
+    return result
+
+
+def run():
+    return {
+        'full every tick': runCase(),
+        'deltas': runCase(telemPublisher()),
+        'deltas, no deadband': runCase(telemPublisher(deadbands={field: 0 for field in deltaFields})),
+        'deltas, 5 s keyframes': runCase(telemPublisher(keyframeInterval=5.0)),
+    }
+
+
+if __name__ == "__main__":
+    print(f'{duration:.0f} s of {telemetryRate} Hz telemetry while driving')
+    for name, result in run().items():
+        print(f'{name:22} {result["bytes_per_s"]:7.0f} bytes/s  {result["messages_per_s"]:5.1f} msgs/s  '
+              f'max error {result["max_error_volts"]:.3f} V  {result["max_error_ma"]:.1f} mA  '
+              f'{result["max_error_percent"]:.2f} % battery  {result["max_error_cpu_usage"]:.1f} % cpu')
@@ -0,0 +1,104 @@
+# A slow link for benchmarks: a TCP relay on loopback that forwards at a
+# fixed rate through one small FIFO shared by every connection and both
+# directions, roughly what a busy Wi-Fi link looks like to the robot.
+# Bytes queue up in the FIFO (at most bufferBytes of them) and then in the
+# senders' own sockets, like they would in the access point and the kernel.
+import socket
+import threading
+import time
+from collections import deque
+from networkmodule import robotNetworkModule
+from networkmodule import ConnModes
+from networkmodule import TrafficClass
+
+relayBuffer = 16 * 1024  # Socket buffers on the relay, keeps hidden queuing small
+
+
+class throttledLink():
+
+    def __init__(self, rate, bufferBytes=32 * 1024) -> None:
+        self.rate = rate  # Bytes/s
+        self.bufferBytes = bufferBytes
+        self.queue = deque()
+        self.queuedBytes = 0
+        self.condition = threading.Condition()
+        self.running = True
+        self.sockets = []
+        threading.Thread(target=self.drain, daemon=True).start()
+
+    def route(self, targetPort):
+        # Returns a port that forwards to targetPort on loopback through the link
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, relayBuffer)
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+        self.sockets.append(listener)
+
+        def accept():
+            try:
+                incoming, _ = listener.accept()
+            except OSError:
+                return
+            outgoing = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            outgoing.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, relayBuffer)
+            outgoing.connect(("127.0.0.1", targetPort))
+            for sock in (incoming, outgoing):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                self.sockets.append(sock)
+            threading.Thread(target=self.pump, args=(incoming, outgoing), daemon=True).start()
+            threading.Thread(target=self.pump, args=(outgoing, incoming), daemon=True).start()
+
+        threading.Thread(target=accept, daemon=True).start()
+        return listener.getsockname()[1]
+
+    def pump(self, source, destination):
+        # Moves data into the FIFO as fast as there's room for it
+        while self.running:
+            try:
+                data = source.recv(4096)
+            except OSError:
+                return
+            if not data:
+                return
+            with self.condition:
+                self.condition.wait_for(lambda: not self.running or self.queuedBytes < self.bufferBytes)
+                self.queue.append((destination, data))
+                self.queuedBytes += len(data)
+                self.condition.notify_all()
+
+    def drain(self):
+        # Delivers the FIFO in order at rate bytes/s
+        nextSend = time.perf_counter()
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: not self.running or self.queue)
+                if not self.running:
+                    return
+                destination, data = self.queue.popleft()
+                self.queuedBytes -= len(data)
+                self.condition.notify_all()
+            nextSend = max(nextSend + len(data) / self.rate, time.perf_counter())
+            delay = nextSend - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                destination.sendall(data)
+            except OSError:
+                pass
+
+    def pair(self, trafficClass: TrafficClass = None):
+        # robotNetworkModule server and client connected through the link
+        server = robotNetworkModule(ConnModes.SERVER, "127.0.0.1", 0, trafficClass=trafficClass)
+        port = self.route(server.sock.getsockname()[1])
+        acceptThread = threading.Thread(target=server.waitForConnection)
+        acceptThread.start()
+        client = robotNetworkModule(ConnModes.CLIENT, "127.0.0.1", port, trafficClass=trafficClass)
+        acceptThread.join()
+        return server, client
+
+    def close(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        for sock in self.sockets:
+            sock.close()
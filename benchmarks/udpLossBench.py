@@ -0,0 +1,107 @@
+# Streams frame-sized messages through udpFrameSender -> lossy proxy ->
+# udpFrameReceiver over loopback. The proxy drops and reorders datagrams,
+# the receiver should keep delivering whole frames with low latency, rebuild
+# single lost fragments from parity and discard the frames it can't rebuild
+# instead of waiting for them.
+# Run from the repo root with: python -m benchmarks.udpLossBench
+import os
+import random
+import select
+import socket
+import threading
+import time
+from udpnetworkmodule import udpFrameSender
+from udpnetworkmodule import udpFrameReceiver
+
+
+def lossyProxy(senderPort, loss, reorder, stop, seed=1):
+    # Forwards viewer -> sender untouched and sender -> viewer with loss and
+    # reordering (a held back datagram is released a few datagrams later)
+    rng = random.Random(seed)
+    viewerSide = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    viewerSide.bind(("127.0.0.1", 0))
+    senderSide = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    senderSide.connect(("127.0.0.1", senderPort))
+    viewerAddress = [None]
+    held = []
+
+    def forward():
+        while not stop.is_set():
+            ready, _, _ = select.select([viewerSide, senderSide], [], [], 0.1)
+            if viewerSide in ready:
+                data, viewerAddress[0] = viewerSide.recvfrom(2048)
+                senderSide.send(data)
+            if senderSide in ready:
+                data = senderSide.recv(2048)
+                if viewerAddress[0] is None or rng.random() < loss:
+                    continue
+                if rng.random() < reorder:
+                    held.append([rng.randint(1, 8), data])
+                    continue
+                viewerSide.sendto(data, viewerAddress[0])
+                for entry in held:
+                    entry[0] -= 1
+                for entry in [entry for entry in held if entry[0] <= 0]:
+                    viewerSide.sendto(entry[1], viewerAddress[0])
+                    held.remove(entry)
+        viewerSide.close()
+        senderSide.close()
+
+    threading.Thread(target=forward, daemon=True).start()
+    return viewerSide.getsockname()[1]
+
+
+def runCase(loss, reorder, frames=300, frameSize=30 * 1024, fps=30):
+    sender = udpFrameSender("127.0.0.1", 0)
+    stop = threading.Event()
+    proxyPort = lossyProxy(sender.port, loss, reorder, stop)
+    receiver = udpFrameReceiver("127.0.0.1", proxyPort)
+    padding = os.urandom(frameSize)
+
+    def send():
+        time.sleep(0.2)  # Let the subscription get through
+        for i in range(frames):
+            sender.sendFrame({'sent': time.perf_counter(), 'index': i, 'data': padding})
+            time.sleep(1 / fps)
+
+    sendThread = threading.Thread(target=send)
+    sendThread.start()
+    latencies = []
+    outOfOrder = 0
+    lastIndex = -1
+    while True:
+        frame = receiver.receiveFrame(timeout=1.0)
+        if isinstance(frame, dict):
+            latencies.append(time.perf_counter() - frame['sent'])
+            if frame['index'] <= lastIndex:
+                outOfOrder += 1
+            lastIndex = frame['index']
+        elif not sendThread.is_alive():
+            break
+    sendThread.join()
+    stop.set()
+    sender.close()
+    receiver.close()
+    latencies.sort()
+    return {
+        'loss': loss,
+        'reorder': reorder,
+        'delivered': len(latencies) / frames,
+        'dropped_incomplete': receiver.framesDropped,
+        'late_fragments': receiver.fragmentsLate,
+        'recovered_fragments': receiver.fragmentsRecovered,
+        'out_of_order_frames': outOfOrder,
+        'p50_ms': latencies[len(latencies) // 2] * 1000 if latencies else 0.0,
+        'max_ms': latencies[-1] * 1000 if latencies else 0.0,
+    }
+
+
+def run():
+    return [runCase(0.0, 0.0), runCase(0.01, 0.02), runCase(0.05, 0.05)]
+
+
+if __name__ == "__main__":
+    for result in run():
+        print(f'loss {result["loss"]:4.0%} reorder {result["reorder"]:4.0%}: delivered {result["delivered"]:5.1%} '
+              f'dropped {result["dropped_incomplete"]:3} recovered {result["recovered_fragments"]:4} late fragments {result["late_fragments"]:4} '
+              f'out of order {result["out_of_order_frames"]} latency p50 {result["p50_ms"]:5.2f} ms max {result["max_ms"]:5.2f} ms')
@@ -0,0 +1,107 @@
+# cameraServerViewer's old serial receive -> decode -> show loop against
+# the receive/decode stages it uses now, over loopback with real 1280x720
+# JPEG decodes. The server sends at fps, showing a frame is played as a
+# sleep of displayTime (imshow needs a display) which makes the serial loop
+# slower than the stream. Latency is from the server sending a frame to it
+# being shown, frames arrive in order so the viewer knows which one it got.
+# Run from the repo root with: python -m benchmarks.viewerBench
+import threading
+import time
+import cv2
+from cameraPipeline import frameUpdates
+from cameraPipeline import frameAssembler
+from cameraPipeline import pipelineStage
+from latestslot import latestSlot
+from benchmarks.loopback import loopbackPair
+from benchmarks.loopback import closePair
+from benchmarks.jpegBench import syntheticFrame
+from benchmarks.jpegBench import encodeJpeg
+
+fps = 30
+displayTime = 0.03
+reducedDecode = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4}
+
+
+def streamFrames(server, sendTimes, stop):
+    buffer = encodeJpeg(syntheticFrame(1280, 720), 80)
+    nextFrame = time.perf_counter()
+    while not stop.is_set():
+        sendTimes.append(time.perf_counter())
+        if server.isFailure(server.sendPyObject(buffer)):
+            return
+        nextFrame += 1 / fps
+        stop.wait(max(0.0, nextFrame - time.perf_counter()))
+
+
+def runSerial(client, sendTimes, end, scale):
+    latencies = []
+    received = 0
+    while time.perf_counter() < end:
+        buffer = client.receivePyObject()
+        received += 1
+        cv2.imdecode(buffer, reducedDecode[scale])
+        time.sleep(displayTime)
+        latencies.append(time.perf_counter() - sendTimes[received - 1])
+    return latencies, received
+
+
+def runPipelined(client, sendTimes, end, scale):
+    # Same stages as the viewer, except the receive stage stamps each frame
+    # with its send time so the display sees the whole latency
+    updates = frameUpdates()
+    decoded = latestSlot()
+    assembler = frameAssembler(lambda buffer: cv2.imdecode(buffer, reducedDecode[scale]), scale)
+    counts = [0]
+
+    def receive():
+        while True:
+            buffer = client.receivePyObject()
+            if client.isFailure(buffer):
+                return
+            counts[0] += 1
+            updates.put((sendTimes[counts[0] - 1], buffer))
+
+    threading.Thread(target=receive, daemon=True).start()
+    pipelineStage("decode", assembler.apply, source=updates, sink=decoded).start()
+    latencies = []
+    while time.perf_counter() < end:
+        item = decoded.take(timeout=0.1)
+        if item is None:
+            continue
+        time.sleep(displayTime)
+        latencies.append(time.perf_counter() - item[0])
+    return latencies, counts[0]
+
+
+def runCase(pipelined, scale=1, duration=6.0):
+    server, client = loopbackPair()
+    sendTimes = []
+    stop = threading.Event()
+    threading.Thread(target=streamFrames, args=(server, sendTimes, stop), daemon=True).start()
+    end = time.perf_counter() + duration
+    latencies, received = (runPipelined if pipelined else runSerial)(client, sendTimes, end, scale)
+    sent = len(sendTimes)
+    stop.set()
+    closePair(server, client)
+    latencies.sort()
+    return {
+        'shown_fps': len(latencies) / duration,
+        'latency_p50_ms': latencies[len(latencies) // 2] * 1000,
+        'latency_max_ms': latencies[-1] * 1000,
+        'backlog_frames': sent - received,  # Sent but still sitting in socket buffers at the end
+    }
+
+
+def run():
+    return {
+        'serial': runCase(False),
+        'pipelined': runCase(True),
+        'pipelined 1/2 decode': runCase(True, scale=2),
+    }
+
+
+if __name__ == "__main__":
+    print(f'{fps} fps of 1280x720 JPEG, {displayTime * 1000:.0f} ms to show a frame')
+    for name, result in run().items():
+        print(f'{name:21} {result["shown_fps"]:5.1f} fps shown  latency p50 {result["latency_p50_ms"]:7.1f} ms '
+              f'max {result["latency_max_ms"]:7.1f} ms  {result["backlog_frames"]} frames backed up')
@@ -0,0 +1,518 @@
+import asyncio
+import collections
+import logging
+import math
+import threading
+import time
+import numpy as np
+from networkmodule import FailureType
+from latestslot import latestSlot
+from timingstats import stageStats
+
+# Building blocks for cameraServer that don't need the camera or cv2 so they
+# can be exercised on their own.
+
+
+class frameRepeat():
+    # Sent instead of a frame when nothing changed, the viewer keeps showing
+    # the last one
+    __slots__ = ()
+
+
+class frameTiles():
+    # Only the parts of the picture that changed. tiles is a list of
+    # (x, y, jpegBuffer) to be pasted onto the last frame at pixel x, y.
+    __slots__ = ('tiles',)
+
+    def __init__(self, tiles) -> None:
+        self.tiles = tiles
+
+
+class frameDiffer():
+    # Decides which tiles of a frame changed enough to be worth sending.
+    # Tiles are tileSize square, the ones on the right/bottom edge may be
+    # cut short by the frame.
+    # Works on a subsampled single channel copy so it's a handful of small
+    # vectorized NumPy ops per frame. Each tile is compared against what the
+    # viewer was last sent for it, so slow drift still gets sent eventually.
+
+    def __init__(self, threshold=6.0, tileSize=64, subsample=8) -> None:
+        self.threshold = threshold  # Mean abs difference (0-255) for a tile to count as changed
+        self.tileSize = tileSize  # Pixels, multiple of subsample
+        self.subsample = subsample
+        self.reference = None
+        self.current = None
+        self.keyframeWanted = True
+
+    def requestKeyframe(self):
+        # Next compare() reports every tile as changed (e.g. a viewer joined)
+        self.keyframeWanted = True
+
+    def compare(self, frame):
+        # Returns a bool array with one entry per tile, True where it changed.
+        # Call accept() with it for the tiles that actually got sent.
+        self.current = frame[::self.subsample, ::self.subsample, 1].astype(np.int16)
+        if self.keyframeWanted or self.reference is None or self.reference.shape != self.current.shape:
+            self.keyframeWanted = False
+            return np.ones(self.tileGrid(self.current.shape), dtype=bool)
+
+        step = self.tileSize // self.subsample
+        rows, cols = self.tileGrid(self.current.shape)
+        diff = np.abs(self.current - self.reference)
+        # Pad out partial tiles at the edges so it reshapes into whole tiles
+        padded = np.zeros((rows * step, cols * step), dtype=np.int16)
+        padded[:diff.shape[0], :diff.shape[1]] = diff
+        tileDiff = padded.reshape(rows, step, cols, step).mean(axis=(1, 3))
+        return tileDiff > self.threshold
+
+    def accept(self, changed):
+        # Remember what the viewer now has for the changed tiles
+        if changed.all():
+            self.reference = self.current
+            return
+        step = self.tileSize // self.subsample
+        for row, col in zip(*np.nonzero(changed)):
+            rowSlice = slice(row * step, (row + 1) * step)
+            colSlice = slice(col * step, (col + 1) * step)
+            self.reference[rowSlice, colSlice] = self.current[rowSlice, colSlice]
+
+    def tileGrid(self, smallShape):
+        step = self.tileSize // self.subsample
+        return (-(-smallShape[0] // step), -(-smallShape[1] // step))
+
+    def tileOrigins(self, changed):
+        # Full resolution (x, y) of the top left corner of every changed tile
+        for row, col in zip(*np.nonzero(changed)):
+            yield (int(col) * self.tileSize, int(row) * self.tileSize)
+
+
+class changeEncoder():
+    # Turns each frame into a full JPEG, frameTiles with just the changed
+    # tiles, or frameRepeat if nothing moved. encodeJpeg(image, quality) does
+    # the actual encoding. output is the slot our results go into, if the
+    # previous result is still sitting there unsent when we make the next one
+    # its tiles get folded into the new one.
+
+    def __init__(self, encodeJpeg, threshold=6.0, maxTileFraction=0.5, keyframeInterval=2.0,
+                 output: latestSlot = None) -> None:
+        self.encodeJpeg = encodeJpeg
+        self.differ = frameDiffer(threshold)
+        self.maxTileFraction = maxTileFraction
+        self.keyframeInterval = keyframeInterval
+        self.output = output
+        self.unsentTiles = None
+        self.lastKeyframe = 0.0
+
+    def requestKeyframe(self):
+        self.differ.requestKeyframe()
+
+    def encode(self, frame, quality, now=None):
+        if now is None:
+            now = time.perf_counter()
+        changed = self.differ.compare(frame)
+        if (self.output is not None and self.output.sequence != self.output.taken
+                and self.unsentTiles is not None and self.unsentTiles.shape == changed.shape):
+            changed |= self.unsentTiles
+        if now - self.lastKeyframe > self.keyframeInterval:
+            changed[:] = True
+        self.differ.accept(changed)
+        self.unsentTiles = changed
+
+        if not changed.any():
+            return frameRepeat()
+        if changed.mean() > self.maxTileFraction:
+            self.lastKeyframe = now
+            return self.encodeJpeg(frame, quality)
+        tileSize = self.differ.tileSize
+        tiles = []
+        for x, y in self.differ.tileOrigins(changed):
+            tiles.append((x, y, self.encodeJpeg(frame[y:y + tileSize, x:x + tileSize], quality)))
+        return frameTiles(tiles)
+
+
+class frameUpdates():
+    # Viewer side handoff from receiving to decoding, latest wins like a
+    # latestSlot except that frameTiles only make sense on top of what came
+    # before them. take() hands back everything since the last take, which
+    # is at most one full frame followed by the tiles that arrived after it.
+    # A full frame throws away whatever is still waiting (counted in
+    # dropped), it covers all of it. Items are (receiveTime, update) like in
+    # a latestSlot, the time handed back is that of the oldest update.
+
+    def __init__(self) -> None:
+        self.updates = []
+        self.since = None
+        self.dropped = 0
+        self.condition = threading.Condition()
+
+    def put(self, item):
+        receiveTime, update = item
+        if isinstance(update, frameRepeat):
+            return  # Nothing to redo
+        with self.condition:
+            if not isinstance(update, frameTiles):
+                self.dropped += len(self.updates)
+                self.updates = []
+                self.since = None
+            if self.since is None:
+                self.since = receiveTime
+            self.updates.append(update)
+            self.condition.notify_all()
+
+    def take(self, timeout=None):
+        # Returns None on timeout
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.updates, timeout):
+                return None
+            item = (self.since, self.updates)
+            self.updates = []
+            self.since = None
+            return item
+
+
+class frameAssembler():
+    # The viewer's half of changeEncoder, turns full frames and frameTiles
+    # back into a picture. decodeJpeg(buffer) does the decoding and returns
+    # None for a bad buffer. scale is how many times smaller it decodes than
+    # what was sent (cv2.IMREAD_REDUCED_*), tile positions are scaled to
+    # match. An image apply() has returned is never changed afterwards, the
+    # display may still be showing it.
+
+    def __init__(self, decodeJpeg, scale=1) -> None:
+        self.decodeJpeg = decodeJpeg
+        self.scale = scale
+        self.image = None
+
+    def apply(self, updates):
+        # Returns the new picture, None if there's nothing new to show
+        image = self.image
+        for update in updates:
+            if isinstance(update, frameRepeat):
+                continue
+            if not isinstance(update, frameTiles):
+                decoded = self.decodeJpeg(update)
+                if decoded is not None:
+                    image = decoded
+                continue
+            if image is None:
+                continue  # Nothing to paste onto until the first full frame
+            if image is self.image:
+                image = image.copy()
+            for x, y, buffer in update.tiles:
+                tile = self.decodeJpeg(buffer)
+                if tile is not None:
+                    self.paste(image, x // self.scale, y // self.scale, tile)
+        if image is self.image:
+            return None
+        self.image = image
+        return image
+
+    def paste(self, image, x, y, tile):
+        height = min(tile.shape[0], image.shape[0] - y)
+        width = min(tile.shape[1], image.shape[1] - x)
+        image[y:y + height, x:x + width] = tile[:height, :width]
+
+
+class pipelineStage(threading.Thread):
+    # Runs work() in its own thread, pulling from source and pushing to sink.
+    # Items in the slots are (captureTime, value) so the last stage can tell
+    # how old a frame is. A stage without a source is the head of the
+    # pipeline and stamps the capture time once its work returns. work() returning None
+    # means there's nothing to pass on this time.
+
+    def __init__(self, name, work, source: latestSlot = None, sink: latestSlot = None) -> None:
+        super().__init__(name=name, daemon=True)
+        self.work = work
+        self.source = source
+        self.sink = sink
+        self.stats = stageStats(name)
+
+    def run(self):
+        while True:
+            if self.source is None:
+                captureTime = None
+                value = None
+            else:
+                captureTime, value = self.source.take()
+            start = time.perf_counter()
+            try:
+                result = self.work(value)
+            except Exception:
+                logging.error(f'Camera pipeline stage {self.name} failed ->', exc_info=True)
+                continue
+            end = time.perf_counter()
+            self.stats.add(end - start)
+            if captureTime is None:
+                captureTime = end
+            if result is not None and self.sink is not None:
+                self.sink.put((captureTime, result))
+
+
+class qualityController():
+    # Closed loop JPEG quality / downscale picker. Fed the size and send time
+    # of every message it keeps a smoothed estimate of what the link can carry
+    # (sendall blocks once the socket buffer is full, so blocking sends tell
+    # us the real link rate) and steers quality so the bytes actually sent
+    # per second stay at headroom of that, or targetBitrate if that's lower.
+    # That's measured over everything sent at whatever rate frames go out,
+    # tiles and repeats included. Quality moves first, the scale only
+    # changes once quality runs out of range. A weak wifi signal makes it
+    # back off before the link actually starts to struggle.
+
+    def __init__(self, targetFps=20, targetBitrate=None, minQuality=20, maxQuality=80,
+                 scales=(1.0, 0.75, 0.5, 0.35)) -> None:
+        self.targetFps = targetFps
+        self.targetBitrate = targetBitrate  # bits/s, None for as much as the link allows
+        self.minQuality = minQuality
+        self.maxQuality = maxQuality
+        self.scales = scales
+        self.quality = (minQuality + maxQuality) // 2
+        self.scaleIndex = 0
+        self.bandwidth = None  # bytes/s
+        self.signalDbm = None
+        self.holdFrames = 0
+
+        self.smoothing = 0.2  # EMA weight of the newest bandwidth sample
+        self.headroom = 0.8  # Only plan to use this much of the estimated bandwidth
+        self.qualityGain = 15  # Quality steps per e-fold of size error
+        self.scaleHold = 15  # Frames to leave the scale alone after changing it
+        self.weakSignal = -75  # dbm
+        self.weakSignalFactor = 0.7
+        self.unblockedFraction = 0.25  # Sends quicker than this share of a frame interval didn't block
+        self.probeRate = 1.0  # Growth per second of the bandwidth estimate while sends aren't blocking
+        self.probeUse = 0.9  # Share of the budget in use before the estimate is probed up
+        self.probeHold = 20.0  # Seconds after the link was last busy before probing again
+        self.lastBusyAt = None
+        self.lastFullFrame = None
+        self.rateWindow = 1.0  # Seconds of sends the send rate is measured over
+        self.lastUpdate = None
+        self.lastBlocked = False
+        self.sends = collections.deque()  # (time, bytes, fullFrame) of the sends in the last rateWindow
+        self.windowBytes = 0
+        self.windowFrames = 0  # Full frames in the window
+        self.windowFrameBytes = 0
+
+    @property
+    def scale(self):
+        return self.scales[self.scaleIndex]
+
+    def setSignal(self, signalDbm):
+        self.signalDbm = signalDbm
+
+    def budget(self):
+        # Bytes per second we're aiming for
+        if self.bandwidth is None:
+            budget = math.inf
+        else:
+            budget = self.bandwidth * self.headroom
+        if self.targetBitrate is not None:
+            budget = min(budget, self.targetBitrate / 8)
+        if self.signalDbm is not None and self.signalDbm < self.weakSignal:
+            budget *= self.weakSignalFactor
+        return budget
+
+    def sendRate(self, frameBytes, now):
+        # Bytes per second we'd send if every full frame was frameBytes: the
+        # last rateWindow of sends scaled by how this frame compares to the
+        # full frames in it. Follows a quality change straight away instead
+        # of a window later.
+        while self.sends and self.sends[0][0] <= now - self.rateWindow:
+            _, oldBytes, oldFull = self.sends.popleft()
+            self.windowBytes -= oldBytes
+            if oldFull:
+                self.windowFrames -= 1
+                self.windowFrameBytes -= oldBytes
+        return self.windowBytes / self.rateWindow * frameBytes * self.windowFrames / self.windowFrameBytes
+
+    def addSample(self, sample):
+        # Straight down, a blocked send is as sure a sign we're over as we get
+        if self.bandwidth is None or sample < self.bandwidth:
+            self.bandwidth = sample
+        else:
+            self.bandwidth += self.smoothing * (sample - self.bandwidth)
+
+    def update(self, frameBytes, sendTime, now=None, fullFrame=True):
+        # Called for every message sent. Tiles and repeats (fullFrame False)
+        # are sized by how much of the picture changed, not by quality, so
+        # they only feed the bandwidth estimate. They still have to come
+        # through here or the next full frame's interval would span them all.
+        if now is None:
+            now = time.perf_counter()
+        interval = now - self.lastUpdate if self.lastUpdate is not None else sendTime
+        self.lastUpdate = now
+        if frameBytes <= 0 or sendTime <= 0 or interval <= 0:
+            return
+        self.sends.append((now, frameBytes, fullFrame))
+        self.windowBytes += frameBytes
+        if fullFrame:
+            self.windowFrames += 1
+            self.windowFrameBytes += frameBytes
+        blocked = sendTime >= self.unblockedFraction / self.targetFps
+        # Only when the send before this one blocked too was the socket buffer
+        # already full when this one started, so the link was busy the whole
+        # interval and drained exactly this message in it. Otherwise part of
+        # it went straight into free buffer space and bytes / interval would
+        # come out too high.
+        busy = blocked and self.lastBlocked
+        self.lastBlocked = blocked
+        if busy:
+            self.lastBusyAt = now
+        if not fullFrame:
+            if busy:
+                self.addSample(frameBytes / interval)
+            return
+
+        if busy:
+            self.addSample(frameBytes / interval)
+        rate = self.sendRate(frameBytes, now)
+        if busy:
+            # A busy link caps what gets sent at its own rate, so the window
+            # understates what we're trying to send by however many messages
+            # a second fell short of targetFps
+            rate *= max(1.0, self.targetFps * self.rateWindow / len(self.sends))
+        budget = self.budget()
+        sinceFrame = now - self.lastFullFrame if self.lastFullFrame is not None else 0.0
+        self.lastFullFrame = now
+        if (self.bandwidth is not None and rate >= self.probeUse * budget
+                and (self.lastBusyAt is None or now - self.lastBusyAt > self.probeHold)):
+            # Using what we planned and the link hasn't been busy for a while, so
+            # the link kept up. That says nothing about its rate, only that
+            # there's room, so creep up. Probing pushes the send rate past
+            # headroom until the link gets busy, holding off after that keeps it
+            # to a short spell every probeHold.
+            self.bandwidth *= (1 + self.probeRate) ** sinceFrame
+        if budget == math.inf:
+            step = 0 if busy else 1  # Nothing measured yet to say by how much
+        else:
+            step = round(self.qualityGain * math.log(budget / rate))
+            # Never up while the link is busy, it says we're already over
+            step = max(-20, min(0 if busy else 5, step))
+        self.quality += step
+
+        if self.holdFrames > 0:
+            self.holdFrames -= 1
+        elif self.quality < self.minQuality and self.scaleIndex < len(self.scales) - 1:
+            # Picture is already as rough as we allow, make it smaller instead
+            self.scaleIndex += 1
+            self.quality = (self.minQuality + self.maxQuality) // 2
+            self.holdFrames = self.scaleHold
+        elif self.quality > self.maxQuality and step > 0 and self.scaleIndex > 0:
+            # Plenty of room even at max quality, go back up a size
+            self.scaleIndex -= 1
+            self.quality = (self.minQuality + self.maxQuality) // 2
+            self.holdFrames = self.scaleHold
+        self.quality = max(self.minQuality, min(self.maxQuality, self.quality))
+
+
+class viewerState():
+
+    def __init__(self, address, queueSize) -> None:
+        self.address = address
+        self.queue = asyncio.Queue(maxsize=queueSize)
+        self.sent = stageStats(f'send {address}')
+        self.dropped = 0
+        # Partial updates (tiles/repeats) only make sense on top of every
+        # message before them. Once anything is dropped for this viewer it
+        # waits for the next full frame before getting partial ones again.
+        self.resync = True
+
+
+class pendingFrame():
+    # One message on its way to every viewer it was queued for. onSent
+    # hears about it once, after the last of them, with the slowest send,
+    # so the controller sees one sample per message however many viewers
+    # there are. A message dropped for any viewer is never reported.
+    __slots__ = ('frameBytes', 'isFullFrame', 'waiting', 'slowest')
+
+    def __init__(self, frameBytes, isFullFrame) -> None:
+        self.frameBytes = frameBytes
+        self.isFullFrame = isFullFrame
+        self.waiting = 0
+        self.slowest = 0.0
+
+
+class frameBroadcaster():
+    # Fans one encoded frame out to every connected viewer. Each viewer has
+    # its own small queue, when it's full frames are dropped for that viewer
+    # only so a slow client never holds up capture or the others.
+    # handleViewer() is meant to be the asyncRobotNetworkModule handler and
+    # publish() must be called on the event loop thread. If given, presence
+    # is kept set while at least one viewer is connected, onSent(bytes,
+    # seconds, isFullFrame) is called once every viewer it was queued for
+    # has a message, with the slowest send, and onJoin() whenever a new
+    # viewer connects.
+
+    def __init__(self, queueSize=2, presence: threading.Event = None, onSent=None, onJoin=None) -> None:
+        self.queueSize = queueSize
+        self.presence = presence
+        self.onSent = onSent
+        self.onJoin = onJoin
+        self.viewers = {}
+        self.published = 0
+
+    def hasViewers(self):
+        return len(self.viewers) > 0
+
+    def publish(self, message, isFullFrame=True):
+        # message is the buffer list from networkmodule.encodeMessage
+        self.published += 1
+        pending = None
+        if self.onSent is not None and self.viewers:
+            pending = pendingFrame(sum(memoryview(buffer).nbytes for buffer in message), isFullFrame)
+        for viewer in self.viewers.values():
+            if isFullFrame:
+                # Supersedes anything still queued for this viewer
+                if viewer.queue.full():
+                    while not viewer.queue.empty():
+                        viewer.queue.get_nowait()
+                        viewer.dropped += 1
+                viewer.resync = False
+            elif viewer.resync:
+                viewer.dropped += 1
+                continue
+            elif viewer.queue.full():
+                # Can't drop anything this update builds on, wait for a full frame
+                viewer.dropped += 1
+                viewer.resync = True
+                continue
+            if pending is not None:
+                pending.waiting += 1
+            viewer.queue.put_nowait((message, pending))
+
+    async def handleViewer(self, peer):
+        viewer = viewerState(peer.address, self.queueSize)
+        self.viewers[peer] = viewer
+        if self.presence is not None:
+            self.presence.set()
+        if self.onJoin is not None:
+            self.onJoin()
+        logging.info(f'Viewer {peer.address} joined, {len(self.viewers)} connected.')
+        try:
+            while True:
+                message, pending = await viewer.queue.get()
+                start = time.perf_counter()
+                result = await peer.sendEncoded(message)
+                if result != FailureType.NONE:
+                    logging.info(f'Viewer {peer.address} stopped receiving -> {result}')
+                    return
+                duration = time.perf_counter() - start
+                viewer.sent.add(duration)
+                if pending is not None:
+                    pending.slowest = max(pending.slowest, duration)
+                    pending.waiting -= 1
+                    if pending.waiting == 0:
+                        self.onSent(pending.frameBytes, pending.slowest, pending.isFullFrame)
+        finally:
+            del self.viewers[peer]
+            if self.presence is not None and not self.viewers:
+                self.presence.clear()
+
+    def report(self):
+        # Per viewer fps/drops since the last report
+        results = []
+        for viewer in self.viewers.values():
+            result = viewer.sent.snapshot()
+            result['dropped'] = viewer.dropped
+            viewer.dropped = 0
+            results.append(result)
+        return results
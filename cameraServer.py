@@ -1,8 +1,23 @@
 import cv2
+import asyncio
 import logging
+import threading
+import time
+import numpy as np
 from networkmodule import robotNetworkModule
 from networkmodule import FailureType
 from networkmodule import ConnModes
+from networkmodule import encodeMessage
+from networkmodule import TrafficClass
+from asyncnetworkmodule import asyncRobotNetworkModule
+from cameraPipeline import frameBroadcaster
+from cameraPipeline import changeEncoder
+from cameraPipeline import pipelineStage
+from cameraPipeline import qualityController
+from latestslot import latestSlot
+from timingstats import stageStats
+from udpnetworkmodule import udpFrameSender
+from systemMetrics import readWifiSignal
 
 logging.basicConfig(
     filename="cameraServer.log",
@@ -49,7 +64,148 @@ def handleFailure(result, networkManager: robotNetworkModule, associatedData):
             return True
 
 
+def captureFrame(_):
+    global cap, captureFailures
+    ret, frame = cap.read()
+    if not ret:
+        # Unplugged or not ready yet, back off instead of spinning on read()
+        captureFailures += 1
+        if captureFailures == 1:
+            logging.warning(f'Reading camera {cameraID} failed, retrying')
+        if captureFailures % reopenAfterFailures == 0:
+            logging.warning(f'Camera {cameraID} failed {captureFailures} reads in a row, reopening it')
+            cap.release()
+            cap = cv2.VideoCapture(cameraID)
+        time.sleep(min(captureRetryDelay * 2 ** (captureFailures - 1), maxCaptureRetryDelay))
+        return None
+    if captureFailures:
+        logging.info(f'Camera {cameraID} is back after {captureFailures} failed reads')
+        captureFailures = 0
+    return frame
+
+def encodeJpeg(image, quality):
+    encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), quality]  # Quality from 0 to 100
+    _, buffer = cv2.imencode('.jpg', image, encode_param)
+    return buffer
+
+def encodeFrame(frame):
+    global nextEncode
+    # Nobody to send to, don't burn CPU on encoding
+    if not viewerPresent.is_set():
+        return None
+    # The camera runs faster than targetFps, skip frames that come early.
+    # The controller budgets bytes per second assuming targetFps, going
+    # faster would send more than that on a fast link
+    now = time.perf_counter()
+    if now < nextEncode:
+        return None
+    nextEncode = max(nextEncode + 1 / targetFps, now)
+    if adaptiveQuality:
+        quality = controller.quality
+        if controller.scale < 1.0:
+            frame = cv2.resize(frame, None, fx=controller.scale, fy=controller.scale, interpolation=cv2.INTER_AREA)
+    else:
+        quality = 50
+    if not skipUnchanged:
+        return encodeJpeg(frame, quality)
+    return changes.encode(frame, quality)
+
+def updateController(frameBytes, sendTime, isFullFrame):
+    global lastSignalCheck
+    controller.update(frameBytes, sendTime, fullFrame=isFullFrame)
+    now = time.perf_counter()
+    if useWifiSignal and now - lastSignalCheck > 1:
+        controller.setSignal(readWifiSignal())
+        lastSignalCheck = now
+
+def logPipelineStats(sendStats: stageStats, latency: stageStats):
+    for stage in stages:
+        stats = stage.stats.snapshot()
+        logging.info(f'Stage {stats["name"]}: {stats["rate"]:.1f} fps, {stats["avg_ms"]:.1f} ms avg, {stats["max_ms"]:.1f} ms max')
+    stats = sendStats.snapshot()
+    logging.info(f'Stage {stats["name"]}: {stats["rate"]:.1f} fps, {stats["avg_ms"]:.1f} ms avg, {stats["max_ms"]:.1f} ms max')
+    stats = latency.snapshot()
+    logging.info(f'End to end: {stats["rate"]:.1f} fps, {stats["avg_ms"]:.1f} ms avg capture to sent, {stats["max_ms"]:.1f} ms max')
+    logging.info(f'Frames replaced before use: capture {rawFrames.overwritten}, encode {encodedFrames.overwritten}')
+    if adaptiveQuality:
+        logging.info(f'Adaptive quality: quality {controller.quality}, scale {controller.scale}, signal {controller.signalDbm} dbm')
+
+def broadcastSender(loop, broadcaster: frameBroadcaster, sendStats: stageStats, latency: stageStats):
+    # Runs in its own thread. Every frame is framed exactly once and the same
+    # buffers are handed to all viewers.
+    while True:
+        captureTime, buffer = encodedFrames.take()
+        start = time.perf_counter()
+        message = encodeMessage(buffer)
+        loop.call_soon_threadsafe(broadcaster.publish, message, isinstance(buffer, np.ndarray))
+        end = time.perf_counter()
+        sendStats.add(end - start)
+        latency.add(end - captureTime)
+
+async def broadcastServer():
+    broadcaster = frameBroadcaster(broadcastQueueSize, viewerPresent,
+                                   updateController if adaptiveQuality else None,
+                                   changes.requestKeyframe)
+    sendStats = stageStats("publish")
+    latency = stageStats("latency")
+    server = asyncRobotNetworkModule(ConnModes.SERVER, "0.0.0.0", 4422, trafficClass=TrafficClass.VIDEO)
+    await server.start(broadcaster.handleViewer)
+    logging.info("Broadcast server is ready - Viewers can connect at any time.")
+
+    loop = asyncio.get_running_loop()
+    threading.Thread(target=broadcastSender, args=(loop, broadcaster, sendStats, latency), daemon=True).start()
+    while True:
+        await asyncio.sleep(reportInterval)
+        logPipelineStats(sendStats, latency)
+        for viewer in broadcaster.report():
+            logging.info(f'Viewer {viewer["name"]}: {viewer["rate"]:.1f} fps, {viewer["dropped"]} dropped')
+
+def udpServer():
+    # Every subscribed viewer gets every frame over UDP, no per-viewer state
+    # beyond its address. Keyframe requests from viewers that lost frames go
+    # straight to the change encoder.
+    sender = udpFrameSender("0.0.0.0", udpPort, changes.requestKeyframe, TrafficClass.VIDEO)
+    sendStats = stageStats("send")
+    latency = stageStats("latency")
+    lastReport = time.perf_counter()
+    while True:
+        sender.poll()
+        if sender.hasSubscribers():
+            viewerPresent.set()
+        else:
+            viewerPresent.clear()
+        item = encodedFrames.take(timeout=0.5)
+        if item is not None:
+            captureTime, buffer = item
+            start = time.perf_counter()
+            sender.sendFrame(buffer)
+            end = time.perf_counter()
+            sendStats.add(end - start)
+            latency.add(end - captureTime)
+        if time.perf_counter() - lastReport > reportInterval:
+            logPipelineStats(sendStats, latency)
+            logging.info(f'UDP viewers: {list(sender.subscribers)}')
+            lastReport = time.perf_counter()
+
+
 cameraID = 0
+broadcastMode = True  # Serve any number of viewers instead of one at a time
+broadcastQueueSize = 2  # Frames buffered per viewer before we start dropping for it
+reportInterval = 5  # Seconds between fps/timing reports in the log
+adaptiveQuality = True  # Pick JPEG quality and downscale per frame to suit the link
+targetFps = 20
+targetBitrate = None  # Bits/s cap for the video, None to use whatever the link gives us
+useWifiSignal = True  # Back off early when wlan0 reports a weak signal
+skipUnchanged = True  # Only send the tiles that changed, or a repeat marker for a static scene
+changeThreshold = 6.0  # Mean per tile pixel difference (0-255) that counts as a change
+maxTileFraction = 0.5  # Send the whole frame once more than this share of tiles changed
+keyframeInterval = 2.0  # Seconds between forced full frames, heals any viewer that missed updates
+udpMode = False  # Send frames as UDP datagrams on udpPort instead of over TCP
+udpPort = 4423
+captureRetryDelay = 0.05  # Seconds after a failed camera read, doubling up to maxCaptureRetryDelay
+maxCaptureRetryDelay = 2.0
+reopenAfterFailures = 5  # Failed reads in a row before the camera is released and opened again
+captureFailures = 0
 try:
     logging.info("cv2 is attempting to open the camera...")
     cap = cv2.VideoCapture(cameraID)
@@ -58,35 +214,77 @@ except Exception:
     logging.fatal(f'cv2 cannot open camera {cameraID=} - This error is fatal', exc_info=True)
     exit()
 
+# Capture and encode run on their own threads at whatever rate they can manage.
+# Each hands over through a single slot so the sender always gets the newest
+# frame and a slow send never holds up the camera.
+viewerPresent = threading.Event()
+controller = qualityController(targetFps, targetBitrate)
+lastSignalCheck = 0.0
+nextEncode = 0.0
+rawFrames = latestSlot()
+encodedFrames = latestSlot()
+changes = changeEncoder(encodeJpeg, changeThreshold, maxTileFraction, keyframeInterval, encodedFrames)
+stages = [
+    pipelineStage("capture", captureFrame, sink=rawFrames),
+    pipelineStage("encode", encodeFrame, source=rawFrames, sink=encodedFrames),
+]
+for stage in stages:
+    stage.start()
+
+if udpMode:
+    udpServer()
+    exit()
+
+if broadcastMode:
+    asyncio.run(broadcastServer())
+    exit()
+
 # Start server
-rnm = robotNetworkModule(ConnModes.SERVER, "0.0.0.0", 4422)
+rnm = robotNetworkModule(ConnModes.SERVER, "0.0.0.0", 4422, trafficClass=TrafficClass.VIDEO)
 if rnm.successfulConnection == True:
     logging.info("Server is ready - Waiting on a client.")
     rnm.waitForConnection()
+    changes.requestKeyframe()
+    viewerPresent.set()
 else:
     logging.fatal("Server failed to start. Check networking logs.")
     exit()
 
 
+sendStats = stageStats("send")
+latency = stageStats("latency")
+lastReport = time.perf_counter()
 waitReason = False
 # Main Loop
 while True:
     if waitReason is False:
-        ret, frame = cap.read()
-        encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), 50]  # Quality from 0 to 100
-        _, buffer = cv2.imencode('.jpg', frame, encode_param)
+        captureTime, buffer = encodedFrames.take()
+        bytesBefore = rnm.stats.bytesSent
+        start = time.perf_counter()
         result = rnm.sendPyObject(buffer)
+        end = time.perf_counter()
+        sendStats.add(end - start)
+        latency.add(end - captureTime)
+        if adaptiveQuality and not rnm.isFailure(result):
+            # Tiles and repeats too, see qualityController.update
+            updateController(rnm.stats.bytesSent - bytesBefore, end - start, isinstance(buffer, np.ndarray))
         if rnm.isFailure(result):
-            ishandled = handleFailure(result, rnm, frame)
+            ishandled = handleFailure(result, rnm, buffer)
             if ishandled:
                 pass
             else:
                 waitReason = result
+        if end - lastReport > reportInterval:
+            logPipelineStats(sendStats, latency)
+            lastReport = end
     else:
         if waitReason is FailureType.CON_CLOSED or FailureType.CON_TIMEOUT:
+            viewerPresent.clear()
             rnm.client_socket.close()
             logging.info("Server is waiting for a new client.")
             rnm.waitForConnection()
+            changes.requestKeyframe()
+            viewerPresent.set()
             waitReason = False
         else:
             logging.fatal("External network error - Exiting...")
@@ -1,34 +1,115 @@
 import cv2
-import socket
-import pickle
-import struct
+import threading
 import time
 
-import numpy as np
-from robotTelemModule import telemData
-from robotTelemModule import commandData
 from networkmodule import robotNetworkModule
 from networkmodule import FailureType
 from networkmodule import ConnModes
+from networkmodule import TrafficClass
+from cameraPipeline import frameRepeat
+from cameraPipeline import frameTiles
+from cameraPipeline import frameUpdates
+from cameraPipeline import frameAssembler
+from cameraPipeline import pipelineStage
+from latestslot import latestSlot
+from timingstats import stageStats
+from udpnetworkmodule import udpFrameReceiver
 
-rnm = robotNetworkModule(ConnModes.CLIENT, "192.168.1.163", 4422)
-if rnm.successfulConnection == True:
-    pass
-else:
-    exit()
+serverAddress = "192.168.1.163"
+udpMode = False  # Has to match the camera server
+udpPort = 4423
+keyframeRequestInterval = 1.0  # Seconds between keyframe requests over UDP, half the camera server's keyframeInterval
+decodeScale = 1  # 2, 4 or 8 decodes at that fraction of the size, much cheaper for a small window
+showOverlay = True  # fps, receive to display latency and dropped frames in the corner
+overlayInterval = 1.0  # Seconds between overlay updates
 
-while True:
-    
-    received = rnm.receivePyObject()
-    decoded_image = cv2.imdecode(received, 1)
+reducedDecode = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
 
-    if rnm.isFailure(decoded_image):
+if udpMode:
+    receiver = udpFrameReceiver(serverAddress, udpPort)
+else:
+    rnm = robotNetworkModule(ConnModes.CLIENT, serverAddress, 4422, trafficClass=TrafficClass.VIDEO)
+    if rnm.successfulConnection == True:
+        pass
+    else:
         exit()
+
+def receiveUpdate(_):
+    # Drains the connection as fast as frames arrive, decoding never holds it up
+    global waitingForFullFrame, lastKeyframeRequest
+    if udpMode:
+        received = receiver.receiveFrame(timeout=0.5)
+        if receiver.missedFrames and not waitingForFullFrame:
+            # Lost something, tiles on top of what we have would be wrong
+            waitingForFullFrame = True
+        now = time.perf_counter()
+        if waitingForFullFrame and now - lastKeyframeRequest > keyframeRequestInterval:
+            # Ask again if the last one got lost too, but not on every gap. The
+            # server's own keyframes come every keyframeInterval anyway and a
+            # burst of requests would fill the link with full frames.
+            lastKeyframeRequest = now
+            receiver.requestKeyframe()
     else:
-        pass
-    
+        received = rnm.receivePyObject()
+
+    if isinstance(received, FailureType):
+        if not udpMode:
+            connectionLost.set()
+            time.sleep(1)  # Main thread is on its way out
+        # No connection to lose over UDP, keep subscribing until frames come back
+        return None
+    if isinstance(received, (frameRepeat, frameTiles)):
+        return None if waitingForFullFrame else received
+    waitingForFullFrame = False
+    return received
+
+def decodeJpeg(buffer):
+    return cv2.imdecode(buffer, reducedDecode[decodeScale])
+
+# Receive and decode run on their own threads and hand over to the next
+# stage newest first. When decoding falls behind the receiver keeps
+# draining the socket and frames are skipped instead of piling up in TCP
+# buffers, same when the display falls behind decoding.
+waitingForFullFrame = False
+lastKeyframeRequest = 0.0
+connectionLost = threading.Event()
+receivedUpdates = frameUpdates()
+decodedFrames = latestSlot()
+assembler = frameAssembler(decodeJpeg, decodeScale)
+stages = [
+    pipelineStage("receive", receiveUpdate, sink=receivedUpdates),
+    pipelineStage("decode", assembler.apply, source=receivedUpdates, sink=decodedFrames),
+]
+for stage in stages:
+    stage.start()
+
+# Display stays on the main thread, that's where imshow wants to be
+displayed = stageStats("display")
+overlay = ""
+lastOverlay = time.perf_counter()
+while not connectionLost.is_set():
+    item = decodedFrames.take(timeout=0.01)
+    if item is not None:
+        receiveTime, image = item
+        displayed.add(time.perf_counter() - receiveTime)
+        if showOverlay:
+            # image is assembler.image, the reference later delta tiles are pasted onto.
+            # Drawing on it would bake the overlay text into the next frames, keep the copy
+            image = image.copy()
+            cv2.putText(image, overlay, (8, 20), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1, cv2.LINE_AA)
+        cv2.imshow("Remote", image)
 
-    cv2.imshow("Remote", decoded_image)
+    now = time.perf_counter()
+    if now - lastOverlay > overlayInterval:
+        stats = displayed.snapshot()
+        dropped = receivedUpdates.dropped + decodedFrames.overwritten
+        overlay = f'{stats["rate"]:.1f} fps  {stats["avg_ms"]:.0f} ms avg {stats["max_ms"]:.0f} ms max  {dropped} dropped'
+        lastOverlay = now
 
     keypress = cv2.waitKey(1)
     if keypress == 13:
@@ -36,4 +117,4 @@ while True:
 
 
 
-cv2.destroyAllWindows()
\ No newline at end of file
+cv2.destroyAllWindows()
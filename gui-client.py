@@ -1,11 +1,30 @@
 from tkinter import *
 import tkinter.messagebox 
+import time
 from networkmodule import robotNetworkModule
 from networkmodule import FailureType
 from networkmodule import ConnModes
+from networkmodule import TrafficClass
+from networkworker import networkWorker
 from robotTelemModule import telemData
 from robotTelemModule import commandData
-
+from robotTelemModule import mergeTelem
+
+commandInterval = 0.02  # Seconds, keys are sampled this often and a command sent when they changed anything
+keepaliveInterval = 0.25  # Seconds, an unchanged command is sent again this often. Has to be well under commandTimeout in the robot's robotlocal.conf
+keyReleaseDelay = 0.05  # Seconds, a held key autorepeats as release/press pairs, only a release that lasts counts
+stallWarning = 1.0  # Seconds without telemetry before the latency shows the link as stalled
+# Key -> the state it holds while pressed
+keyStates = {
+    "w": "forward",
+    "s": "back",
+    "a": "left",
+    "d": "right",
+    "e": "right_track",
+    "q": "left_track",
+    "c": "right_track_reverse",
+    "z": "left_track_reverse",
+}
 
 
 class robotControl():
@@ -25,6 +44,7 @@ class robotControl():
         self.cpu_usage = tkinter.StringVar()
         self.cpu_temp = tkinter.StringVar()
         self.wifiSignal = tkinter.StringVar()
+        self.linkLatency = tkinter.StringVar()
 
         # Internal States
         self.forward = False
@@ -40,52 +60,45 @@ class robotControl():
         self.ma = 0
         self.mb = 0
 
-        # Network
+        self.releasedAt = {} # State -> when its key was let go, see key_released
+
+        # Network. Sockets are only touched by the worker's threads, the Tk
+        # thread swaps the newest telemetry and command with it.
         self.rnm = None
+        self.worker = None
+        self.shownTelemetry = 0 # Sequence of the telemetry on screen
+        self.lastCommand = None # (ma, mb) last handed to the worker
+        self.nextTick = 0.0
     
     def connect(self):
-        self.rnm = robotNetworkModule(ConnModes.CLIENT, self.ip.get(), int(self.port.get()))
+        self.rnm = robotNetworkModule(ConnModes.CLIENT, self.ip.get(), int(self.port.get()), timestamps=True, trafficClass=TrafficClass.CONTROL)
         if self.rnm.successfulConnection == True:
             self.ip_box.config(state="disabled")
             self.port_box.config(state="disabled")
-            pass
+            self.worker = networkWorker(self.rnm, keepalive=keepaliveInterval, merge=mergeTelem)
+            self.nextTick = time.perf_counter()
         else:
             tkinter.messagebox.showerror("Failed to Connect", "Couldn't connect to supplied IP address. Check logs.")
             exit()
         
-    def reset_direction(self):
-        self.forward = False
-        self.back = False
-        self.left = False
-        self.right = False
-        self.right_track = False
-        self.left_track = False
-        self.right_track_reverse = False
-        self.left_track_reverse = False
-
-    def forward_pressed(self, val):
-        self.forward = True
-
-    def back_pressed(self, val):
-        self.back = True
-
-    def left_pressed(self, val):
-        self.left = True
-
-    def right_pressed(self, val):
-        self.right = True
-
-    def left_track_pressed(self, val):
-        self.left_track = True
-
-    def right_track_pressed(self, val):
-        self.right_track = True
-
-    def left_track_back(self, val):
-        self.left_track_reverse = True
-
-    def right_track_back(self, val):
-        self.right_track_reverse = True
+    def key_pressed(self, event):
+        state = keyStates.get(event.keysym)
+        if state is not None:
+            setattr(self, state, True)
+            self.releasedAt.pop(state, None)
+
+    def key_released(self, event):
+        # Applied by releaseKeys() once it's clear no press follows
+        state = keyStates.get(event.keysym)
+        if state is not None:
+            self.releasedAt[state] = time.perf_counter()
+
+    def releaseKeys(self):
+        now = time.perf_counter()
+        for state, releasedAt in list(self.releasedAt.items()):
+            if now - releasedAt > keyReleaseDelay:
+                setattr(self, state, False)
+                del self.releasedAt[state]
 
     def updateForwardSpeed(self, val):
         self.forward_value = int(val)
@@ -134,32 +147,52 @@ class robotControl():
         self.mb = self.mb
 
     def robotLoop(self):
-        if self.rnm is not None:
-            received: telemData = self.rnm.receivePyObject()
-
-            if self.rnm.isFailure(received):
-                tkinter.messagebox.showerror("Receive Failure", "An unhandled exception occured. Check logs.")
-                exit()
-            else:
-                self.avgVolt.set(str(received.avgVolt)+"V")
-                self.totalMa.set(str(round((received.totalMa / 1000),3)) +"A")
-                self.timeLeft.set(str(received.timeLeft)+"H")
-                self.voltageBatteryPercent.set(str(round(received.voltageBatteryPercent, 2))+"%")
-                self.cpu_usage.set(str(received.cpu_usage)+"%")
-                self.cpu_temp.set(str(received.cpu_temp)+"C")
-                self.wifiSignal.set(str(received.wifiSignal)+" dbm")
-
+        # Runs on the Tk thread every commandInterval and never waits on the
+        # network, the worker's threads do the sending and receiving
+        if self.worker is None:
+            m.after(15, rc.robotLoop)
+            return
 
-            self.deriveControl()
+        if self.worker.failure is not None:
+            tkinter.messagebox.showerror("Connection Failure", f'{self.worker.failure} - Check logs.')
+            exit()
 
+        self.releaseKeys()
+        self.deriveControl()
+        if (self.ma, self.mb) != self.lastCommand:
+            # The worker repeats it as a keepalive until something changes
             command = commandData()
             command.ma = self.ma
             command.mb = self.mb
-            self.rnm.sendPyObject(command)
-            self.reset_direction()
-            m.after(8, rc.robotLoop)
-        else:
-            m.after(15, rc.robotLoop)
+            self.worker.outgoing.put(command)
+            self.lastCommand = (self.ma, self.mb)
+
+        slot = self.worker.received
+        if slot.sequence != self.shownTelemetry:
+            self.shownTelemetry = slot.sequence
+            self.showTelemetry(slot.peek())
+        silentFor = self.worker.silentFor()
+        if silentFor is not None and silentFor > stallWarning:
+            self.linkLatency.set(f'stalled {silentFor:.1f} s')
+
+        # Fixed rate, the next tick is planned from the last one's schedule
+        # so time spent here doesn't add up
+        now = time.perf_counter()
+        self.nextTick = max(self.nextTick + commandInterval, now)
+        m.after(int((self.nextTick - now) * 1000), rc.robotLoop)
+
+    def showTelemetry(self, received: telemData):
+        if not isinstance(received, telemData):
+            return
+        self.avgVolt.set(str(received.avgVolt)+"V")
+        self.totalMa.set(str(round((received.totalMa / 1000),3)) +"A")
+        self.timeLeft.set(str(received.timeLeft)+"H")
+        self.voltageBatteryPercent.set(str(round(received.voltageBatteryPercent, 2))+"%")
+        self.cpu_usage.set(str(received.cpu_usage)+"%")
+        self.cpu_temp.set(str(received.cpu_temp)+"C")
+        self.wifiSignal.set(str(received.wifiSignal)+" dbm")
+        if self.rnm.stats.lastRtt is not None:
+            self.linkLatency.set(str(round(self.rnm.stats.lastRtt * 1000, 1))+" ms")
 
 
 m = Tk()
@@ -208,15 +241,12 @@ Label(m, text="WiFi Strength: ").grid(row=5, column=0)
 
 Label(m, textvariable=rc.wifiSignal).grid(row=5, column=1)
 
+Label(m, text="Link Latency: ").grid(row=5, column=2)
+Label(m, textvariable=rc.linkLatency).grid(row=5, column=3)
+
 
-m.bind("w", rc.forward_pressed)
-m.bind("s", rc.back_pressed)
-m.bind("a", rc.left_pressed)
-m.bind("d", rc.right_pressed)
-m.bind("e", rc.right_track_pressed)
-m.bind("q", rc.left_track_pressed)
-m.bind("c", rc.right_track_back)
-m.bind("z", rc.left_track_back)
+m.bind("<KeyPress>", rc.key_pressed)
+m.bind("<KeyRelease>", rc.key_released)
 m.after(15, rc.robotLoop)
 m.mainloop()
 rc.rnm.server_socket.close()
\ No newline at end of file
@@ -0,0 +1,35 @@
+import threading
+
+# Single value handoff between threads where only the newest value matters.
+# A put() replaces whatever hasn't been taken yet (counted in `overwritten`),
+# so a slow consumer always gets the freshest value instead of a backlog.
+
+
+class latestSlot():
+
+    def __init__(self) -> None:
+        self.value = None
+        self.sequence = 0  # Bumped on every put
+        self.taken = 0  # Sequence of the last value handed out by take()
+        self.overwritten = 0
+        self.condition = threading.Condition()
+
+    def put(self, value):
+        with self.condition:
+            if self.sequence != self.taken:
+                self.overwritten += 1
+            self.value = value
+            self.sequence += 1
+            self.condition.notify_all()
+
+    def take(self, timeout=None):
+        # Waits for a value that hasn't been taken yet. Returns None on timeout.
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.sequence != self.taken, timeout):
+                return None
+            self.taken = self.sequence
+            return self.value
+
+    def peek(self):
+        # Latest value without waiting or taking the lock, may be None
+        return self.value
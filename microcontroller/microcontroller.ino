@@ -23,12 +23,67 @@ void expiredAllStop(){
   ledcWriteChannel(1, 0);
 }
 
+// Serial frames, both directions:
+//   sync (0xA5) | type | sequence | payload length | payload | CRC-16
+// CRC is CRC-16/CCITT-FALSE over type, sequence, length and payload, sent
+// little endian. Replies carry the sequence number of their request.
+const uint8_t FRAME_SYNC = 0xA5;
+const uint8_t MSG_HEARTBEAT = 1;
+const uint8_t MSG_POWER = 2;
+const uint8_t MSG_MOTORS = 3;
+const uint8_t MSG_POWER_STREAM = 4;
+const uint8_t FRAME_HEADER = 4;
+const uint8_t MAX_PAYLOAD = 24;
+
+uint8_t rxFrame[FRAME_HEADER + MAX_PAYLOAD + 2];
+uint8_t rxCount = 0;
+unsigned long badFrames = 0;
+
+unsigned long powerInterval = 0; // ms between pushed power readings, 0 = only when asked
+unsigned long lastPowerPush = 0;
+
+uint16_t crc16Update(uint16_t crc, const uint8_t *data, uint8_t len){
+  for(uint8_t i = 0; i < len; i++){
+    crc ^= (uint16_t)data[i] << 8;
+    for(uint8_t bit = 0; bit < 8; bit++){
+      if(crc & 0x8000){
+        crc = (crc << 1) ^ 0x1021;
+      } else {
+        crc = crc << 1;
+      }
+    }
+  }
+  return crc;
+}
+
+void sendFrame(uint8_t type, uint8_t sequence, const uint8_t *payload, uint8_t len){
+  uint8_t header[FRAME_HEADER] = {FRAME_SYNC, type, sequence, len};
+  uint16_t crc = crc16Update(0xFFFF, header + 1, FRAME_HEADER - 1);
+  crc = crc16Update(crc, payload, len);
+  uint8_t crcBytes[2] = {(uint8_t)(crc & 0xFF), (uint8_t)(crc >> 8)};
+  Serial.write(header, FRAME_HEADER);
+  if(len > 0){
+    Serial.write(payload, len);
+  }
+  Serial.write(crcBytes, 2);
+}
+
+int expectedPayload(uint8_t type){
+  switch(type){
+    case MSG_HEARTBEAT: return 0;
+    case MSG_POWER: return 0;
+    case MSG_MOTORS: return 4;
+    case MSG_POWER_STREAM: return 2;
+    default: return -1;
+  }
+}
+
 void commsLog(){
   lastHb = millis();
 }
 
-void handleHeartBeat(){
-  Serial.println("heartbeat");
+void handleHeartBeat(uint8_t sequence){
+  sendFrame(MSG_HEARTBEAT, sequence, NULL, 0);
   commsLog();
 }
 
@@ -41,46 +96,103 @@ bool isHbExpired(){
   }
 }
 
-void handlePowerRequest(){
-  
-  String ch1_ma = String(ina_1.getCurrent(INA3221_CH1) * 1000);
-  String ch2_ma = String(ina_1.getCurrent(INA3221_CH2) * 1000);
-  String ch3_ma = String(ina_1.getCurrent(INA3221_CH3) * 1000);
+void sendPowerReading(uint8_t sequence){
+  float readings[6] = {
+    ina_1.getVoltage(INA3221_CH1), ina_1.getCurrent(INA3221_CH1) * 1000,
+    ina_1.getVoltage(INA3221_CH2), ina_1.getCurrent(INA3221_CH2) * 1000,
+    ina_1.getVoltage(INA3221_CH3), ina_1.getCurrent(INA3221_CH3) * 1000,
+  };
+  // ESP32 floats are little endian IEEE 754, same as struct '<6f' on the Pi
+  sendFrame(MSG_POWER, sequence, (const uint8_t *)readings, sizeof(readings));
+}
 
-  String ch1_v = String(ina_1.getVoltage(INA3221_CH1));
-  String ch2_v = String(ina_1.getVoltage(INA3221_CH2));
-  String ch3_v = String(ina_1.getVoltage(INA3221_CH3));
+void handlePowerRequest(uint8_t sequence){
+  sendPowerReading(sequence);
+  commsLog();
+}
 
-  Serial.println(ch1_v + " " + ch1_ma + " " + ch2_v + " " + ch2_ma + " " + ch3_v + " " + ch3_ma);
+void handlePowerStream(uint8_t sequence, const uint8_t *payload){
+  powerInterval = payload[0] | (payload[1] << 8);
+  lastPowerPush = millis();
+  sendFrame(MSG_POWER_STREAM, sequence, payload, 2);
   commsLog();
 }
 
-void handleMotorRequest(String command){
-  int duty = 0;
-  if(command.startsWith("ma")){
-    duty = command.substring(command.indexOf(" "), command.length()).toInt();
-    if(duty < 0){
-      digitalWrite(ma_dir, LOW);
-    } else {
-      digitalWrite(ma_dir, HIGH);
-    }
-    ledcWriteChannel(0, abs(duty));
+void pushPower(){
+  // Pushed readings go out with sequence 0, nobody asked for them
+  if(powerInterval > 0 && (millis() - lastPowerPush) >= powerInterval){
+    lastPowerPush = millis();
+    sendPowerReading(0);
   }
-  if(command.startsWith("mb")){
-    duty = command.substring(command.indexOf(" "), command.length()).toInt();
-    if(duty < 0){
-      digitalWrite(mb_dir, LOW);
-    } else {
-      digitalWrite(mb_dir, HIGH);
-    }
-    ledcWriteChannel(1, abs(duty));
+}
+
+void setMotor(uint8_t channel, int dirPin, int duty){
+  if(duty < 0){
+    digitalWrite(dirPin, LOW);
+  } else {
+    digitalWrite(dirPin, HIGH);
   }
+  ledcWriteChannel(channel, min(abs(duty), 255));
+}
+
+void handleMotorRequest(const uint8_t *payload){
+  ma_duty = (int16_t)(payload[0] | (payload[1] << 8));
+  mb_duty = (int16_t)(payload[2] | (payload[3] << 8));
+  setMotor(0, ma_dir, ma_duty);
+  setMotor(1, mb_dir, mb_duty);
   commsLog();
 }
 
+void handleFrame(uint8_t type, uint8_t sequence, const uint8_t *payload){
+  if(type == MSG_HEARTBEAT){
+    handleHeartBeat(sequence);
+  }
+
+  if(type == MSG_POWER){
+    handlePowerRequest(sequence);
+  }
+
+  if(type == MSG_MOTORS){
+    handleMotorRequest(payload);
+  }
+
+  if(type == MSG_POWER_STREAM){
+    handlePowerStream(sequence, payload);
+  }
+}
+
+void readFrames(){
+  // Works through whatever has arrived without blocking, a frame can be
+  // split across calls
+  while(Serial.available() > 0){
+    uint8_t b = Serial.read();
+    if(rxCount == 0 && b != FRAME_SYNC){
+      continue;
+    }
+    rxFrame[rxCount++] = b;
+    if(rxCount == FRAME_HEADER){
+      if(expectedPayload(rxFrame[1]) != rxFrame[3]){
+        badFrames++;
+        rxCount = 0; // Not a real header, wait for the next sync byte
+        continue;
+      }
+    }
+    if(rxCount >= FRAME_HEADER && rxCount == FRAME_HEADER + rxFrame[3] + 2){
+      uint8_t len = rxFrame[3];
+      uint16_t crc = crc16Update(0xFFFF, rxFrame + 1, FRAME_HEADER - 1 + len);
+      uint16_t received = rxFrame[FRAME_HEADER + len] | (rxFrame[FRAME_HEADER + len + 1] << 8);
+      if(crc == received){
+        handleFrame(rxFrame[1], rxFrame[2], rxFrame + FRAME_HEADER);
+      } else {
+        badFrames++;
+      }
+      rxCount = 0;
+    }
+  }
+}
+
 void setup() {
   Serial.begin(115200);
-  Serial.setTimeout(5000);
   initIna();
   pinMode(ma_dir, OUTPUT);
   pinMode(mb_dir, OUTPUT);
@@ -94,25 +206,7 @@ void loop() {
     isHbExpired();
     delay(1);
   } else {
-    String eval = Serial.readStringUntil('\n');
-
-    if(eval.startsWith("heartbeat")){
-      handleHeartBeat();
-    }
-
-    if(eval.startsWith("pwr")){
-      handlePowerRequest();
-    }
-
-    if(eval.startsWith("ma")){
-      handleMotorRequest(eval);
-    }
-
-    if(eval.startsWith("mb")){
-      handleMotorRequest(eval);
-    }
+    readFrames();
   }
-
-  
-  
+  pushPower();
 }
@@ -2,7 +2,23 @@ import socket
 import pickle
 import logging
 import struct
+import time
+import zlib
 from enum import Enum
+from robotTelemModule import telemData
+from robotTelemModule import commandData
+from robotTelemModule import telemDelta
+from timingstats import latencyHistogram
+
+# Optional faster compressors, zlib is always there
+try:
+    import lz4.frame as lz4Frame
+except ImportError:
+    lz4Frame = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 
 
@@ -19,20 +35,295 @@ class FailureType(Enum):
     UNPACK = 4
     RECONNECTED = 5
 
+class MsgType(Enum):
+    PICKLE = 0
+    TELEM = 1
+    COMMAND = 2
+    TELEM_DELTA = 3
+
+class TrafficClass(Enum):
+    # What a connection carries, as (IP TOS byte, SO_PRIORITY). The TOS byte
+    # holds a DSCP that Wi-Fi (WMM) and most routers queue by, SO_PRIORITY
+    # does the same for the robot's own qdisc before it gets that far.
+    CONTROL = (0xB8, 6)  # DSCP EF, the voice queue on Wi-Fi
+    VIDEO = (0x88, 4)  # DSCP AF41, the video queue
+
+class Compression(Enum):
+    # How a message's payload and out-of-band buffers were compressed, kept
+    # in the header flags byte
+    NONE = 0
+    ZLIB = 0x02
+    LZ4 = 0x04
+    ZSTD = 0x08
+
+# Every message is prefixed with the payload length, a MsgType tag, the
+# number of out-of-band buffers that follow the payload and a flags byte.
+# Each of those buffers has its length sent right after the header, then
+# a stampStruct if FLAG_TIMESTAMPS is set. Lengths are as sent, so
+# compressed sizes when the flags hold a Compression.
+headerStruct = struct.Struct('<QBBB')
+bufferLengthStruct = struct.Struct('<Q')
+FLAG_TIMESTAMPS = 0x01
+FLAG_COMPRESSION = 0x0E  # Bits holding the Compression value
+# Sender's clock when it sent the message, the peer's clock from the last
+# message it got from the peer (0 if none yet) and how long it held on to
+# that before this send. The peer works out the round trip time from its
+# own clock alone, no ping messages or clock sync needed.
+stampStruct = struct.Struct('<ddd')
+maxOobBuffers = 255
+# Anything claiming to be bigger than this is treated as a corrupted header
+maxMessageSize = 64 * 1024 * 1024
+# Messages smaller than this are never compressed, it would cost more time
+# than the bytes saved are worth (a telemData is about 160 bytes)
+compressThreshold = 4096
+# Compressed output has to be at least this much smaller to be sent, a couple
+# of percent off a JPEG isn't worth the receiver decompressing it
+minCompressionSaving = 0.05
+
+# The decompressors stop after limit + 1 bytes so a corrupted or hostile
+# message can't blow up in memory, decompressPayload rejects anything that
+# comes out bigger than limit.
+
+def zlibDecompress(data, limit):
+    decompressor = zlib.decompressobj()
+    result = decompressor.decompress(data, limit + 1)
+    if len(result) <= limit and not decompressor.eof:
+        raise ValueError("Compressed payload is cut short or corrupted")
+    return result
+
+def lz4Decompress(data, limit):
+    decompressor = lz4Frame.LZ4FrameDecompressor()
+    result = decompressor.decompress(data, max_length=limit + 1)
+    if len(result) <= limit and not decompressor.eof:
+        raise ValueError("Compressed payload is cut short or corrupted")
+    return result
+
+def zstdDecompress(data, limit):
+    # Our compressor writes the size into the frame header, check it before
+    # anything is allocated. Without one max_output_size caps the output.
+    size = zstandard.frame_content_size(data)
+    if size > limit:
+        raise ValueError(f'Compressed payload claims {size} bytes')
+    return zstandard.ZstdDecompressor().decompress(data, max_output_size=limit + 1)
+
+# Compression -> (compress, decompress). Fast settings throughout, this is
+# about Wi-Fi airtime on a Pi, not the smallest possible message.
+compressors = {
+    Compression.ZLIB: (lambda data: zlib.compress(data, 1), zlibDecompress),
+}
+if lz4Frame is not None:
+    compressors[Compression.LZ4] = (lz4Frame.compress, lz4Decompress)
+if zstandard is not None:
+    # A compressor object isn't thread safe, a new one per message is cheap
+    compressors[Compression.ZSTD] = (lambda data: zstandard.ZstdCompressor(level=1).compress(data), zstdDecompress)
+
+# Types with their own fixed-layout codec. Anything else goes through pickle.
+codecTypes = {
+    telemData: MsgType.TELEM,
+    commandData: MsgType.COMMAND,
+    telemDelta: MsgType.TELEM_DELTA,
+}
+codecDecoders = {
+    MsgType.TELEM.value: telemData.unpack,
+    MsgType.COMMAND.value: commandData.unpack,
+    MsgType.TELEM_DELTA.value: telemDelta.unpack,
+}
+
+# Bytes the kernel may hold unsent on a TCP connection with a TrafficClass
+# before a send blocks. Anything handed to the kernel can't be overtaken or
+# dropped, so a deep backlog only makes every later frame or telemetry
+# packet older by the time it goes out. Blocking early leaves the choice of
+# what to send next with us (the newest frame in the slot).
+unsentLimit = 16 * 1024
+
+def tuneSocket(sock, trafficClass: TrafficClass):
+    # Best effort, not every platform has every option
+    tos, priority = trafficClass.value
+    options = [(socket.IPPROTO_IP, socket.IP_TOS, tos)]
+    if hasattr(socket, 'SO_PRIORITY'):
+        options.append((socket.SOL_SOCKET, socket.SO_PRIORITY, priority))
+    if hasattr(socket, 'TCP_NOTSENT_LOWAT') and sock.type == socket.SOCK_STREAM:
+        options.append((socket.IPPROTO_TCP, socket.TCP_NOTSENT_LOWAT, unsentLimit))
+    for level, option, value in options:
+        try:
+            sock.setsockopt(level, option, value)
+        except OSError:
+            logging.warning(f'Could not set socket option {option} to {value} for {trafficClass}', exc_info=True)
+
+def encodePayload(obj):
+    # Returns the MsgType, the main payload and a list of out-of-band buffers.
+    # Pickle protocol 5 hands large buffers (like the ndarray from cv2.imencode)
+    # to the callback instead of copying them into the pickle.
+    msgType = codecTypes.get(type(obj))
+    if msgType is not None:
+        return msgType, obj.pack(), []
+    buffers = []
+    packed = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+    if len(buffers) > maxOobBuffers:
+        # Too many to describe in the header, just pickle them in-band
+        return MsgType.PICKLE, pickle.dumps(obj, protocol=5), []
+    return MsgType.PICKLE, packed, [buffer.raw() for buffer in buffers]
+
+def compressPayload(packed, buffers, compression: Compression, threshold=compressThreshold):
+    # Compressed payload and buffers and the Compression used. Left as they
+    # are (Compression.NONE) when smaller than threshold or when compressing
+    # hardly made them smaller, like an already compressed JPEG.
+    size = len(packed) + sum(memoryview(buffer).nbytes for buffer in buffers)
+    if compression == Compression.NONE or size < threshold:
+        return packed, buffers, Compression.NONE
+    compress, _ = compressors[compression]
+    compressedPacked = compress(packed)
+    compressedBuffers = [memoryview(compress(buffer)) for buffer in buffers]
+    if len(compressedPacked) + sum(buffer.nbytes for buffer in compressedBuffers) > size * (1 - minCompressionSaving):
+        return packed, buffers, Compression.NONE
+    return compressedPacked, compressedBuffers, compression
+
+def decompressPayload(flags, data, buffers):
+    # Inverse of compressPayload, going by the header flags. Raises
+    # ValueError for an unknown codec, corrupted data or a message that
+    # comes out bigger than maxMessageSize, payload and buffers together.
+    bits = flags & FLAG_COMPRESSION
+    if not bits:
+        return data, buffers
+    try:
+        compression = Compression(bits)
+        _, decompress = compressors[compression]
+    except (ValueError, KeyError):
+        raise ValueError(f'Message uses compression {bits:#x} which is not available here')
+    remaining = maxMessageSize
+    decompressed = []
+    try:
+        for part in [data] + list(buffers):
+            result = decompress(part, remaining)
+            if len(result) > remaining:
+                raise ValueError(f'Decompressed message is larger than {maxMessageSize}')
+            remaining -= len(result)
+            decompressed.append(result)
+    except Exception as error:
+        # Every codec has its own error type for bad data
+        raise ValueError(f'Decompressing {compression} payload failed: {error}') from error
+    # Buffers stay writable like uncompressed ones, an unpickled ndarray points into them
+    return decompressed[0], [bytearray(buffer) for buffer in decompressed[1:]]
+
+def encodeMessage(obj, stamp=None, compression=Compression.NONE, threshold=compressThreshold):
+    # Full wire representation of obj as a list of buffers: header (plus
+    # out-of-band buffer lengths and the optional stamp), payload, then the
+    # out-of-band buffers. Encoding once and sending the list to several
+    # peers avoids re-pickling.
+    msgType, packed, buffers = encodePayload(obj)
+    packed, buffers, used = compressPayload(packed, buffers, compression, threshold)
+    flags = (FLAG_TIMESTAMPS if stamp is not None else 0) | used.value
+    header = [headerStruct.pack(len(packed), msgType.value, len(buffers), flags)]
+    for buffer in buffers:
+        header.append(bufferLengthStruct.pack(buffer.nbytes))
+    if stamp is not None:
+        header.append(stampStruct.pack(*stamp))
+    return [b''.join(header), packed] + buffers
+
+def decodeMessage(message):
+    # Inverse of encodeMessage for when the whole thing is already in one
+    # buffer (e.g. reassembled from datagrams). Slices are zero-copy views.
+    view = memoryview(message)
+    (length, msgType, bufferCount, flags) = headerStruct.unpack_from(view)
+    offset = headerStruct.size
+    bufferLengths = []
+    for _ in range(bufferCount):
+        (bufferLength,) = bufferLengthStruct.unpack_from(view, offset)
+        bufferLengths.append(bufferLength)
+        offset += bufferLengthStruct.size
+    if flags & FLAG_TIMESTAMPS:
+        offset += stampStruct.size  # Only meaningful on a two way connection
+    if offset + length + sum(bufferLengths) != len(view):
+        raise ValueError(f'Message is {len(view)} bytes but the header describes {offset + length + sum(bufferLengths)}')
+    data = view[offset:offset + length]
+    offset += length
+    buffers = []
+    for bufferLength in bufferLengths:
+        buffers.append(view[offset:offset + bufferLength])
+        offset += bufferLength
+    data, buffers = decompressPayload(flags, data, buffers)
+    return decodePayload(msgType, data, buffers)
+
+def decodePayload(msgType, data, buffers=()):
+    if msgType == MsgType.PICKLE.value:
+        return pickle.loads(data, buffers=buffers)
+    decoder = codecDecoders.get(msgType)
+    if decoder is None:
+        raise ValueError(f'Unknown message type {msgType}')
+    return decoder(data)
+
+class linkStats():
+    # Counters and timing for one connection, kept by robotNetworkModule on
+    # every message. Read the attributes directly or take a snapshot(), which
+    # adds rates and timing since the previous snapshot.
+
+    def __init__(self) -> None:
+        self.messagesSent = 0
+        self.bytesSent = 0
+        self.messagesReceived = 0
+        self.bytesReceived = 0
+        self.serialize = latencyHistogram("serialize")
+        self.sendBlocking = latencyHistogram("send")
+        self.deserialize = latencyHistogram("deserialize")
+        self.rtt = latencyHistogram("rtt")
+        self.lastRtt = None  # Seconds, None until the peer has echoed a stamp
+        self.since = time.perf_counter()
+        self.lastTotals = (0, 0, 0, 0)
+
+    def snapshot(self):
+        now = time.perf_counter()
+        elapsed = now - self.since
+        totals = (self.messagesSent, self.bytesSent, self.messagesReceived, self.bytesReceived)
+        rates = [(total - last) / elapsed if elapsed > 0 else 0.0 for total, last in zip(totals, self.lastTotals)]
+        result = {
+            'messages_sent': self.messagesSent,
+            'bytes_sent': self.bytesSent,
+            'messages_received': self.messagesReceived,
+            'bytes_received': self.bytesReceived,
+            'sent_per_s': rates[0],
+            'send_bytes_per_s': rates[1],
+            'received_per_s': rates[2],
+            'receive_bytes_per_s': rates[3],
+            'rtt_ms': self.lastRtt * 1000 if self.lastRtt is not None else None,
+            'serialize': self.serialize.snapshot(),
+            'send': self.sendBlocking.snapshot(),
+            'deserialize': self.deserialize.snapshot(),
+            'rtt': self.rtt.snapshot(),
+        }
+        self.since = now
+        self.lastTotals = totals
+        return result
+
 class robotNetworkModule:
 
-    def __init__(self, mode: ConnModes, address, port) -> None:
+    def __init__(self, mode: ConnModes, address, port, timestamps=False, trafficClass: TrafficClass = None,
+                 compression=Compression.NONE, compressionThreshold=compressThreshold) -> None:
 
         self.mode = mode
         self.address = address
         self.port = port
         self.successfulConnection = False
+        self.timestamps = timestamps  # Stamp outgoing messages so the peer can measure round trips
+        self.trafficClass = trafficClass  # None leaves the sockets as the OS makes them
+        # Outgoing messages of at least compressionThreshold bytes are sent
+        # compressed when that makes them smaller. Only the sender picks, the
+        # header tells the receiver what to do.
+        self.compression = compression
+        self.compressionThreshold = compressionThreshold
+        self.stats = linkStats()
+        self.peerStamp = None  # (peer's clock, our clock when it arrived) from the last stamped message
         self.client_socket = None
         self.client_address = None
 
         self.server_socket = None
         self.server_address = None
 
+        # Reused for every receive so big payloads aren't rebuilt chunk by chunk
+        self.headerBuffer = bytearray(headerStruct.size)
+        self.bufferLengths = bytearray(bufferLengthStruct.size * maxOobBuffers)
+        self.stampBuffer = bytearray(stampStruct.size)
+        self.recvBuffer = bytearray(65536)
+
         if mode == ConnModes.CLIENT:
 
             logging.basicConfig(
@@ -48,6 +339,9 @@ class robotNetworkModule:
             try:
                 self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                 self.server_socket.settimeout(10)
+                self.server_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                if trafficClass is not None:
+                    tuneSocket(self.server_socket, trafficClass)
                 self.server_socket.connect((address, port))
                 self.successfulConnection = True
             except socket.timeout:
@@ -79,6 +373,10 @@ class robotNetworkModule:
             self.sock.listen()
             logging.info(f'Server is listening on {address}:{port}...')
             
+        if compression != Compression.NONE and compression not in compressors:
+            logging.warning(f'{compression} is not installed, compressing with zlib instead.')
+            self.compression = Compression.ZLIB
+
         if mode != ConnModes.CLIENT or mode != ConnModes.SERVER:
             logging.error("No proper mode selected. Check your code.")
 
@@ -117,6 +415,12 @@ class robotNetworkModule:
         if self.mode == ConnModes.SERVER:
             logging.debug("Server is waiting for a connection... (This is blocking)")
             self.client_socket, self.client_address = self.sock.accept()
+            # Every message goes out in one sendmsg already, Nagle would only
+            # hold small ones (commands) back waiting for an ACK
+            self.client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if self.trafficClass is not None:
+                tuneSocket(self.client_socket, self.trafficClass)
+            self.peerStamp = None # Stamps from the last client mean nothing to this one
             logging.info(f'Server has accepted a connection from -> {self.client_address}')
             return True
         else:
@@ -133,14 +437,13 @@ class robotNetworkModule:
         if self.mode == ConnModes.CLIENT:
             sock = self.server_socket    
 
-        packed = pickle.dumps(ObjToSend)
-        length = struct.pack('<Q', len(packed))
-
-        # Attempt to send the length of data we are about to send
+        # Header, payload and any out-of-band buffers go out together
+        start = time.perf_counter()
+        message = encodeMessage(ObjToSend, self.makeStamp(start) if self.timestamps else None,
+                                self.compression, self.compressionThreshold)
+        encoded = time.perf_counter()
         try:
-            sock.sendall(length)
-            # Hopefully the client has received the data. We will send the rest of our data
-            sock.sendall(packed)
+            self.sendBuffers(sock, message)
         except socket.timeout:
             logging.error("Attempting to send data has timed out ->", exc_info=True)
             return FailureType.CON_TIMEOUT
@@ -153,7 +456,26 @@ class robotNetworkModule:
         except socket.error:
             logging.error("Attempting to send data has failed ->", exc_info=True)
             return FailureType.SOCKET_ERROR
+        stats = self.stats
+        stats.serialize.add(encoded - start)
+        stats.sendBlocking.add(time.perf_counter() - encoded)
+        stats.messagesSent += 1
+        stats.bytesSent += sum(memoryview(buffer).nbytes for buffer in message)
         return FailureType.NONE
+
+    def makeStamp(self, now):
+        peerStamp = self.peerStamp
+        if peerStamp is None:
+            return (now, 0.0, 0.0)
+        return (now, peerStamp[0], now - peerStamp[1])
+
+    def handleStamp(self, now):
+        (sentAt, echoed, heldFor) = stampStruct.unpack(self.stampBuffer)
+        self.peerStamp = (sentAt, now)
+        if echoed > 0:
+            rtt = now - echoed - heldFor
+            self.stats.rtt.add(rtt)
+            self.stats.lastRtt = rtt
     
     def receivePyObject(self):
 
@@ -165,30 +487,97 @@ class robotNetworkModule:
         if self.mode == ConnModes.CLIENT:
             sock = self.server_socket  
 
-        length = sock.recv(8) # Get length of content client is sending
-        if not length: # Handle possible abrupt disconnection.
+        try:
+            return self.receiveFrom(sock)
+        except socket.timeout:
+            logging.error("Attempting to receive data has timed out ->", exc_info=True)
+            return FailureType.CON_TIMEOUT
+        except ConnectionResetError:
+            logging.error("Connection was reset by remote ->", exc_info=True)
             return self.handleNoData()
-        
-        try:    
-            (length,) = struct.unpack('<Q', length) # TODO: This can error out if our data is bad
+        except socket.error:
+            logging.error("Attempting to receive data has failed ->", exc_info=True)
+            return FailureType.SOCKET_ERROR
+
+    def receiveFrom(self, sock):
+        if not self.recvExactly(sock, memoryview(self.headerBuffer)): # Get length and type of content client is sending
+            return self.handleNoData() # Handle possible abrupt disconnection.
+
+        try:
+            (length, msgType, bufferCount, flags) = headerStruct.unpack(self.headerBuffer)
         except struct.error:
-            logging.error(f'Unpack of data for content length -> {length} has failed. This indicates corrupted/bad data.')
+            logging.error(f'Unpack of data for content length -> {bytes(self.headerBuffer)} has failed. This indicates corrupted/bad data.')
             return FailureType.UNPACK
 
-        data = b''
-        while len(data) < length:
-            # doing it in batches is generally better than trying
-            # to do it all in one go, so I believe.
-            to_read = length - len(data)
-            received = sock.recv(
-                4096 if to_read > 4096 else to_read)
-            if not received:
+        lengthsView = memoryview(self.bufferLengths)[:bufferLengthStruct.size * bufferCount]
+        if not self.recvExactly(sock, lengthsView):
+            return self.handleNoData()
+        bufferLengths = [bufferLength for (bufferLength,) in bufferLengthStruct.iter_unpack(lengthsView)]
+        if length + sum(bufferLengths) > maxMessageSize:
+            logging.error(f'Content length -> {length} + {bufferLengths} is larger than {maxMessageSize}. This indicates corrupted/bad data.')
+            return FailureType.UNPACK
+        if flags & FLAG_TIMESTAMPS:
+            if not self.recvExactly(sock, memoryview(self.stampBuffer)):
                 return self.handleNoData()
-            data += received
-            
-        unpacked = pickle.loads(data) # Turn back into a python object
+            self.handleStamp(time.perf_counter())
+
+        if length > len(self.recvBuffer):
+            # Grow geometrically so a slowly increasing frame size doesn't reallocate every time
+            self.recvBuffer = bytearray(max(length, len(self.recvBuffer) * 2))
+        data = memoryview(self.recvBuffer)[:length]
+        if not self.recvExactly(sock, data):
+            return self.handleNoData()
+
+        # Out-of-band buffers get their own allocation since the unpickled
+        # object (e.g. an ndarray) keeps pointing at them after we return.
+        buffers = []
+        for bufferLength in bufferLengths:
+            buffer = bytearray(bufferLength)
+            if not self.recvExactly(sock, memoryview(buffer)):
+                return self.handleNoData()
+            buffers.append(buffer)
+
+        start = time.perf_counter()
+        try:
+            data, buffers = decompressPayload(flags, data, buffers)
+            unpacked = decodePayload(msgType, data, buffers) # Turn back into a python object
+        except (ValueError, struct.error):
+            logging.error(f'Decoding message of type {msgType} has failed. This indicates corrupted/bad data.', exc_info=True)
+            return FailureType.UNPACK
+        stats = self.stats
+        stats.deserialize.add(time.perf_counter() - start)
+        stats.messagesReceived += 1
+        stats.bytesReceived += (headerStruct.size + len(lengthsView) + length + sum(bufferLengths)
+                                + (stampStruct.size if flags & FLAG_TIMESTAMPS else 0))
         return unpacked
     
+    def sendBuffers(self, sock, buffers):
+        # Puts every buffer on the wire with as few syscalls as possible.
+        # sendmsg isn't available everywhere (Windows), fall back to sendall.
+        if not hasattr(sock, 'sendmsg'):
+            for buffer in buffers:
+                sock.sendall(buffer)
+            return
+        views = [memoryview(buffer).cast('B') for buffer in buffers]
+        while views:
+            sent = sock.sendmsg(views)
+            # Drop whatever went out completely and trim a partially sent buffer
+            while views and sent >= views[0].nbytes:
+                sent -= views[0].nbytes
+                views.pop(0)
+            if sent:
+                views[0] = views[0][sent:]
+
+    def recvExactly(self, sock, view):
+        # Reads straight into the given memoryview until it's full.
+        # Returns False if the remote closed the connection before that.
+        while len(view) > 0:
+            received = sock.recv_into(view)
+            if received == 0:
+                return False
+            view = view[received:]
+        return True
+
     def isFailure(self, check):
         if isinstance(check, FailureType):
             failureEnums = [FailureType.CON_CLOSED, FailureType.CON_TIMEOUT, FailureType.SOCKET_ERROR, FailureType.UNPACK, FailureType.RECONNECTED]
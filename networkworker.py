@@ -0,0 +1,70 @@
+import threading
+import time
+from networkmodule import robotNetworkModule
+from latestslot import latestSlot
+
+# Does the socket work for a UI on its own threads so the UI never waits on
+# the network. Received objects land in `received`, the newest object put
+# in `outgoing` gets sent and anything put before it that hasn't gone out
+# yet is dropped. The UI side only touches the slots (peek() is lock free)
+# and `failure`, which is set to the FailureType once the connection fails.
+# With a keepalive the last object sent goes again whenever nothing new has
+# been put for that many seconds, so the UI only has to put changes.
+# Messages that only make sense on top of the previous ones (telemetry
+# deltas) need `merge`, called on the receive thread with what's in
+# `received` and the new message, what it returns goes in `received`.
+# Merging here means a delta the UI never got to see isn't lost.
+
+
+class networkWorker():
+
+    def __init__(self, rnm: robotNetworkModule, keepalive=None, merge=None) -> None:
+        self.rnm = rnm
+        self.keepalive = keepalive
+        self.merge = merge
+        self.keepalivesSent = 0
+        self.received = latestSlot()
+        self.outgoing = latestSlot()
+        self.lastReceived = None  # perf_counter of the last receive, None until the first one
+        self.failure = None
+        self.stopped = threading.Event()
+        self.receiveThread = threading.Thread(target=self.receiveLoop, name="receive", daemon=True)
+        self.sendThread = threading.Thread(target=self.sendLoop, name="send", daemon=True)
+        self.receiveThread.start()
+        self.sendThread.start()
+
+    def receiveLoop(self):
+        while not self.stopped.is_set():
+            result = self.rnm.receivePyObject()
+            if self.rnm.isFailure(result):
+                self.failure = result
+                return
+            self.lastReceived = time.perf_counter()
+            if self.merge is not None:
+                result = self.merge(self.received.peek(), result)
+            self.received.put(result)
+
+    def sendLoop(self):
+        lastSent = None
+        while not self.stopped.is_set():
+            toSend = self.outgoing.take(timeout=self.keepalive or 0.5)
+            if toSend is None:
+                if self.keepalive is None or lastSent is None:
+                    continue
+                toSend = lastSent
+                self.keepalivesSent += 1
+            result = self.rnm.sendPyObject(toSend)
+            if self.rnm.isFailure(result):
+                self.failure = result
+                return
+            lastSent = toSend
+
+    def silentFor(self):
+        # Seconds since anything arrived, None if nothing has yet
+        if self.lastReceived is None:
+            return None
+        return time.perf_counter() - self.lastReceived
+
+    def stop(self):
+        # The threads finish once their current receive/send returns
+        self.stopped.set()
@@ -0,0 +1,97 @@
+import logging
+import sys
+import threading
+import time
+from networkmodule import robotNetworkModule
+from networkmodule import ConnModes
+from networkmodule import TrafficClass
+from telemRecorder import RecordKind
+from telemRecorder import recordingFiles
+from telemRecorder import openRecording
+from telemRecorder import toMessage
+from telemRecorder import playbackTimes
+
+# Plays telemetry recorded by robot-local-main back to gui-client.py as if
+# it were the robot, so clients can be tried out and load tested without
+# the hardware. Commands the client sends are read and counted, not acted on.
+#   python replayTelemetry.py [recording directory] [speed]
+
+logging.basicConfig(
+    filename="replayTelemetry.log",
+    encoding="utf-8",
+    filemode='a',
+    format="{asctime} - {levelname} - {message}",
+    style="{",
+    datefmt="%Y-%m-%d %H:%M",
+    level=logging.DEBUG,
+)
+
+recordingDirectory = "recordings"
+replaySpeed = 1.0  # 2.0 plays back twice as fast, 0 sends as fast as the client takes them
+loopReplay = True  # Start over at the end instead of dropping the client
+maxGap = 1.0  # Seconds, longer pauses in the recording (robot had no client) are cut down to this
+replayPort = 4421  # Same port robot-local-main serves gui-client on
+
+if len(sys.argv) > 1:
+    recordingDirectory = sys.argv[1]
+if len(sys.argv) > 2:
+    replaySpeed = float(sys.argv[2])
+
+
+def drainCommands(rnm: robotNetworkModule, stop: threading.Event, counts: dict):
+    while not stop.is_set():
+        result = rnm.receivePyObject()
+        if rnm.isFailure(result):
+            stop.set()
+            return
+        counts['commands'] += 1
+
+def replay(rnm: robotNetworkModule, segments):
+    stop = threading.Event()
+    counts = {'commands': 0, 'telemetry': 0}
+    threading.Thread(target=drainCommands, args=(rnm, stop, counts), daemon=True).start()
+    started = time.perf_counter()
+    while not stop.is_set():
+        for records in segments:
+            times = playbackTimes(records)  # The wall clock can step back
+            playClock = 0.0 # Seconds into the segment, gaps cut down to maxGap
+            wallStart = time.perf_counter()
+            for i in range(len(records)):
+                if stop.is_set():
+                    break
+                if i > 0:
+                    playClock += min(times[i] - times[i - 1], maxGap)
+                if replaySpeed > 0:
+                    delay = playClock / replaySpeed - (time.perf_counter() - wallStart)
+                    if delay > 0:
+                        stop.wait(delay)
+                result = rnm.sendPyObject(toMessage(records[i]))
+                if rnm.isFailure(result):
+                    stop.set()
+                    break
+                counts['telemetry'] += 1
+        if not loopReplay:
+            break
+    elapsed = time.perf_counter() - started
+    logging.info(f'Replayed {counts["telemetry"]} telemetry messages in {elapsed:.1f}s ({counts["telemetry"] / elapsed:.1f}/s), client sent {counts["commands"]} commands')
+
+
+segments = [openRecording(path) for path in recordingFiles(recordingDirectory, RecordKind.TELEM)]
+segments = [records for records in segments if len(records) > 0]
+if not segments:
+    logging.fatal(f'No telemetry recordings in {recordingDirectory}')
+    print(f'No telemetry recordings in {recordingDirectory}')
+    exit()
+total = sum(len(records) for records in segments)
+logging.info(f'Loaded {total} telemetry records from {len(segments)} files in {recordingDirectory}')
+
+rnm = robotNetworkModule(ConnModes.SERVER, "0.0.0.0", replayPort, trafficClass=TrafficClass.CONTROL)
+if rnm.successfulConnection != True:
+    logging.fatal("Server failed to start. Check networking logs.")
+    exit()
+
+while True:
+    logging.info("Replay server is waiting for a client.")
+    rnm.waitForConnection()
+    replay(rnm, segments)
+    rnm.client_socket.close()
@@ -1,6 +1,4 @@
-import re
-import subprocess
-import serial
+import socket
 import time
 from configparser import ConfigParser
 import os.path
@@ -8,10 +6,18 @@ import logging
 from networkmodule import robotNetworkModule
 from networkmodule import FailureType
 from networkmodule import ConnModes
+from networkmodule import Compression
+from networkmodule import TrafficClass
 from robotTelemModule import telemData
 from robotTelemModule import commandData
-import psutil
-import platform
+import threading
+from timingstats import stageStats
+from latestslot import latestSlot
+from samplering import sampleRing
+from telemRecorder import telemetryRecorder
+from systemMetrics import metricsSampler
+from telemPublisher import telemPublisher
+from robotMcuModule import mcuControl
 
 ## Set up logger
 
@@ -25,55 +31,10 @@ logging.basicConfig(
     level=logging.DEBUG,
 )
 
-class mcuControl():
-
-    def __init__(self, serialPath: str) -> None:
-        self.lastHeartBeatMs = round(time.time() * 1000)
-        try:
-            self.mcuSerial = serial.Serial(
-                port=serialPath,
-                baudrate=115200,
-                timeout=5000
-            )
-        except serial.SerialException:
-            logging.fatal(f'Unable to open serial port to MCU at {serialPath=} shutting down...', exc_info=True)
-            exit()
-        logging.debug(f'Opened serial port to MCU at {serialPath=}')
-
-    def readMessage(self):
-        data = self.mcuSerial.readline()
-        time.sleep(1./120)
-        if len(data) > 0:
-            try:
-                decoded = data.decode('utf-8').rstrip()
-            except UnicodeDecodeError:
-                logging.error("Received corrupt data from the MCU ->", exc_info=True)
-                return ""
-            return decoded
-        else:
-            return ""
-   
-    def sendMessage(self, message: str):
-        message = message + "\n"
-        self.mcuSerial.write(message.encode('utf-8'))
-        time.sleep(1./120)
-
-    def heartBeat(self):
-        if (round(time.time() * 1000) - self.lastHeartBeatMs) > 150:
-            self.sendMessage("heartbeat")
-            if self.readMessage() == "heartbeat":
-                pass # Cool, got good data
-            else:
-                logging.warning("Possible data corruption between MCU. Heartbeat did not return correct data.")
-        else:
-            pass
-        self.lastHeartBeatMs = round(time.time() * 1000)
-
-    def getPower(self):
-        self.sendMessage("pwr")
-        return self.readMessage()
-
 class pwrSubSystem():
+    historySize = 36000 # Samples kept, half an hour at 20/s
+    smoothing = 30.0 # Seconds, time constant for the battery percentage and timeLeft
+
     def __init__(self, battSize: int):
         self.ch1volt = 0.0
         self.ch2volt = 0.0
@@ -87,80 +48,72 @@ class pwrSubSystem():
         self.timeLeft = 0.0
         self.battSize = battSize
         self.voltageBatteryPercent = 0.0
+        self.lock = threading.Lock() # Pushed readings arrive on the MCU reader thread
+        # Every reading in the order the MCU sends them: ch1 volts, ch1 mA,
+        # ch2 volts, ch2 mA, ch3 volts, ch3 mA
+        self.history = sampleRing(self.historySize, 6, self.smoothing)
 
     def utilCalc(self):
         self.avgVolt = round(((self.ch1volt + self.ch2volt + self.ch3volt) / 3), 2)
         self.avgMa = round(((self.ch1ma + self.ch2ma + self.ch3ma) / 3), 2)
         self.totalMa = self.ch1ma + self.ch2ma + self.ch3ma
+        # Percentage and time left go off the smoothed readings so they don't
+        # jump around with every current spike
+        smoothed = self.history.ema
+        smoothVolt = float(smoothed[0] + smoothed[2] + smoothed[4]) / 3
+        smoothMa = float(smoothed[1] + smoothed[3] + smoothed[5])
         try:
             # Mapping ranges
-            self.voltageBatteryPercent = 0 + (float(self.avgVolt - 9.0) / float(12.70 - 9.0) * (100 - 0))
+            self.voltageBatteryPercent = 0 + (float(smoothVolt - 9.0) / float(12.70 - 9.0) * (100 - 0))
 
-            self.timeLeft = round(((self.battSize * (self.voltageBatteryPercent / 100)) / self.totalMa), 2) # In hours
+            self.timeLeft = round(((self.battSize * (self.voltageBatteryPercent / 100)) / smoothMa), 2) # In hours
 
         except ZeroDivisionError:
             logging.error("Bad data from calculated averages from MCU -> Check values from Ingest", exc_info=True)
 
-    def ingestFromMCU(self, data: str):
-        try:
-            datapoints = data.split(" ")
-            self.ch1volt = float(datapoints[0])
-            self.ch1ma = float(datapoints[1])
-            self.ch2volt = float(datapoints[2])
-            self.ch2ma = float(datapoints[3])
-            self.ch3volt = float(datapoints[4])
-            self.ch3ma = float(datapoints[5])
-        except ValueError:
-            logging.error(f'Bad data from MCU ingest -> Possible data corruption {data=}', exc_info=True)
-        except Exception:
-            logging.error(f'Error when processing data for ingest {data=}', exc_info=True)
-        self.utilCalc()
+    def ingestFromMCU(self, readings):
+        # readings comes straight from mcu.getPower(), None when the MCU didn't
+        # answer (already logged) so the last good values are kept
+        if readings is None:
+            return
+        now = time.monotonic()
+        with self.lock:
+            (self.ch1volt, self.ch1ma,
+             self.ch2volt, self.ch2ma,
+             self.ch3volt, self.ch3ma) = readings
+            self.history.append(now, readings)
+            self.utilCalc()
 
     def reportToTelem(self, telem: telemData):
-        telem.ch1volt = self.ch1volt
-        telem.ch2volt = self.ch2volt
-        telem.ch3volt = self.ch3volt
-        telem.ch1ma = self.ch1ma
-        telem.ch2ma = self.ch2ma
-        telem.ch3ma = self.ch3ma
-        telem.avgVolt = self.avgVolt
-        telem.avgMa = self.avgMa
-        telem.totalMa = self.totalMa
-        telem.timeLeft = self.timeLeft
-        telem.battSize = telem.battSize
-        telem.voltageBatteryPercent = self.voltageBatteryPercent
-        return telem
+        with self.lock:
+            telem.ch1volt = self.ch1volt
+            telem.ch2volt = self.ch2volt
+            telem.ch3volt = self.ch3volt
+            telem.ch1ma = self.ch1ma
+            telem.ch2ma = self.ch2ma
+            telem.ch3ma = self.ch3ma
+            telem.avgVolt = self.avgVolt
+            telem.avgMa = self.avgMa
+            telem.totalMa = self.totalMa
+            telem.timeLeft = self.timeLeft
+            telem.battSize = telem.battSize
+            telem.voltageBatteryPercent = self.voltageBatteryPercent
+            return telem
 
 class internalReporting():
-    
-    def __init__(self) -> None:
-        self.cpu_usage = 0
-        self.ram_usage = 0
-        self.cpu_temp = 0
-        self.wifiSignal = "Not Available"
-        self.lastReport = round(time.time() * 1000)
+    # CPU/RAM/temperature/WiFi come from a sampler thread, nothing here
+    # touches the system so the control loop never waits on it
+
+    def __init__(self, intervals=None) -> None:
+        self.sampler = metricsSampler(intervals)
+        self.sampler.start()
 
-    def update(self):
-        currentTime = round(time.time() * 1000)
-        if (currentTime - self.lastReport) > 15000:
-            if platform.system() == "Linux":
-                self.cpu_usage = psutil.cpu_percent(interval=None)
-                self.ram_usage = psutil.virtual_memory().percent
-                temps = psutil.sensors_temperatures()
-                if "coretemp" in temps:
-                    self.cpu_temp = temps["coretemp"][0].current
-                result = subprocess.run(['iwconfig', "wlan0"], capture_output=True, text=True)
-                signal_level = re.search(r'Signal level=(-?\d+)', result.stdout)
-                if signal_level:
-                    self.wifiSignal = int(signal_level.group(1))
-                self.lastReport = currentTime
-        
-    
     def reportToTelem(self, telem: telemData):
-        telem.cpu_usage = self.cpu_usage
-        telem.ram_usage = self.ram_usage
-        telem.cpu_temp = self.cpu_temp
-        telem.wifiSignal = self.wifiSignal
+        latest = self.sampler.latest.peek()
+        telem.cpu_usage = latest['cpu_usage']
+        telem.ram_usage = latest['ram_usage']
+        telem.cpu_temp = latest['cpu_temp']
+        telem.wifiSignal = latest['wifiSignal']
         return telem
 
 def handleFailure(result, networkManager: robotNetworkModule, associatedData):
@@ -203,18 +156,53 @@ config = ConfigParser()
 if os.path.isfile("robotlocal.conf"):
     config.read("robotlocal.conf")
     serialPath = config.get("connection", "mcuSerialPath")
+    compression = Compression[config.get("connection", "compression", fallback="none").upper()]
+    compressionThreshold = config.getint("connection", "compressionThreshold", fallback=4096)
     cameraID = config.getint("camera", "sysCamID")
     battSize = config.getint("power", "batterySize")
+    telemetryRate = config.getfloat("timing", "telemetryRate", fallback=20.0)
+    powerStreamRate = config.getfloat("timing", "powerStreamRate", fallback=20.0)
+    keyframeInterval = config.getfloat("timing", "keyframeInterval", fallback=2.0)
+    commandTimeout = config.getfloat("timing", "commandTimeout", fallback=1.0)
+    motorRefresh = config.getfloat("timing", "motorRefresh", fallback=0.5)
+    recordingEnabled = config.getboolean("recording", "enabled", fallback=False)
+    recordingDirectory = config.get("recording", "directory", fallback="recordings")
+    recordingMaxMb = config.getint("recording", "maxFileMb", fallback=64)
+    recordingTotalMb = config.getint("recording", "maxTotalMb", fallback=1024)
+    metricIntervals = {
+        'cpu': config.getfloat("metrics", "cpuInterval", fallback=1.0),
+        'ram': config.getfloat("metrics", "ramInterval", fallback=5.0),
+        'temp': config.getfloat("metrics", "tempInterval", fallback=5.0),
+        'wifi': config.getfloat("metrics", "wifiInterval", fallback=2.0),
+    }
 else:
     logging.debug("New config file generated.")
     config.read('robotlocal.conf')
     config.add_section("connection")
     config.set('connection', 'serverIP', 'IP_HERE')
     config.set('connection', 'mcuSerialPath', 'SERIALPATH')
+    config.set('connection', 'compression', 'none') # zlib, lz4 or zstd (if installed) for messages over compressionThreshold bytes
+    config.set('connection', 'compressionThreshold', '4096')
     config.add_section("camera")
     config.set('camera', 'sysCamID', '0')
     config.add_section("power")
     config.set('power', 'batterySize', '6500')
+    config.add_section("timing")
+    config.set('timing', 'telemetryRate', '20')
+    config.set('timing', 'powerStreamRate', '20') # 0 to poll the MCU every tick instead
+    config.set('timing', 'keyframeInterval', '2') # Seconds between full telemetry messages, only changes in between. 0 sends every one in full
+    config.set('timing', 'commandTimeout', '1') # Seconds without a command (or keepalive) before the motors are stopped
+    config.set('timing', 'motorRefresh', '0.5') # Seconds before an unchanged command is written to the MCU again, 0 writes every one
+    config.add_section("recording")
+    config.set('recording', 'enabled', 'false') # Every telemetry message and command to disk, for replayTelemetry.py
+    config.set('recording', 'directory', 'recordings')
+    config.set('recording', 'maxFileMb', '64')
+    config.set('recording', 'maxTotalMb', '1024') # Oldest recordings are deleted past this, 0 keeps everything
+    config.add_section("metrics") # Seconds between samples of each
+    config.set('metrics', 'cpuInterval', '1')
+    config.set('metrics', 'ramInterval', '5')
+    config.set('metrics', 'tempInterval', '5')
+    config.set('metrics', 'wifiInterval', '2')
     with open("robotlocal.conf", 'w') as f:
         config.write(f)
         print("Please finalize the config file.")
@@ -223,7 +211,8 @@ else:
 
 ## Initialize web server
 logging.info("Starting socket server to send frames / Telem data...")
-rnm = robotNetworkModule(ConnModes.SERVER, "0.0.0.0", 4421)
+rnm = robotNetworkModule(ConnModes.SERVER, "0.0.0.0", 4421, timestamps=True, trafficClass=TrafficClass.CONTROL,
+                         compression=compression, compressionThreshold=compressionThreshold)
 logging.info("Waiting for a connection before starting up MCU.")
 
 # Wait for our client to connect
@@ -231,58 +220,153 @@ rnm.waitForConnection()
 
 
 pwr = pwrSubSystem(battSize)
-mcu = mcuControl(serialPath)
-internal = internalReporting()
+mcu = mcuControl(serialPath, motorRefresh=motorRefresh)
+internal = internalReporting(metricIntervals)
+recorder = None
+if recordingEnabled:
+    # Every telemetry message and command goes to disk, replayTelemetry.py plays them back
+    recorder = telemetryRecorder(recordingDirectory, recordingMaxMb * 1024 * 1024,
+                                 maxTotalBytes=recordingTotalMb * 1024 * 1024 if recordingTotalMb > 0 else None)
 time.sleep(1)
-mcu.mcuSerial.read_all() # Clears garbage from MCU reset
+mcu.clearInput() # Clears garbage from MCU reset
 
+def startPowerStream():
+    # The MCU pushes power readings straight into pwr so the telemetry loop
+    # never waits on the sensors. Polling is the fallback.
+    if powerStreamRate <= 0:
+        return
+    if not mcu.startPowerStream(powerStreamRate, pwr.ingestFromMCU):
+        logging.warning("MCU did not acknowledge power streaming, it will be polled every tick instead.")
 
-waitReason = False
-while True:
+startPowerStream()
+
+# Commands and telemetry run on their own threads so a motor command is
+# forwarded to the MCU as soon as it arrives instead of waiting for the next
+# telemetry round trip. Received commands go through a latest-wins slot to
+# the actuation thread, if the MCU is busy only the newest command gets
+# written instead of working through a backlog. mcuControl queues writes
+# and matches replies itself so the threads can share it without a lock.
+linkDown = threading.Event()
+latestCommand = None # New latestSlot for every client, see below
+actuationLatency = stageStats("command to MCU")
+reportInterval = 30 # Seconds between command latency reports in the log
 
-    if waitReason is False:
+def commandLoop():
+    # Receives commands as fast as the client sends them
+    while not linkDown.is_set():
+        result: commandData = rnm.receivePyObject()
+        if rnm.isFailure(result):
+            if linkDown.is_set() or not handleFailure(result, rnm, None):
+                linkDown.set()
+                return
+            continue
+        latestCommand.put((time.perf_counter(), result))
+        if recorder is not None:
+            recorder.record(result)
+
+def actuationLoop():
+    # Writes the newest command to the MCU whenever there is one. The client
+    # only sends a command when it changes plus a keepalive, if neither turns
+    # up for commandTimeout the client has stalled and the motors are stopped
+    # until the next one does. The heartbeat keeps the MCU from noticing.
+    lastCommand = time.perf_counter()
+    timedOut = False
+    while not linkDown.is_set():
+        item = latestCommand.take(timeout=0.1)
+        if item is None:
+            if not timedOut and time.perf_counter() - lastCommand > commandTimeout:
+                logging.warning(f'No command from the client for {commandTimeout}s, stopping the motors.')
+                mcu.setMotors(0, 0)
+                timedOut = True
+            continue
+        received, command = item
+        lastCommand = received
+        timedOut = False
+        try:
+            mcu.setMotors(command.ma, command.mb)
+        except (NameError, AttributeError, TypeError, ValueError):
+            logging.error(f'Bad data from receiving client data - Possible data corruption', exc_info=True)
+            continue
+        actuationLatency.add(time.perf_counter() - received)
+    mcu.setMotors(0, 0) # Client is gone, don't leave the last command driving
+
+def telemetryLoop():
+    # Publishes telemetry at telemetryRate until the link goes down. A new
+    # client starts with a keyframe, after that mostly only changes go out.
+    interval = 1.0 / telemetryRate
+    publisher = telemPublisher(keyframeInterval) if keyframeInterval > 0 else None
+    nextTick = time.perf_counter()
+    lastReport = nextTick
+    while not linkDown.is_set():
         mcu.heartBeat()
+        if not mcu.powerStreamFresh():
+            pwr.ingestFromMCU(mcu.getPower()) # Not streaming (or it went quiet), ask for a reading
         toSend = telemData()
-        pwr.ingestFromMCU(mcu.getPower())
         toSend = pwr.reportToTelem(toSend)
 
-        internal.update()
         toSend = internal.reportToTelem(toSend)
 
-        result = rnm.sendPyObject(toSend)
-        if rnm.isFailure(result):
-            ishandled = handleFailure(result, rnm, toSend)
-            if ishandled:
-                pass
-            else:
-                waitReason = result
-
-        if waitReason is False:
-            result: commandData = rnm.receivePyObject()
+        message = toSend if publisher is None else publisher.publish(toSend)
+        if recorder is not None:
+            recorder.record(toSend)
+        if message is not None:
+            result = rnm.sendPyObject(message)
             if rnm.isFailure(result):
-                ishandled = handleFailure(result, rnm, toSend)
-                if ishandled:
-                    pass
-                else:
-                    waitReason = result
-            else:
-                try:
-                    mcu.sendMessage(f'ma {result.ma}')
-                    mcu.sendMessage(f'mb {result.mb}')
-                except NameError:
-                    logging.error(f'Bad data from receiving client data - Possible data corruption', exc_info=True)
-                mcu.heartBeat()
-        
+                # A reconnected client gets the full telemetry resent
+                if not handleFailure(result, rnm, toSend):
+                    linkDown.set()
+                    return
+                if publisher is not None:
+                    publisher.reset()
 
-        ## React to com Instructions
-        
-    else:
-        if waitReason is FailureType.CON_CLOSED or FailureType.CON_TIMEOUT:
-            rnm.client_socket.close()
-            logging.info("Server is waiting for a new client.")
-            rnm.waitForConnection()
-            waitReason = False
-            mcu.mcuSerial.read_all() # Clears garbage
-        else:
-            logging.fatal("External network error - Exiting...")
-            exit()
+        now = time.perf_counter()
+        if now - lastReport > reportInterval:
+            stats = actuationLatency.snapshot()
+            logging.info(f'Commands: {stats["rate"]:.1f}/s actuated, {latestCommand.overwritten} superseded, {stats["avg_ms"]:.1f} ms avg to MCU, {stats["max_ms"]:.1f} ms max, '
+                         f'{mcu.motorWrites} motor writes, {mcu.motorWritesSkipped} skipped as unchanged')
+            stats = mcu.roundTrip.snapshot()
+            logging.info(f'MCU: {stats["avg_ms"]:.1f} ms avg round trip, {stats["max_ms"]:.1f} ms max, {mcu.parser.corruptFrames} corrupt frames, {mcu.timeouts} timeouts, {mcu.powerPushes} power readings pushed')
+            link = rnm.stats.snapshot()
+            rtt = link['rtt']
+            logging.info(f'Link: {link["sent_per_s"]:.1f} msgs/s out ({link["send_bytes_per_s"] / 1000:.1f} kB/s), {link["received_per_s"]:.1f} msgs/s in, '
+                         f'rtt p50 {rtt["p50_ms"]:.1f} ms p99 {rtt["p99_ms"]:.1f} ms, send blocked {link["send"]["max_ms"]:.1f} ms max')
+            if publisher is not None:
+                logging.info(f'Telemetry: {publisher.keyframes} keyframes, {publisher.deltas} deltas, {publisher.skipped} ticks with nothing to send')
+            with pwr.lock:
+                mean = pwr.history.mean(reportInterval)
+                peak = pwr.history.percentile(reportInterval, 95)
+                usedMah = pwr.history.integral(reportInterval, [1, 3, 5])
+            if mean is not None:
+                logging.info(f'Power: {usedMah:.2f} mAh used in the last {reportInterval} s, {mean[1] + mean[3] + mean[5]:.0f} mA avg, p95 per channel {peak[1]:.0f}/{peak[3]:.0f}/{peak[5]:.0f} mA')
+            lastReport = now
+        nextTick = max(nextTick + interval, now)
+        linkDown.wait(nextTick - now)
+
+
+while True:
+    linkDown.clear()
+    # Whatever the last client left in the slot must not drive the motors
+    # for this one, or count its wait for us as command latency
+    latestCommand = latestSlot()
+    # A new client stays quiet until its sticks move, until then nothing
+    # from the last one should be driving
+    mcu.resetMotors()
+    commandThread = threading.Thread(target=commandLoop, name="commands", daemon=True)
+    actuationThread = threading.Thread(target=actuationLoop, name="actuation", daemon=True)
+    commandThread.start()
+    actuationThread.start()
+    telemetryLoop()
+
+    # Lost our client. Shutting the socket down wakes the command thread if
+    # it's still blocked waiting for data.
+    try:
+        rnm.client_socket.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    commandThread.join()
+    actuationThread.join()
+    rnm.client_socket.close()
+    logging.info("Server is waiting for a new client.")
+    rnm.waitForConnection()
+    mcu.clearInput() # Clears garbage
+    startPowerStream() # In case the MCU reset while we were waiting
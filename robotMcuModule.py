@@ -0,0 +1,312 @@
+import binascii
+import logging
+import queue
+import struct
+import threading
+import time
+from enum import Enum
+import serial
+from timingstats import stageStats
+
+# Serial link to the ESP32 running microcontroller.ino.
+#
+# Outgoing frames go through a queue to a writer thread so sending a motor
+# command never waits on the port. A reader thread picks up every frame the
+# MCU sends and hands it to the request with the same sequence number, so
+# nothing has to sleep a fixed amount hoping the answer has arrived, and a
+# stray frame can't be mistaken for the reply to a different request.
+#
+# Frames are binary both ways:
+#   sync (0xA5) | type | sequence | payload length | payload | CRC-16
+# The CRC is CRC-16/CCITT-FALSE over type, sequence, length and payload,
+# sent little endian. Replies carry the sequence number of their request,
+# sequence 0 is for frames nobody asked for, like power readings the MCU
+# pushes on its own once POWER_STREAM has turned that on.
+
+class McuMsg(Enum):
+    HEARTBEAT = 1  # Host -> MCU, echoed back empty
+    POWER = 2  # Host -> MCU empty, MCU -> host powerStruct
+    MOTORS = 3  # Host -> MCU motorStruct, no reply
+    POWER_STREAM = 4  # Host -> MCU streamStruct, echoed back. MCU then pushes POWER frames
+
+SYNC = 0xA5
+frameHeader = struct.Struct('<BBBB')  # sync, type, sequence, payload length
+crcStruct = struct.Struct('<H')
+powerStruct = struct.Struct('<6f')  # ch1 volts, ch1 mA, ch2 volts, ch2 mA, ch3 volts, ch3 mA
+motorStruct = struct.Struct('<hh')  # Duty for motor a and b, -255 to 255, sign is direction
+streamStruct = struct.Struct('<H')  # Milliseconds between pushed power readings, 0 turns it off
+maxDuty = 255
+
+# Every type has a fixed payload size each way, a header that disagrees is noise
+requestSizes = {
+    McuMsg.HEARTBEAT.value: 0,
+    McuMsg.POWER.value: 0,
+    McuMsg.MOTORS.value: motorStruct.size,
+    McuMsg.POWER_STREAM.value: streamStruct.size,
+}
+replySizes = {
+    McuMsg.HEARTBEAT.value: 0,
+    McuMsg.POWER.value: powerStruct.size,
+    McuMsg.POWER_STREAM.value: streamStruct.size,
+}
+
+
+def crc16(data):
+    return binascii.crc_hqx(data, 0xFFFF)
+
+
+def encodeFrame(msgType: McuMsg, sequence=0, payload=b''):
+    body = frameHeader.pack(SYNC, msgType.value, sequence, len(payload)) + payload
+    return body + crcStruct.pack(crc16(body[1:]))
+
+
+class frameParser():
+    # Turns a byte stream into (type, sequence, payload) frames. Anything that
+    # fails the header or CRC checks is skipped a byte at a time until the
+    # next sync byte that starts a good frame. payloadSizes is replySizes on
+    # the host, requestSizes on the MCU side.
+
+    def __init__(self, payloadSizes=replySizes) -> None:
+        self.payloadSizes = payloadSizes
+        self.buffer = bytearray()
+        self.framesReceived = 0
+        self.corruptFrames = 0
+        self.bytesDiscarded = 0
+
+    def feed(self, data):
+        self.buffer += data
+        frames = []
+        buffer = self.buffer
+        while True:
+            start = buffer.find(SYNC)
+            if start < 0:
+                self.bytesDiscarded += len(buffer)
+                buffer.clear()
+                break
+            if start > 0:
+                self.bytesDiscarded += start
+                del buffer[:start]
+            if len(buffer) < frameHeader.size:
+                break
+            _, msgType, sequence, length = frameHeader.unpack_from(buffer)
+            if self.payloadSizes.get(msgType) != length:
+                self.corruptFrames += 1
+                del buffer[:1]
+                continue
+            end = frameHeader.size + length + crcStruct.size
+            if len(buffer) < end:
+                break
+            (crc,) = crcStruct.unpack_from(buffer, end - crcStruct.size)
+            if crc16(buffer[1:end - crcStruct.size]) != crc:
+                self.corruptFrames += 1
+                del buffer[:1]
+                continue
+            frames.append((msgType, sequence, bytes(buffer[frameHeader.size:end - crcStruct.size])))
+            self.framesReceived += 1
+            del buffer[:end]
+        return frames
+
+
+class mcuRequest():
+    __slots__ = ('msgType', 'event', 'reply', 'sent')
+
+    def __init__(self, msgType) -> None:
+        self.msgType = msgType
+        self.event = threading.Event()
+        self.reply = None
+        self.sent = 0.0
+
+
+class mcuControl():
+
+    def __init__(self, serialPath: str, replyTimeout=0.25, motorRefresh=0.5) -> None:
+        self.lastHeartBeatMs = round(time.time() * 1000)
+        self.replyTimeout = replyTimeout  # Seconds to wait for the MCU to answer a request
+        self.motorRefresh = motorRefresh  # Seconds before unchanged duties are written again, 0 writes every setMotors()
+        try:
+            self.mcuSerial = serial.Serial(
+                port=serialPath,
+                baudrate=115200,
+                timeout=0.1 # Only bounds how long the reader thread takes to notice close()
+            )
+        except serial.SerialException:
+            logging.fatal(f'Unable to open serial port to MCU at {serialPath=} shutting down...', exc_info=True)
+            exit()
+        logging.debug(f'Opened serial port to MCU at {serialPath=}')
+
+        self.outgoing = queue.Queue()
+        self.pending = {}  # sequence -> mcuRequest
+        self.pendingLock = threading.Lock()
+        self.sequence = 0
+        self.parser = frameParser()  # Only ever touched on the reader thread
+        self.clearRequested = threading.Event()  # clearInput() asks the reader to do it
+        self.clearDone = threading.Event()
+        self.roundTrip = stageStats("mcu round trip")
+        self.running = True
+        self.unmatchedFrames = 0
+        self.timeouts = 0
+        self.onPower = None  # Called on the reader thread with every pushed power reading
+        self.powerInterval = 0.0  # Seconds between pushed readings, 0 when the MCU isn't pushing
+        self.lastPowerPush = 0.0
+        self.powerPushes = 0
+        self.lastMotors = None  # Duties last written, see setMotors()
+        self.lastMotorWrite = 0.0
+        self.motorWrites = 0
+        self.motorWritesSkipped = 0
+
+        self.writer = threading.Thread(target=self.writerLoop, name="mcu writer", daemon=True)
+        self.reader = threading.Thread(target=self.readerLoop, name="mcu reader", daemon=True)
+        self.writer.start()
+        self.reader.start()
+
+    def writerLoop(self):
+        while self.running:
+            frame = self.outgoing.get()
+            if frame is None:
+                return
+            try:
+                self.mcuSerial.write(frame)
+            except serial.SerialException:
+                logging.error(f'Writing {frame=} to the MCU failed ->', exc_info=True)
+
+    def readerLoop(self):
+        while self.running:
+            try:
+                if self.clearRequested.is_set():
+                    self.clearRequested.clear()
+                    self.mcuSerial.reset_input_buffer()
+                    self.parser.buffer.clear()
+                    self.clearDone.set()
+                data = self.mcuSerial.read(self.mcuSerial.in_waiting or 1)
+            except serial.SerialException:
+                if self.running:
+                    logging.error("Reading from the MCU failed ->", exc_info=True)
+                    time.sleep(0.1)
+                continue
+            if not data:
+                continue
+            corruptBefore = self.parser.corruptFrames
+            for msgType, sequence, payload in self.parser.feed(data):
+                self.route(msgType, sequence, payload)
+            if self.parser.corruptFrames != corruptBefore:
+                logging.warning(f'Dropped corrupt frames from the MCU, {self.parser.corruptFrames} so far')
+
+    def route(self, msgType, sequence, payload):
+        if sequence == 0 and msgType == McuMsg.POWER.value:
+            self.handlePowerPush(payload)
+            return
+        with self.pendingLock:
+            request = self.pending.get(sequence)
+            if request is not None and request.msgType.value == msgType:
+                del self.pending[sequence]
+            else:
+                request = None
+        if request is None:
+            self.unmatchedFrames += 1
+            logging.warning(f'Unexpected frame from the MCU, nothing was waiting for it {msgType=} {sequence=}')
+            return
+        self.roundTrip.add(time.perf_counter() - request.sent)
+        request.reply = payload
+        request.event.set()
+
+    def handlePowerPush(self, payload):
+        self.lastPowerPush = time.perf_counter()
+        self.powerPushes += 1
+        if self.onPower is not None:
+            self.onPower(powerStruct.unpack(payload))
+
+    def send(self, msgType: McuMsg, payload=b'', sequence=0):
+        # Queues the frame and returns straight away
+        self.outgoing.put(encodeFrame(msgType, sequence, payload))
+
+    def request(self, msgType: McuMsg, payload=b''):
+        # Sends a frame and waits for the reply. Returns the reply payload or
+        # None on timeout.
+        request = mcuRequest(msgType)
+        with self.pendingLock:
+            self.sequence = self.sequence % 255 + 1
+            sequence = self.sequence
+            self.pending[sequence] = request
+        request.sent = time.perf_counter()
+        self.send(msgType, payload, sequence)
+        if request.event.wait(self.replyTimeout):
+            return request.reply
+        with self.pendingLock:
+            self.pending.pop(sequence, None)
+        self.timeouts += 1
+        logging.warning(f'MCU did not answer {msgType} within {self.replyTimeout}s')
+        return request.reply
+
+    def heartBeat(self):
+        # Only counts the time since the last heartbeat actually sent, power
+        # polls used to keep the MCU's watchdog fed but with streaming there
+        # aren't any
+        if (round(time.time() * 1000) - self.lastHeartBeatMs) > 150:
+            if self.request(McuMsg.HEARTBEAT) is not None:
+                pass # Cool, got good data
+            else:
+                logging.warning("Possible data corruption between MCU. Heartbeat was not answered.")
+            self.lastHeartBeatMs = round(time.time() * 1000)
+        else:
+            pass
+
+    def getPower(self):
+        # (ch1 volts, ch1 mA, ch2 volts, ch2 mA, ch3 volts, ch3 mA) or None
+        payload = self.request(McuMsg.POWER)
+        if payload is None:
+            return None
+        return powerStruct.unpack(payload)
+
+    def startPowerStream(self, rate: float, onPower):
+        # Asks the MCU to push a power reading rate times a second, each one
+        # goes to onPower on the reader thread. False if the MCU didn't
+        # acknowledge (older firmware), keep polling getPower() then.
+        self.onPower = onPower
+        intervalMs = max(1, round(1000 / rate)) if rate > 0 else 0
+        if self.request(McuMsg.POWER_STREAM, streamStruct.pack(intervalMs)) is None:
+            self.powerInterval = 0.0
+            return False
+        self.powerInterval = intervalMs / 1000
+        return True
+
+    def powerStreamFresh(self):
+        # True while pushed readings keep turning up. An MCU reset turns the
+        # stream off, so this going False means poll instead.
+        return self.powerInterval > 0 and time.perf_counter() - self.lastPowerPush < self.powerInterval * 3
+
+    def setMotors(self, ma: int, mb: int):
+        # The MCU holds its duties for as long as heartbeats keep coming, so
+        # the same duties again are only written once motorRefresh has passed.
+        # That still puts them back soon after the MCU reset or timed out.
+        ma = max(-maxDuty, min(maxDuty, int(ma)))
+        mb = max(-maxDuty, min(maxDuty, int(mb)))
+        now = time.perf_counter()
+        if (ma, mb) == self.lastMotors and now - self.lastMotorWrite < self.motorRefresh:
+            self.motorWritesSkipped += 1
+            return
+        self.lastMotors = (ma, mb)
+        self.lastMotorWrite = now
+        self.motorWrites += 1
+        self.send(McuMsg.MOTORS, motorStruct.pack(ma, mb))
+
+    def resetMotors(self):
+        # Stops the motors and forgets the last duties, so the next
+        # setMotors() is written whatever it is. For a new client, which only
+        # sends once its command changes.
+        self.lastMotors = None
+        self.setMotors(0, 0)
+
+    def clearInput(self):
+        # Throws away anything the MCU sent that nobody asked for (e.g. boot messages).
+        # Done on the reader thread, it could be in the middle of parser.feed()
+        self.clearDone.clear()
+        self.clearRequested.set()
+        if not self.clearDone.wait(1.0):  # The reader notices within the serial timeout
+            logging.warning("MCU reader didn't clear its input in time")
+
+    def close(self):
+        self.running = False
+        self.outgoing.put(None)
+        self.writer.join()
+        self.reader.join()  # Notices within the serial timeout
+        self.mcuSerial.close()
@@ -1,6 +1,41 @@
-import cv2
+import struct
+
+# Fixed-layout wire formats for the two messages that go back and forth every
+# control tick. Bump the version whenever fields are added/removed/reordered
+# so a mismatched client gets an UNPACK failure instead of garbage values.
+TELEM_VERSION = 1
+COMMAND_VERSION = 1
+DELTA_VERSION = 1
+
+# wifiSignal is either a dbm reading or "Not Available". On the wire the
+# latter is sent as this value since real readings never get near it.
+WIFI_NOT_AVAILABLE = -32768
+
+telemFields = (
+    'ch1volt', 'ch2volt', 'ch3volt',
+    'ch1ma', 'ch2ma', 'ch3ma',
+    'avgVolt', 'avgMa', 'totalMa',
+    'timeLeft', 'battSize', 'voltageBatteryPercent',
+    'cpu_usage', 'ram_usage', 'cpu_temp',
+)
+
+# version, every float field above, wifiSignal
+telemStruct = struct.Struct('<B' + 'd' * len(telemFields) + 'h')
+# version, ma, mb
+commandStruct = struct.Struct('<Bhh')
+
+# telemDelta on the wire: version, flags, a bit per deltaFields entry that
+# is present, then just those values in deltaFields order
+deltaFields = telemFields + ('wifiSignal',)
+deltaHeader = struct.Struct('<BBH')
+deltaFormats = {field: 'd' for field in telemFields}
+deltaFormats['wifiSignal'] = 'h'
+DELTA_KEYFRAME = 0x01
+
 
 class telemData():
+    __slots__ = telemFields + ('wifiSignal',)
+
     def __init__(self) -> None:
         self.ch1volt = 0.0
         self.ch2volt = 0.0
@@ -19,8 +54,121 @@ class telemData():
         self.cpu_temp = 0
         self.wifiSignal = "Not Available"
 
+    def pack(self) -> bytes:
+        if isinstance(self.wifiSignal, int):
+            wifi = self.wifiSignal
+        else:
+            wifi = WIFI_NOT_AVAILABLE
+        return telemStruct.pack(
+            TELEM_VERSION,
+            self.ch1volt, self.ch2volt, self.ch3volt,
+            self.ch1ma, self.ch2ma, self.ch3ma,
+            self.avgVolt, self.avgMa, self.totalMa,
+            self.timeLeft, self.battSize, self.voltageBatteryPercent,
+            self.cpu_usage, self.ram_usage, self.cpu_temp,
+            wifi)
+
+    @classmethod
+    def unpack(cls, data):
+        (version,
+         ch1volt, ch2volt, ch3volt,
+         ch1ma, ch2ma, ch3ma,
+         avgVolt, avgMa, totalMa,
+         timeLeft, battSize, voltageBatteryPercent,
+         cpu_usage, ram_usage, cpu_temp,
+         wifi) = telemStruct.unpack(data)
+        if version != TELEM_VERSION:
+            raise ValueError(f'Unsupported telemData version {version}')
+        # Skip __init__, every field gets overwritten anyway
+        telem = cls.__new__(cls)
+        telem.ch1volt = ch1volt
+        telem.ch2volt = ch2volt
+        telem.ch3volt = ch3volt
+        telem.ch1ma = ch1ma
+        telem.ch2ma = ch2ma
+        telem.ch3ma = ch3ma
+        telem.avgVolt = avgVolt
+        telem.avgMa = avgMa
+        telem.totalMa = totalMa
+        telem.timeLeft = timeLeft
+        telem.battSize = battSize
+        telem.voltageBatteryPercent = voltageBatteryPercent
+        telem.cpu_usage = cpu_usage
+        telem.ram_usage = ram_usage
+        telem.cpu_temp = cpu_temp
+        telem.wifiSignal = "Not Available" if wifi == WIFI_NOT_AVAILABLE else wifi
+        return telem
+
 
 class commandData():
+    __slots__ = ('ma', 'mb')
+
     def __init__(self):
         self.ma = 0
-        self.mb = 0
\ No newline at end of file
+        self.mb = 0
+
+    def pack(self) -> bytes:
+        return commandStruct.pack(COMMAND_VERSION, self.ma, self.mb)
+
+    @classmethod
+    def unpack(cls, data):
+        version, ma, mb = commandStruct.unpack(data)
+        if version != COMMAND_VERSION:
+            raise ValueError(f'Unsupported commandData version {version}')
+        command = cls.__new__(cls)
+        command.ma = ma
+        command.mb = mb
+        return command
+
+
+class telemDelta():
+    # Only the telemData fields that changed, see telemPublisher.py. A
+    # keyframe carries every field.
+    __slots__ = ('keyframe', 'values')
+
+    def __init__(self, keyframe=False, values=None):
+        self.keyframe = keyframe
+        self.values = {} if values is None else values  # Field name -> value
+
+    def pack(self) -> bytes:
+        mask = 0
+        layout = '<'
+        values = []
+        for bit, field in enumerate(deltaFields):
+            if field not in self.values:
+                continue
+            value = self.values[field]
+            if field == 'wifiSignal' and not isinstance(value, int):
+                value = WIFI_NOT_AVAILABLE
+            mask |= 1 << bit
+            layout += deltaFormats[field]
+            values.append(value)
+        flags = DELTA_KEYFRAME if self.keyframe else 0
+        return deltaHeader.pack(DELTA_VERSION, flags, mask) + struct.pack(layout, *values)
+
+    @classmethod
+    def unpack(cls, data):
+        version, flags, mask = deltaHeader.unpack_from(data)
+        if version != DELTA_VERSION:
+            raise ValueError(f'Unsupported telemDelta version {version}')
+        fields = [field for bit, field in enumerate(deltaFields) if mask & (1 << bit)]
+        layout = '<' + ''.join(deltaFormats[field] for field in fields)
+        values = dict(zip(fields, struct.unpack_from(layout, data, deltaHeader.size)))
+        if values.get('wifiSignal') == WIFI_NOT_AVAILABLE:
+            values['wifiSignal'] = "Not Available"
+        return cls(bool(flags & DELTA_KEYFRAME), values)
+
+
+def mergeTelem(current, received):
+    # The telemData a client should show after receiving `received` (a
+    # telemData or telemDelta) on top of `current` (None before the first).
+    # Always a new object, the old one may still be on screen.
+    if not isinstance(received, telemDelta):
+        return received
+    merged = telemData()
+    if current is not None and not received.keyframe:
+        for field in deltaFields:
+            setattr(merged, field, getattr(current, field))
+    for field, value in received.values.items():
+        setattr(merged, field, value)
+    return merged
@@ -0,0 +1,82 @@
+import math
+import numpy as np
+
+# Fixed size history of timestamped samples (one row of channel values per
+# sample) for smoothing and trends. Every sample is written twice, at i and
+# i + capacity, so the newest n samples are always one contiguous slice and
+# queries work on views of it instead of stitching the wrap around together.
+# Appending only copies into preallocated arrays, queries cost O(window).
+
+
+class sampleRing():
+
+    def __init__(self, capacity: int, channels: int, tau=30.0) -> None:
+        self.capacity = capacity
+        self.channels = channels
+        self.tau = tau  # Seconds, time constant of the running EMA
+        self.times = np.zeros(2 * capacity)
+        self.values = np.zeros((2 * capacity, channels))
+        self.ema = np.zeros(channels)
+        self.scratch = np.zeros(channels)
+        self.next = 0  # Where the next sample goes
+        self.count = 0
+        self.lastTime = None
+
+    def append(self, timestamp, sample):
+        i = self.next
+        row = self.values[i]
+        row[:] = sample
+        self.values[i + self.capacity] = row
+        self.times[i] = timestamp
+        self.times[i + self.capacity] = timestamp
+        if self.lastTime is None:
+            self.ema[:] = row
+        else:
+            # Weighted by the time since the last sample so uneven spacing
+            # (a dropped reading, a burst) doesn't skew it
+            alpha = 1.0 - math.exp(-max(timestamp - self.lastTime, 0.0) / self.tau)
+            np.subtract(row, self.ema, out=self.scratch)
+            self.scratch *= alpha
+            self.ema += self.scratch
+        self.lastTime = timestamp
+        self.next = (i + 1) % self.capacity
+        if self.count < self.capacity:
+            self.count += 1
+
+    def latest(self, n=None):
+        # (times, values) views of the newest n samples, oldest first
+        n = self.count if n is None else min(n, self.count)
+        end = self.next + self.capacity
+        return self.times[end - n:end], self.values[end - n:end]
+
+    def window(self, seconds, now=None):
+        # (times, values) views of the samples from the last `seconds`
+        times, values = self.latest()
+        if len(times) == 0:
+            return times, values
+        cutoff = (times[-1] if now is None else now) - seconds
+        start = np.searchsorted(times, cutoff, side='left')
+        return times[start:], values[start:]
+
+    def mean(self, seconds, now=None):
+        # Per channel mean over the window, None if it's empty
+        _, values = self.window(seconds, now)
+        if len(values) == 0:
+            return None
+        return values.mean(axis=0)
+
+    def percentile(self, seconds, q, now=None):
+        # Per channel q-th percentile (0-100) over the window, None if it's empty
+        _, values = self.window(seconds, now)
+        if len(values) == 0:
+            return None
+        return np.percentile(values, q, axis=0)
+
+    def integral(self, seconds, columns, now=None):
+        # Sum of the given columns integrated over the window (trapezoids),
+        # per hour. For currents in mA that's the mAh used.
+        times, values = self.window(seconds, now)
+        if len(times) < 2:
+            return 0.0
+        total = values[:, columns].sum(axis=1)
+        return float(((total[1:] + total[:-1]) * np.diff(times)).sum()) / 2 / 3600
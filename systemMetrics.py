@@ -0,0 +1,117 @@
+import glob
+import logging
+import os
+import threading
+import time
+import psutil
+from latestslot import latestSlot
+
+# Cheap readers for system stats that don't need to fork a process, and a
+# background sampler built on them.
+
+
+def readWifiSignal(interface="wlan0"):
+    # Signal level in dbm from /proc/net/wireless, None if the interface
+    # isn't there (or we're not on Linux). Lines look like:
+    #  wlan0: 0000   54.  -56.  -256        0      0      0      0     0        0
+    try:
+        with open("/proc/net/wireless") as f:
+            for line in f:
+                name, sep, fields = line.partition(":")
+                if sep and name.strip() == interface:
+                    return int(float(fields.split()[2]))
+    except OSError:
+        return None
+    except (ValueError, IndexError):
+        logging.error(f'Unexpected /proc/net/wireless contents for {interface}', exc_info=True)
+    return None
+
+
+def findCpuThermalZone():
+    # sysfs file with the CPU temperature in millidegrees, None if there
+    # isn't one. Looked up once, reading it is then a single small file read.
+    zones = sorted(glob.glob("/sys/class/thermal/thermal_zone*"))
+    for zone in zones:
+        try:
+            with open(os.path.join(zone, "type")) as f:
+                zoneType = f.read().strip()
+        except OSError:
+            continue
+        if zoneType in ("cpu-thermal", "cpu_thermal", "x86_pkg_temp", "soc_thermal"):
+            return os.path.join(zone, "temp")
+    if zones:
+        return os.path.join(zones[0], "temp")
+    return None
+
+
+def readCpuTemp(path):
+    # Degrees C from a thermal zone file, None if it can't be read
+    try:
+        with open(path) as f:
+            return int(f.read()) / 1000
+    except (OSError, ValueError):
+        return None
+
+
+def readPsutilTemp():
+    # Slower fallback, psutil walks every hwmon device on each call
+    temps = psutil.sensors_temperatures()
+    for name in ("coretemp", "cpu_thermal", "k10temp"):
+        if name in temps:
+            return temps[name][0].current
+    return None
+
+
+class metricsSampler(threading.Thread):
+    # Samples CPU, RAM, temperature and WiFi signal on its own thread, each
+    # at its own interval, and publishes a fresh dict to `latest` after every
+    # round. Readers just peek() at it and never wait on a sample.
+
+    def __init__(self, intervals=None, interface="wlan0") -> None:
+        super().__init__(name="system metrics", daemon=True)
+        self.intervals = {'cpu': 1.0, 'ram': 5.0, 'temp': 5.0, 'wifi': 2.0}  # Seconds between samples
+        if intervals is not None:
+            self.intervals.update(intervals)
+        self.interface = interface
+        self.latest = latestSlot()
+        self.stop = threading.Event()
+        self.thermalZone = findCpuThermalZone()
+        self.values = {
+            'cpu_usage': 0,
+            'ram_usage': 0,
+            'cpu_temp': 0,
+            'wifiSignal': "Not Available",
+        }
+        psutil.cpu_percent(interval=None)  # First call only sets the baseline
+        self.latest.put(dict(self.values))
+
+    def sample(self, metric):
+        if metric == 'cpu':
+            self.values['cpu_usage'] = psutil.cpu_percent(interval=None)
+        elif metric == 'ram':
+            self.values['ram_usage'] = psutil.virtual_memory().percent
+        elif metric == 'temp':
+            if self.thermalZone is not None:
+                temp = readCpuTemp(self.thermalZone)
+            else:
+                temp = readPsutilTemp()
+            if temp is not None:
+                self.values['cpu_temp'] = temp
+        elif metric == 'wifi':
+            signal = readWifiSignal(self.interface)
+            self.values['wifiSignal'] = "Not Available" if signal is None else signal
+
+    def run(self):
+        nextDue = {metric: time.monotonic() for metric in self.intervals}
+        while not self.stop.is_set():
+            now = time.monotonic()
+            for metric, due in nextDue.items():
+                if now >= due:
+                    try:
+                        self.sample(metric)
+                    except Exception:
+                        logging.error(f'Sampling {metric} failed ->', exc_info=True)
+                    nextDue[metric] = max(due + self.intervals[metric], now)
+            # A new dict every time, readers may still hold the last one
+            self.latest.put(dict(self.values))
+            self.stop.wait(min(nextDue.values()) - time.monotonic())
@@ -0,0 +1,88 @@
+import time
+from robotTelemModule import telemData
+from robotTelemModule import telemDelta
+from robotTelemModule import deltaFields
+
+# Decides what of each telemData tick goes out as a telemDelta. Every
+# keyframeInterval seconds all fields are sent, in between only fields that
+# moved more than their deadband since they were last sent, and no field
+# more often than its interval. A value held back by either always arrives
+# with the next keyframe, so the client is never further off than that.
+# When nothing changed at all an empty delta still goes out every
+# idleInterval so the client can tell the link is alive.
+
+# Smallest change worth sending, in the field's own units. 0 sends any change.
+defaultDeadbands = {
+    'ch1volt': 0.01, 'ch2volt': 0.01, 'ch3volt': 0.01,  # About the INA3221's resolution
+    'ch1ma': 5.0, 'ch2ma': 5.0, 'ch3ma': 5.0,
+    'avgVolt': 0.01, 'avgMa': 5.0, 'totalMa': 10.0,
+    'timeLeft': 0.01, 'battSize': 0.0, 'voltageBatteryPercent': 0.1,
+    'cpu_usage': 2.0, 'ram_usage': 0.5, 'cpu_temp': 0.5,
+    'wifiSignal': 2,
+}
+# Seconds between sends of a field, 0 for every tick. The system metrics are
+# only sampled every second or more (see systemMetrics.py).
+defaultIntervals = {field: 0.0 for field in deltaFields}
+defaultIntervals.update({'cpu_usage': 1.0, 'ram_usage': 5.0, 'cpu_temp': 5.0, 'wifiSignal': 2.0})
+
+
+class telemPublisher():
+
+    def __init__(self, keyframeInterval=2.0, idleInterval=0.25, deadbands=None, intervals=None) -> None:
+        self.keyframeInterval = keyframeInterval
+        self.idleInterval = idleInterval
+        self.deadbands = dict(defaultDeadbands)
+        if deadbands is not None:
+            self.deadbands.update(deadbands)
+        self.intervals = dict(defaultIntervals)
+        if intervals is not None:
+            self.intervals.update(intervals)
+        self.keyframes = 0
+        self.deltas = 0
+        self.skipped = 0
+        self.reset()
+
+    def reset(self):
+        # Next publish() is a keyframe, for a new or reconnected client
+        self.published = {}  # Field -> value the client has
+        self.publishedAt = {}  # Field -> when it was sent
+        self.lastKeyframe = None
+        self.lastSent = 0.0
+
+    def changed(self, field, value):
+        last = self.published[field]
+        if isinstance(value, str) or isinstance(last, str):
+            return value != last  # wifiSignal can be "Not Available"
+        deadband = self.deadbands[field]
+        if deadband == 0:
+            return value != last
+        return abs(value - last) >= deadband
+
+    def publish(self, telem: telemData, now=None):
+        # The telemDelta to send for this tick, None if there's nothing to send
+        if now is None:
+            now = time.monotonic()
+        if self.lastKeyframe is None or now - self.lastKeyframe >= self.keyframeInterval:
+            values = {field: getattr(telem, field) for field in deltaFields}
+            self.published = dict(values)
+            self.publishedAt = {field: now for field in deltaFields}
+            self.lastKeyframe = now
+            self.lastSent = now
+            self.keyframes += 1
+            return telemDelta(True, values)
+
+        values = {}
+        for field in deltaFields:
+            if now - self.publishedAt[field] < self.intervals[field]:
+                continue
+            value = getattr(telem, field)
+            if self.changed(field, value):
+                values[field] = value
+                self.published[field] = value
+                self.publishedAt[field] = now
+        if not values and now - self.lastSent < self.idleInterval:
+            self.skipped += 1
+            return None
+        self.lastSent = now
+        self.deltas += 1
+        return telemDelta(False, values)
@@ -0,0 +1,261 @@
+import glob
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+from enum import Enum
+import numpy as np
+from robotTelemModule import telemData
+from robotTelemModule import commandData
+from robotTelemModule import telemFields
+from robotTelemModule import telemStruct
+from robotTelemModule import commandStruct
+
+# Append-only recording of the telemetry and commands robot-local-main
+# sends and receives. Each message kind gets its own file: a 16 byte header
+# then fixed size records, a float64 wall clock timestamp and a float64
+# time.monotonic() followed by the message exactly as pack() puts it on the
+# wire. The wall clock can step (NTP at boot on the Pi), the monotonic one
+# only goes forward within a run. A file rolls over to the next segment
+# once it would pass maxBytes, and the oldest segments in the directory are
+# deleted once they all add up to more than maxTotalBytes.
+#
+# record() is called from the control loops, so it only packs the record and
+# queues it. A thread of the recorder's own does the writing, an SD card
+# that stalls for a while holds up that thread alone. Once queueSize records
+# are waiting new ones are dropped (and counted) rather than waited for.
+#
+# openRecording() memory-maps a file as a NumPy structured array, so a
+# column across hours of runs is a view that costs nothing until it's read.
+
+class RecordKind(Enum):
+    TELEM = 1
+    COMMAND = 2
+
+RECORD_VERSION = 2  # 1 had no monotonic column, still readable
+recordMagic = b'TREXREC\0'
+recordHeader = struct.Struct('<8sHHI')  # magic, format version, RecordKind, record size
+timeStruct = struct.Struct('<dd')  # Wall clock, monotonic
+
+recordTypes = {
+    telemData: RecordKind.TELEM,
+    commandData: RecordKind.COMMAND,
+}
+# Same layout as timeStruct + telemStruct / commandStruct, no padding.
+# Format version -> RecordKind -> dtype
+timeColumns = {
+    1: [('time', '<f8')],
+    2: [('time', '<f8'), ('monotonic', '<f8')],
+}
+recordDtypes = {
+    version: {
+        RecordKind.TELEM.value: np.dtype(columns + [('version', 'u1')]
+                                         + [(field, '<f8') for field in telemFields]
+                                         + [('wifiSignal', '<i2')]),
+        RecordKind.COMMAND.value: np.dtype(columns + [('version', 'u1'), ('ma', '<i2'), ('mb', '<i2')]),
+    }
+    for version, columns in timeColumns.items()
+}
+recordSizes = {
+    RecordKind.TELEM.value: timeStruct.size + telemStruct.size,
+    RecordKind.COMMAND.value: timeStruct.size + commandStruct.size,
+}
+
+
+class recordFile():
+    # One kind of record, rolling over to a new numbered segment by size
+
+    def __init__(self, directory, prefix, kind: RecordKind, maxBytes) -> None:
+        self.directory = directory
+        self.prefix = prefix
+        self.kind = kind
+        self.maxBytes = maxBytes
+        self.segment = 0
+        self.file = None
+        self.open()
+
+    def open(self):
+        path = os.path.join(self.directory, f'{self.prefix}-{self.segment:03}.{self.kind.name.lower()}')
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(recordHeader.pack(recordMagic, RECORD_VERSION, self.kind.value, recordSizes[self.kind.value]))
+        logging.info(f'Recording {self.kind.name.lower()} to {path}')
+
+    def write(self, record):
+        # True when this started a new segment
+        rolled = self.file.tell() + len(record) > self.maxBytes
+        if rolled:
+            self.file.close()
+            self.segment += 1
+            self.open()
+        self.file.write(record)
+        return rolled
+
+    def path(self):
+        return self.file.name
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class telemetryRecorder():
+
+    def __init__(self, directory="recordings", maxBytes=64 * 1024 * 1024, flushInterval=1.0,
+                 maxTotalBytes=1024 * 1024 * 1024, queueSize=4096) -> None:
+        os.makedirs(directory, exist_ok=True)
+        prefix = time.strftime("run-%Y%m%d-%H%M%S")
+        self.directory = directory
+        self.maxTotalBytes = maxTotalBytes  # Every run's segments together, None keeps everything
+        self.segmentsDeleted = 0
+        self.files = {kind: recordFile(directory, prefix, kind, maxBytes) for kind in RecordKind}
+        self.flushInterval = flushInterval  # Seconds of records a crash can lose
+        self.lastFlush = time.monotonic()
+        self.queue = queue.Queue(maxsize=queueSize)  # (RecordKind, record), None to stop
+        self.records = 0  # Written
+        self.dropped = 0  # Queue was full
+        self.failed = False
+        self.prune()  # Anything left over from earlier runs
+        self.writer = threading.Thread(target=self.writeLoop, name="recorder", daemon=True)
+        self.writer.start()
+
+    def prune(self):
+        # Deletes the oldest segments until everything in the directory fits
+        # in maxTotalBytes. Segments being written to are never deleted.
+        if self.maxTotalBytes is None:
+            return
+        inUse = {file.path() for file in self.files.values()}
+        # Names start with the run's start time then the segment number, so they sort oldest first
+        segments = sorted(path for kind in RecordKind for path in recordingFiles(self.directory, kind))
+        sizes = {}
+        for path in segments:
+            try:
+                sizes[path] = os.path.getsize(path)
+            except OSError:
+                pass
+        total = sum(sizes.values())
+        for path in segments:
+            if total <= self.maxTotalBytes:
+                break
+            if path in inUse or path not in sizes:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                logging.error(f'Deleting old recording {path} failed ->', exc_info=True)
+                continue
+            total -= sizes[path]
+            self.segmentsDeleted += 1
+            logging.info(f'Deleted old recording {path} to stay under {self.maxTotalBytes / 1e6:.0f} MB')
+
+    def record(self, obj, timestamp=None, monotonic=None):
+        # Never blocks, the record is stamped now and written later
+        kind = recordTypes.get(type(obj))
+        if kind is None or self.failed:
+            return
+        data = timeStruct.pack(time.time() if timestamp is None else timestamp,
+                               time.monotonic() if monotonic is None else monotonic) + obj.pack()
+        try:
+            self.queue.put_nowait((kind, data))
+        except queue.Full:
+            self.dropped += 1
+
+    def writeLoop(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flushInterval)
+            except queue.Empty:
+                self.write(None)  # Nothing new, still flush what's waiting
+                continue
+            if item is None:
+                self.queue.task_done()
+                return
+            self.write(item)
+            self.queue.task_done()
+
+    def write(self, item):
+        # item is (RecordKind, record) or None to only flush
+        if self.failed:
+            return  # Still taken off the queue so close() and drain() don't wait forever
+        try:
+            if item is not None:
+                kind, data = item
+                if self.files[kind].write(data):
+                    self.prune()
+                self.records += 1
+            now = time.monotonic()
+            if now - self.lastFlush > self.flushInterval:
+                for file in self.files.values():
+                    file.flush()
+                self.lastFlush = now
+        except OSError:
+            # Most likely a full disk, the robot is more important than the recording
+            logging.error("Writing the telemetry recording failed, recording stopped ->", exc_info=True)
+            self.failed = True
+
+    def drain(self):
+        # Waits until everything recorded so far has been written
+        self.queue.join()
+
+    def close(self):
+        # Writes whatever is still queued first
+        self.queue.put(None)
+        self.writer.join()
+        for file in self.files.values():
+            file.close()
+        if self.dropped:
+            logging.warning(f'Telemetry recording dropped {self.dropped} records, writing fell behind')
+
+
+def recordingFiles(directory, kind: RecordKind):
+    # Every segment of that kind in the directory, oldest first
+    return sorted(glob.glob(os.path.join(directory, f'*.{kind.name.lower()}')))
+
+
+def openRecording(path):
+    # Memory-mapped structured array of every complete record in the file.
+    # A record cut short by a crash at the end is left out.
+    with open(path, 'rb') as f:
+        header = f.read(recordHeader.size)
+    if len(header) < recordHeader.size:
+        raise ValueError(f'{path} is too short to be a recording')
+    magic, version, kind, recordSize = recordHeader.unpack(header)
+    if magic != recordMagic or version not in recordDtypes:
+        raise ValueError(f'{path} is not a version {"/".join(str(v) for v in recordDtypes)} recording')
+    dtype = recordDtypes[version].get(kind)
+    if dtype is None or dtype.itemsize != recordSize:
+        raise ValueError(f'{path} has unknown record kind {kind} or size {recordSize}')
+    count = (os.path.getsize(path) - recordHeader.size) // recordSize
+    if count == 0:
+        return np.zeros(0, dtype)
+    return np.memmap(path, dtype, mode='r', offset=recordHeader.size, shape=(count,))
+
+
+def between(records, start, end):
+    # Records with start <= time < end. A view when the wall clock only went
+    # forward while recording, if it stepped back the times aren't sorted
+    # and the matching records are picked out (a copy) instead.
+    times = records['time']
+    if len(times) < 2 or np.all(times[1:] >= times[:-1]):
+        return records[np.searchsorted(times, start):np.searchsorted(times, end)]
+    return records[(times >= start) & (times < end)]
+
+
+def playbackTimes(records):
+    # Seconds that only go forward, for spacing records out. Monotonic when
+    # the recording has it, older ones only have the wall clock.
+    if 'monotonic' in records.dtype.names:
+        return records['monotonic']
+    return records['time']
+
+
+def toMessage(record):
+    # One record back into the telemData/commandData it came from
+    data = record.tobytes()[record.dtype.fields['version'][1]:]
+    if len(data) == telemStruct.size:
+        return telemData.unpack(data)
+    return commandData.unpack(data)
@@ -0,0 +1,91 @@
+import math
+import time
+
+
+class stageStats():
+    # Running count and timing for one stage of a pipeline or loop (camera
+    # frames, motor commands, ...).
+    # snapshot() hands back the numbers since the last snapshot.
+
+    def __init__(self, name) -> None:
+        self.name = name
+        self.count = 0
+        self.totalTime = 0.0
+        self.maxTime = 0.0
+        self.since = time.perf_counter()
+
+    def add(self, duration):
+        self.count += 1
+        self.totalTime += duration
+        if duration > self.maxTime:
+            self.maxTime = duration
+
+    def snapshot(self):
+        now = time.perf_counter()
+        elapsed = now - self.since
+        result = {
+            'name': self.name,
+            'rate': self.count / elapsed if elapsed > 0 else 0.0,
+            'avg_ms': self.totalTime / self.count * 1000 if self.count else 0.0,
+            'max_ms': self.maxTime * 1000,
+        }
+        self.count = 0
+        self.totalTime = 0.0
+        self.maxTime = 0.0
+        self.since = now
+        return result
+
+
+class latencyHistogram():
+    # Log scale histogram of durations, four buckets per power of two of
+    # microseconds so a percentile is off by 12.5% at most. add() is O(1)
+    # and allocates nothing, so it can sit on every message.
+    # snapshot() hands back the numbers since the last snapshot.
+    bucketCount = 4 * 40
+
+    def __init__(self, name) -> None:
+        self.name = name
+        self.buckets = [0] * self.bucketCount
+        self.count = 0
+        self.totalTime = 0.0
+        self.maxTime = 0.0
+
+    def add(self, duration):
+        if duration > 0:
+            mantissa, exponent = math.frexp(duration * 1e6)
+            index = min(max(exponent, 0) * 4 + int((mantissa - 0.5) * 8), self.bucketCount - 1)
+        else:
+            index = 0
+        self.buckets[index] += 1
+        self.count += 1
+        self.totalTime += duration
+        if duration > self.maxTime:
+            self.maxTime = duration
+
+    def percentile(self, q):
+        # Seconds, upper edge of the bucket the q-th percentile (0-100) falls in
+        if self.count == 0:
+            return 0.0
+        target = self.count * q / 100
+        running = 0
+        for index, count in enumerate(self.buckets):
+            running += count
+            if running >= target and count:
+                exponent, sub = divmod(index, 4)
+                return min((0.5 + (sub + 1) / 8) * 2 ** exponent / 1e6, self.maxTime)
+        return self.maxTime
+
+    def snapshot(self):
+        result = {
+            'name': self.name,
+            'count': self.count,
+            'avg_ms': self.totalTime / self.count * 1000 if self.count else 0.0,
+            'p50_ms': self.percentile(50) * 1000,
+            'p99_ms': self.percentile(99) * 1000,
+            'max_ms': self.maxTime * 1000,
+        }
+        self.buckets = [0] * self.bucketCount
+        self.count = 0
+        self.totalTime = 0.0
+        self.maxTime = 0.0
+        return result
@@ -0,0 +1,284 @@
+import logging
+import random
+import select
+import socket
+import struct
+import time
+from networkmodule import FailureType
+from networkmodule import encodeMessage
+from networkmodule import decodeMessage
+from networkmodule import TrafficClass
+from networkmodule import tuneSocket
+
+# Datagram transport for the camera stream. A lost TCP segment stalls every
+# frame behind it until it's retransmitted, over UDP a lost fragment only
+# costs the frame it belongs to and the viewer just moves on to the next one.
+#
+# Each frame is serialized the same way robotNetworkModule does it, then cut
+# into fragments that fit in one datagram, each prefixed with the sender's
+# session, the frame ID, the fragment index, how many data fragments the
+# frame has and its length in bytes. The session is random per sender, so a
+# restarted sender counting frame IDs from 1 again is told apart from late
+# datagrams. Viewers subscribe by sending SUBSCRIBE to the sender every so
+# often and can ask for a fresh full frame with KEYFRAME when they know they
+# missed something.
+#
+# After the data fragments come parity fragments (indexes from the fragment
+# count up), each the XOR of one group of up to parityGroup data fragments.
+# A group that lost a single fragment gets it back from the others, so one
+# lost datagram no longer costs the whole frame. Groups are interleaved
+# (fragment i is in group i % groups) so a short burst of losses lands in
+# different groups.
+
+fragmentStruct = struct.Struct('<IIHHI')  # session, frameID, fragment index, data fragment count, frame length
+maxDatagram = 1400  # Stays under a 1500 byte Ethernet/WiFi MTU with IP/UDP headers
+maxFragmentPayload = maxDatagram - fragmentStruct.size
+parityGroup = 8  # Data fragments per parity fragment, 12.5% more to send. 0 sends none
+
+SUBSCRIBE = b'subscribe'
+KEYFRAME = b'keyframe'
+subscriptionTimeout = 5.0  # Seconds without a SUBSCRIBE before a viewer is dropped
+subscribeInterval = 1.0
+
+
+def parityGroups(count):
+    if parityGroup <= 0:
+        return 0
+    return -(-count // parityGroup)
+
+
+def xorFragments(fragments):
+    # XOR of the fragments, the shorter (last) one padded with zeros
+    result = 0
+    for fragment in fragments:
+        result ^= int.from_bytes(fragment, 'little')
+    return result.to_bytes(maxFragmentPayload, 'little')
+
+
+class udpFrameSender():
+
+    def __init__(self, address, port, onKeyframeRequest=None, trafficClass: TrafficClass = None) -> None:
+        self.address = address
+        self.port = port
+        self.onKeyframeRequest = onKeyframeRequest
+        self.subscribers = {}  # address -> time of last SUBSCRIBE
+        self.session = random.getrandbits(32)
+        self.frameID = 0
+        self.framesSent = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if trafficClass is not None:
+            tuneSocket(self.sock, trafficClass)
+        self.sock.bind((address, port))
+        self.sock.setblocking(False)
+        self.port = self.sock.getsockname()[1]
+        logging.info(f'UDP frame sender is listening for viewers on {address}:{self.port}...')
+
+    def hasSubscribers(self):
+        return len(self.subscribers) > 0
+
+    def poll(self):
+        # Handle any waiting SUBSCRIBE/KEYFRAME datagrams and expire viewers
+        # that went quiet. Never blocks.
+        now = time.monotonic()
+        while True:
+            try:
+                data, address = self.sock.recvfrom(64)
+            except (BlockingIOError, InterruptedError):
+                break
+            except ConnectionResetError:
+                # Windows reports ICMP port unreachable from an earlier send this way
+                continue
+            if data == SUBSCRIBE:
+                if address not in self.subscribers:
+                    logging.info(f'UDP viewer {address} subscribed.')
+                self.subscribers[address] = now
+            elif data == KEYFRAME:
+                self.subscribers[address] = now
+                if self.onKeyframeRequest is not None:
+                    self.onKeyframeRequest()
+        for address, lastSeen in list(self.subscribers.items()):
+            if now - lastSeen > subscriptionTimeout:
+                logging.info(f'UDP viewer {address} timed out.')
+                del self.subscribers[address]
+
+    def sendFrame(self, ObjToSend):
+        self.poll()
+        if not self.subscribers:
+            return FailureType.NONE
+        message = memoryview(b''.join(encodeMessage(ObjToSend)))
+        fragmentCount = -(-len(message) // maxFragmentPayload)
+        groups = parityGroups(fragmentCount)
+        if fragmentCount + groups > 0xFFFF:
+            logging.error(f'Frame of {len(message)} bytes is too big to fragment.')
+            return FailureType.UNPACK
+        self.frameID = (self.frameID + 1) & 0xFFFFFFFF
+        fragments = [message[index * maxFragmentPayload:(index + 1) * maxFragmentPayload] for index in range(fragmentCount)]
+        for group in range(groups):
+            fragments.append(xorFragments(fragments[group:fragmentCount:groups]))
+        for index, fragment in enumerate(fragments):
+            header = fragmentStruct.pack(self.session, self.frameID, index, fragmentCount, len(message))
+            for address in self.subscribers:
+                try:
+                    self.sock.sendto(header + fragment, address)
+                except (BlockingIOError, InterruptedError):
+                    pass  # Send buffer full, same as losing it on the air
+                except socket.error:
+                    logging.error(f'Sending fragment to {address} failed ->', exc_info=True)
+        self.framesSent += 1
+        return FailureType.NONE
+
+    def close(self):
+        self.sock.close()
+
+
+class partialFrame():
+    # The fragments of one frame received so far, data then parity
+
+    __slots__ = ('count', 'length', 'groups', 'fragments', 'received')
+
+    def __init__(self, count, length) -> None:
+        self.count = count
+        self.length = length
+        self.groups = parityGroups(count)
+        self.fragments = [None] * (count + self.groups)
+        self.received = 0  # Data fragments we have, received or recovered
+
+    def add(self, index, payload):
+        # False if we already had it
+        if self.fragments[index] is not None:
+            return False
+        self.fragments[index] = payload
+        if index < self.count:
+            self.received += 1
+        return True
+
+    def recover(self, group):
+        # Rebuilds the group's data fragment from its parity and the others
+        # when exactly one is missing
+        members = range(group, self.count, self.groups)
+        missing = [index for index in members if self.fragments[index] is None]
+        parity = self.fragments[self.count + group]
+        if len(missing) != 1 or parity is None:
+            return False
+        index = missing[0]
+        rebuilt = xorFragments([parity] + [self.fragments[other] for other in members if other != index])
+        self.fragments[index] = rebuilt[:min(maxFragmentPayload, self.length - index * maxFragmentPayload)]
+        self.received += 1
+        return True
+
+    def complete(self):
+        return self.received == self.count
+
+    def message(self):
+        return b''.join(self.fragments[:self.count])
+
+
+class udpFrameReceiver():
+
+    def __init__(self, address, port, maxInFlight=4) -> None:
+        self.serverAddress = (address, port)
+        self.maxInFlight = maxInFlight  # Partial frames kept around waiting for fragments
+        self.partial = {}  # frameID -> partialFrame
+        self.session = None  # Sender session the frame IDs belong to
+        self.lastDelivered = None
+        self.lastSubscribe = 0.0
+        # True when frames were lost between the last delivered frame and
+        # this one, so anything that builds on earlier frames is stale
+        self.missedFrames = False
+        self.framesDelivered = 0
+        self.framesDropped = 0  # Incomplete frames given up on
+        self.fragmentsLate = 0  # Fragments for frames we'd already moved past
+        self.fragmentsBad = 0  # Fragments with an index, count or length that doesn't fit their frame
+        self.fragmentsRecovered = 0  # Lost data fragments rebuilt from parity
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        self.sock.bind(("0.0.0.0", 0))
+        self.subscribe()
+
+    def subscribe(self):
+        self.sock.sendto(SUBSCRIBE, self.serverAddress)
+        self.lastSubscribe = time.monotonic()
+
+    def requestKeyframe(self):
+        self.sock.sendto(KEYFRAME, self.serverAddress)
+
+    def receiveFrame(self, timeout=5.0):
+        # Next complete frame, or CON_TIMEOUT if none turned up in time
+        deadline = time.monotonic() + timeout
+        while True:
+            now = time.monotonic()
+            if now - self.lastSubscribe > subscribeInterval:
+                self.subscribe()
+            remaining = min(deadline - now, subscribeInterval)
+            if deadline - now <= 0:
+                return FailureType.CON_TIMEOUT
+            ready, _, _ = select.select([self.sock], [], [], remaining)
+            if not ready:
+                continue
+            try:
+                datagram = self.sock.recv(maxDatagram)
+            except ConnectionResetError:
+                continue  # ICMP unreachable from before the sender was up
+            result = self.ingest(datagram)
+            if result is not None:
+                return result
+
+    def ingest(self, datagram):
+        # Takes one datagram, returns the decoded frame once one completes
+        if len(datagram) < fragmentStruct.size:
+            return None
+        session, frameID, index, count, length = fragmentStruct.unpack_from(datagram)
+        if session != self.session:
+            # New sender (or the first one), its frame IDs start over
+            if self.session is not None:
+                logging.info(f'UDP sender session changed from {self.session:#x} to {session:#x}, sender restarted.')
+            self.session = session
+            self.lastDelivered = None
+            self.partial.clear()
+        if self.lastDelivered is not None and frameID <= self.lastDelivered:
+            if frameID != self.lastDelivered or index < count:
+                self.fragmentsLate += 1  # Parity for a frame that completed without it is expected
+            return None
+        if index >= count + parityGroups(count) or -(-length // maxFragmentPayload) != count:
+            self.fragmentsBad += 1
+            return None
+
+        entry = self.partial.get(frameID)
+        if entry is None:
+            if len(self.partial) >= self.maxInFlight:
+                oldest = min(self.partial)
+                del self.partial[oldest]
+                self.framesDropped += 1
+            entry = partialFrame(count, length)
+            self.partial[frameID] = entry
+        elif entry.count != count or entry.length != length:
+            # Disagrees with the frame's first fragment, corrupted or not ours
+            self.fragmentsBad += 1
+            return None
+        if not entry.add(index, datagram[fragmentStruct.size:]):
+            return None  # Duplicate
+        if not entry.complete() and entry.groups:
+            group = index % entry.groups if index < count else index - count
+            if entry.recover(group):
+                self.fragmentsRecovered += 1
+        if not entry.complete():
+            return None
+
+        # Complete. Anything older that's still incomplete will never be shown.
+        for stale in [staleID for staleID in self.partial if staleID <= frameID]:
+            if stale != frameID:
+                self.framesDropped += 1
+            del self.partial[stale]
+        self.missedFrames = self.lastDelivered is not None and frameID != self.lastDelivered + 1
+        self.lastDelivered = frameID
+        try:
+            frame = decodeMessage(entry.message())
+        except (ValueError, struct.error):
+            logging.error(f'Decoding UDP frame {frameID} has failed. This indicates corrupted/bad data.', exc_info=True)
+            return FailureType.UNPACK
+        self.framesDelivered += 1
+        return frame
+
+    def close(self):
+        self.sock.close()